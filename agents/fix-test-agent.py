@@ -2,7 +2,8 @@
 import subprocess
 import sys
 
-from gptdiff import generate_diff, smartapply, load_project_files, build_environment, save_files
+from gptdiff import generate_diff, smartapply, apply_diff_to_files, load_project_files, build_environment, save_files
+from gptdiff.applydiff import PatchSet
 
 
 def run_tests():
@@ -35,8 +36,11 @@ def main():
             # Generate a diff using GPTDiff API based on the failing test output
             diff = generate_diff(env, prompt, model="o3-mini")
 
-            # Apply the generated diff using smartapply to get updated file contents
-            updated_files = smartapply(diff, files, model="o3-mini")
+            # Apply what matches exactly in memory; only the rest goes to smartapply
+            updated_files, report = apply_diff_to_files(diff, files)
+            failed = PatchSet(result.patch for result in report.values() if not result.ok)
+            if failed:
+                updated_files = smartapply(failed, updated_files, model="o3-mini")
 
             # Save the updated files back to the project directory
             save_files(updated_files, ".")
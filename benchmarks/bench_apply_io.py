@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Benchmark: bytes read per applied patch by apply_diff.
+
+Builds a directory of large generated files and a diff that changes one line
+near the top of each, then measures the bytes the process reads (rchar from
+/proc/self/io) and the wall time for
+
+- the previous change detection, which hashed every target before patching
+  and re-read and re-hashed it afterward (emulated below around apply_diff),
+- the current apply_diff, which reads each file once and decides whether it
+  changed by comparing old and new lines in memory.
+
+Usage:
+    python benchmarks/bench_apply_io.py [--files 4] [--mb 50]
+"""
+
+import argparse
+import hashlib
+import tempfile
+import time
+from pathlib import Path
+
+from gptdiff.applydiff import apply_diff
+
+
+def bytes_read():
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def make_tree(root, files, mb):
+    line = "generated_value = compute(%08d)  # padding padding padding\n"
+    count = mb * 1024 * 1024 // len(line % 0)
+    body = "".join(line % i for i in range(count))
+    for f in range(files):
+        (root / f"gen_{f}.py").write_text(body)
+    return count
+
+
+def make_diff(files):
+    parts = []
+    for f in range(files):
+        parts += [f"--- a/gen_{f}.py", f"+++ b/gen_{f}.py", "@@ -2,3 +2,3 @@",
+                  " generated_value = compute(00000001)  # padding padding padding",
+                  "-generated_value = compute(00000002)  # padding padding padding",
+                  "+generated_value = compute_fast(00000002)  # padding padding padding",
+                  " generated_value = compute(00000003)  # padding padding padding"]
+    return "\n".join(parts) + "\n"
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        h.update(f.read())
+    return h.hexdigest()
+
+
+def previous_apply(project_dir, diff_text, paths):
+    # What apply_diff used to do around the patching itself.
+    before = {path: file_hash(path) for path in paths}
+    result = apply_diff(project_dir, diff_text)
+    return result and any(file_hash(path) != before[path] for path in paths)
+
+
+def measure(label, run, total_bytes, files):
+    start_read, start = bytes_read(), time.perf_counter()
+    assert run()
+    elapsed = time.perf_counter() - start
+    end_read = bytes_read()
+    if start_read is None:
+        print(f"{label:<10} {'n/a':>14} {elapsed:>8.2f}s")
+        return
+    read = end_read - start_read
+    print(f"{label:<10} {read / files / 2**20:>11.1f} MB {elapsed:>8.2f}s   ({read / total_bytes:.1f}x the tree)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--mb", type=int, default=50, help="size of each file")
+    args = parser.parse_args()
+
+    diff_text = make_diff(args.files)
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        lines = make_tree(root, args.files, args.mb)
+        paths = sorted(root.glob("gen_*.py"))
+        total = sum(path.stat().st_size for path in paths)
+        print(f"{args.files} files x {args.mb} MB ({lines} lines each), one hunk per file")
+        print(f"{'mode':<10} {'read per file':>14} {'time':>9}")
+        measure("previous", lambda: previous_apply(tmp, diff_text, paths), total, args.files)
+        # Put the tree back before measuring again.
+        make_tree(root, args.files, args.mb)
+        measure("current", lambda: apply_diff(tmp, diff_text), total, args.files)
+
+
+if __name__ == "__main__":
+    main()
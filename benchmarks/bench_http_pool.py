@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Benchmark: shared keep-alive LLM clients vs. a new client per call.
+
+Starts a local HTTPS server with a throwaway self-signed certificate (needs the
+`openssl` command), sends chat completion requests from several threads the
+way smartapply does, and reports wall time and TLS connections accepted.
+
+Usage:
+    python benchmarks/bench_http_pool.py [--requests 60] [--threads 12] [--latency 0.01]
+"""
+
+import argparse
+import json
+import os
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from gptdiff import transport
+
+COMPLETION = json.dumps({
+    "id": "cmpl-1", "object": "chat.completion", "created": 0, "model": "bench",
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}, "finish_reason": "stop"}],
+    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+}).encode()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    connections = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with Handler.lock:
+            Handler.connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(COMPLETION)))
+        self.end_headers()
+        self.wfile.write(COMPLETION)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_certificate(directory):
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+         "-keyout", key, "-out", cert],
+        check=True, capture_output=True,
+    )
+    return cert, key
+
+
+def run(label, make_client, base_url, requests, threads):
+    Handler.connections = 0
+    messages = [{"role": "user", "content": "hi"}]
+
+    def one(_):
+        client = make_client()
+        client.chat.completions.create(model="bench", messages=messages, max_tokens=1, temperature=0.0)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(one, range(requests)))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<22} {elapsed * 1000:8.1f} ms  {Handler.connections:4d} TLS connections")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=60)
+    parser.add_argument("--threads", type=int, default=12)
+    parser.add_argument("--latency", type=float, default=0.01, help="Simulated server time per request (s)")
+    args = parser.parse_args()
+    Handler.latency = args.latency
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cert, key = make_certificate(tmp)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        os.environ["SSL_CERT_FILE"] = cert
+        base_url = f"https://127.0.0.1:{server.server_address[1]}/v1/"
+
+        def fresh_client():
+            # What call_llm did before: a new client (and connection pool) per call.
+            from openai import OpenAI
+            httpx = transport._httpx()
+            return OpenAI(api_key="bench", base_url=base_url, max_retries=0,
+                          http_client=httpx.Client(verify=transport._verify()))
+
+        try:
+            print(f"{args.requests} requests on {args.threads} threads, {args.latency * 1000:.0f} ms server latency")
+            run("new client per call", fresh_client, base_url, args.requests, args.threads)
+            run("shared client", lambda: transport.get_openai_client(base_url, "bench"),
+                base_url, args.requests, args.threads)
+        finally:
+            transport.close_clients()
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
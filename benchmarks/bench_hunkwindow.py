@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Benchmark: windowed smartapply vs. whole-file smartapply.
+
+Builds a synthetic module, a small patch whose context has drifted (so it
+cannot be applied exactly), and reports the characters that would be sent to
+and returned by the model for each mode. Output characters are what dominate
+smartapply latency. No LLM is called.
+
+Usage:
+    python benchmarks/bench_hunkwindow.py [--lines 4000] [--hunks 1]
+"""
+
+import argparse
+
+from gptdiff.gptdiff import _apply_messages, _apply_window_messages
+from gptdiff.hunkwindow import plan_windows
+
+
+def make_file(lines):
+    return "".join(f"    value_{i} = compute({i})  # line {i}\n" for i in range(lines))
+
+
+def make_patch(lines, hunks):
+    parts = ["--- a/module.py", "+++ b/module.py"]
+    for h in range(hunks):
+        i = (h + 1) * lines // (hunks + 1)
+        parts += [
+            f"@@ -{i},3 +{i},3 @@",
+            f"     value_{i - 1} = compute({i - 1})  # line {i - 1}",
+            f"-    value_{i} = compute({i})  # stale",
+            f"+    value_{i} = compute_fast({i})  # line {i}",
+            f"     value_{i + 1} = compute({i + 1})  # line {i + 1}",
+        ]
+    return "\n".join(parts)
+
+
+def chars(messages):
+    return sum(len(m["content"]) for m in messages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lines", type=int, default=4000)
+    parser.add_argument("--hunks", type=int, default=1)
+    args = parser.parse_args()
+
+    original = make_file(args.lines)
+    patch = make_patch(args.lines, args.hunks)
+    lines = original.splitlines(keepends=True)
+
+    whole_in = chars(_apply_messages("module.py", original, patch, "model"))
+    whole_out = len(original)
+    windows = plan_windows(original, patch)
+    if windows is None:
+        print("patch cannot be windowed")
+        return
+    window_in = window_out = 0
+    for window in windows:
+        excerpt = "".join(lines[window.start:window.end])
+        window_in += chars(_apply_window_messages("module.py", excerpt, window, len(lines), "model"))
+        window_out += len(excerpt)
+
+    print(f"{args.lines} lines, {args.hunks} hunk(s), {len(windows)} window(s)")
+    print(f"{'mode':<12} {'sent':>10} {'returned':>10}")
+    print(f"{'whole file':<12} {whole_in:>10} {whole_out:>10}")
+    print(f"{'windowed':<12} {window_in:>10} {window_out:>10}")
+    print(f"output reduced {whole_out / window_out:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Benchmark: compiled IgnoreMatcher vs. the previous per-pattern fnmatch scan.
+
+Generates a synthetic path list and a .gitignore-sized pattern list, then
+reports paths/sec for both implementations.
+
+Usage:
+    python benchmarks/bench_ignore.py [--paths 20000] [--patterns 300]
+"""
+
+import argparse
+import fnmatch
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from gptdiff.ignore import IgnoreMatcher
+
+
+def legacy_is_ignored(filepath, gitignore_patterns):
+    """The is_ignored implementation used before IgnoreMatcher."""
+    filepath = Path(filepath).resolve()
+    ignored = False
+
+    for pattern in gitignore_patterns:
+        if pattern.startswith('!'):
+            negated_pattern = pattern[1:]
+            if fnmatch.fnmatch(str(filepath), negated_pattern) or fnmatch.fnmatch(str(filepath.relative_to(Path.cwd())), negated_pattern):
+                ignored = False
+        else:
+            relative_path = str(filepath.relative_to(Path.cwd()))
+            if fnmatch.fnmatch(str(filepath), pattern) or fnmatch.fnmatch(relative_path, pattern):
+                ignored = True
+                break
+            if pattern in relative_path:
+                ignored = True
+                break
+
+    if filepath.name == ".gitignore" and not any(pattern == ".gitignore" for pattern in gitignore_patterns):
+        ignored = False
+
+    return ignored
+
+
+def make_patterns(count, rng):
+    patterns = ["node_modules/", "build/", "dist/", "*.pyc", ".*", "!.gitkeep"]
+    while len(patterns) < count:
+        kind = rng.randrange(4)
+        word = f"gen{len(patterns)}"
+        if kind == 0:
+            patterns.append(f"*.{word}")
+        elif kind == 1:
+            patterns.append(f"{word}/")
+        elif kind == 2:
+            patterns.append(f"/src/{word}/*.py")
+        else:
+            patterns.append(f"**/{word}/**")
+    return patterns
+
+
+def make_paths(count, rng):
+    dirs = ["src", "src/app", "src/lib/util", "tests", "docs", "web/components", "tools/scripts"]
+    exts = ["py", "js", "md", "txt", "pyc", "json"]
+    return [f"{rng.choice(dirs)}/file{i}.{rng.choice(exts)}" for i in range(count)]
+
+
+def rate(fn, paths):
+    start = time.perf_counter()
+    for path in paths:
+        fn(path)
+    elapsed = time.perf_counter() - start
+    return len(paths) / elapsed if elapsed else float("inf")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--paths", type=int, default=20000)
+    parser.add_argument("--patterns", type=int, default=300)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    patterns = make_patterns(args.patterns, rng)
+    paths = make_paths(args.paths, rng)
+
+    with tempfile.TemporaryDirectory() as root:
+        cwd = os.getcwd()
+        os.chdir(root)
+        try:
+            # The legacy implementation is much slower; time a sample of the paths.
+            legacy_sample = paths[: max(1, len(paths) // 20)]
+            legacy = rate(lambda p: legacy_is_ignored(p, patterns), legacy_sample)
+            start = time.perf_counter()
+            matcher = IgnoreMatcher(root, patterns)
+            compile_ms = (time.perf_counter() - start) * 1000
+            compiled = rate(lambda p: matcher.is_ignored(p, is_dir=False), paths)
+        finally:
+            os.chdir(cwd)
+
+    print(f"{len(patterns)} patterns, {len(paths)} paths")
+    print(f"legacy is_ignored:  {legacy:12,.0f} paths/sec")
+    print(f"IgnoreMatcher:      {compiled:12,.0f} paths/sec (compiled in {compile_ms:.1f} ms)")
+    print(f"speedup:            {compiled / legacy:12.1f}x")
+
+
+if __name__ == "__main__":
+    main()
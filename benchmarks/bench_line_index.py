@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Benchmark: relocating hunks in a huge file with LineIndex vs. a linear scan.
+
+Builds a synthetic generated file and a patch whose hunk headers are far from
+where their lines really are, in random directions (as when code has been
+moved around since the diff was made). Every other hunk was made against a
+reindented copy, so it only matches with whitespace ignored. Times
+apply_patch_to_lines against the position-by-position scan it replaced.
+
+Usage:
+    python benchmarks/bench_line_index.py [--lines 500000] [--hunks 50] [--drift 100000]
+"""
+
+import argparse
+import random
+import time
+
+from gptdiff.applydiff import apply_patch_to_lines, split_hunks
+
+
+def make_lines(count):
+    # Repeating lines make many partial matches, as in generated code.
+    return [f"    table[{i}] = {i % 97}  # {i % 7}\n" for i in range(count)]
+
+
+def make_patch(lines, hunks, drift, seed=0):
+    rng = random.Random(seed)
+    parts = ["--- a/generated.py", "+++ b/generated.py"]
+    for h in range(hunks):
+        i = (h + 1) * len(lines) // (hunks + 1)
+        header_line = min(max(1, i + 1 + rng.randint(-drift, drift)), len(lines))
+        old = [line.rstrip("\n") for line in lines[i - 1:i + 2]]
+        if h % 2:
+            old = [line.replace("    ", "  ") for line in old]
+        parts += [
+            f"@@ -{header_line},3 +{header_line},3 @@",
+            " " + old[0],
+            "-" + old[1],
+            "+" + old[1].replace("table", "TABLE"),
+            " " + old[2],
+        ]
+    return "\n".join(parts)
+
+
+def scan_apply(original_lines, patch):
+    """The old search: try each position outward from the header, exactly and then ignoring whitespace."""
+    exact = [line.rstrip("\n") for line in original_lines]
+    loose = [" ".join(line.split()) for line in original_lines]
+    new_lines = []
+    current = 0
+    for hunk in split_hunks(patch):
+        old = hunk.old_lines
+        upper = len(exact) - len(old)
+        desired = min(max(hunk.hint, current), upper)
+        pos = None
+        for keys, block in ((exact, old), (loose, [" ".join(line.split()) for line in old])):
+            for distance in range(upper - current + 1):
+                for candidate in (desired + distance, desired - distance):
+                    if current <= candidate <= upper and keys[candidate:candidate + len(block)] == block:
+                        pos = candidate
+                        break
+                if pos is not None:
+                    break
+            if pos is not None:
+                break
+        new_lines.extend(original_lines[current:pos])
+        current = pos
+        for op, text in hunk.ops:
+            if op == " ":
+                new_lines.append(original_lines[current])
+                current += 1
+            elif op == "-":
+                current += 1
+            else:
+                new_lines.append(text + "\n")
+    new_lines.extend(original_lines[current:])
+    return new_lines
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lines", type=int, default=500000)
+    parser.add_argument("--hunks", type=int, default=50)
+    parser.add_argument("--drift", type=int, default=100000)
+    args = parser.parse_args()
+
+    lines = make_lines(args.lines)
+    patch = make_patch(lines, args.hunks, args.drift)
+
+    indexed, indexed_time = timed(apply_patch_to_lines, lines, patch, 0)
+    scanned, scan_time = timed(scan_apply, lines, patch)
+    assert indexed == scanned
+
+    print(f"{args.lines} lines, {args.hunks} hunk(s), headers off by up to {args.drift} lines")
+    print(f"{'method':<12} {'seconds':>10}")
+    print(f"{'scan':<12} {scan_time:>10.3f}")
+    print(f"{'LineIndex':<12} {indexed_time:>10.3f}")
+    print(f"speedup {scan_time / indexed_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
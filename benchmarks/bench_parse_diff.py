@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Benchmark: single-pass parse_diff_per_file vs. the previous two-pass parser.
+
+Builds a synthetic git diff touching many files and reports parse time and
+peak memory for the previous parser (kept below for comparison), the
+current parse_diff_per_file, and for a diff on disk, reading it whole and
+parsing vs. iter_file_patches streaming it, including how soon the first
+file patch is available.
+
+Usage:
+    python benchmarks/bench_parse_diff.py [--files 10000] [--hunks 4] [--lines 12]
+"""
+
+import argparse
+import os
+import re
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+from gptdiff.applydiff import iter_file_patches, parse_diff_per_file
+
+
+def make_diff(files, hunks, lines):
+    parts = []
+    for f in range(files):
+        path = f"pkg{f % 100}/module_{f}.py"
+        parts += [f"diff --git a/{path} b/{path}", "index 1111111..2222222 100644",
+                  f"--- a/{path}", f"+++ b/{path}"]
+        for h in range(hunks):
+            start = h * 100 + 1
+            parts.append(f"@@ -{start},{lines} +{start},{lines} @@")
+            for i in range(lines):
+                if i == lines // 2:
+                    parts += [f"-    value = old_{h}_{i}()", f"+    value = new_{h}_{i}()"]
+                else:
+                    parts.append(f"     line_{h}_{i} = {i}")
+    return "\n".join(parts) + "\n"
+
+
+def previous_parse(diff_text):
+    """The git-header path of the previous parse_diff_per_file."""
+    header_re = re.compile(r'^(?:diff --git\s+)?(a/[^ ]+)\s+(b/[^ ]+)\s*$', re.MULTILINE)
+    lines = diff_text.splitlines()
+    if not any(header_re.match(line) for line in lines):
+        raise ValueError("benchmark diff must have git headers")
+    diffs = []
+    current_lines = []
+    current_file = None
+    deletion_mode = False
+    for line in lines:
+        m = header_re.match(line)
+        if m:
+            if current_file is not None and current_lines:
+                if deletion_mode and not any(l.startswith("+++ ") for l in current_lines):
+                    current_lines.append("+++ /dev/null")
+                diffs.append((current_file, "\n".join(current_lines)))
+            current_lines = [line]
+            deletion_mode = False
+            file_to = m.group(2)
+            current_file = file_to[2:] if file_to.startswith("b/") else file_to
+        else:
+            current_lines.append(line)
+            if "deleted file mode" in line:
+                deletion_mode = True
+            if line.startswith("+++ "):
+                parts = line.split()
+                if len(parts) >= 2:
+                    file_to = parts[1].strip()
+                    if file_to != "/dev/null":
+                        current_file = file_to[2:] if (file_to.startswith("a/") or file_to.startswith("b/")) else file_to
+    if current_file is not None and current_lines:
+        if deletion_mode and not any(l.startswith("+++ ") for l in current_lines):
+            current_lines.append("+++ /dev/null")
+        diffs.append((current_file, "\n".join(current_lines)))
+    groups = defaultdict(list)
+    for key, value in diffs:
+        groups[key].append(value)
+    return [[key, "\n".join(values)] for key, values in groups.items()]
+
+
+def measure(fn, *args):
+    """Return fn's result, its run time, and its peak memory (from a second, traced run)."""
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    fn(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def read_and_parse(path):
+    with open(path, encoding="utf8") as f:
+        return len(previous_parse(f.read()))
+
+
+def stream_from_file(path):
+    first = None
+    start = time.perf_counter()
+    count = 0
+    with open(path, encoding="utf8") as f:
+        for _ in iter_file_patches(f):
+            if first is None:
+                first = time.perf_counter() - start
+            count += 1
+    return count, first
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=10000)
+    parser.add_argument("--hunks", type=int, default=4)
+    parser.add_argument("--lines", type=int, default=12)
+    args = parser.parse_args()
+
+    diff_text = make_diff(args.files, args.hunks, args.lines)
+    with tempfile.NamedTemporaryFile("w", suffix=".diff", delete=False, encoding="utf8") as f:
+        f.write(diff_text)
+    try:
+        previous, previous_time, previous_peak = measure(previous_parse, diff_text)
+        current, current_time, current_peak = measure(parse_diff_per_file, diff_text)
+        _, read_time, read_peak = measure(read_and_parse, f.name)
+        (count, first), stream_time, stream_peak = measure(stream_from_file, f.name)
+    finally:
+        os.unlink(f.name)
+    assert previous == current and count == args.files
+
+    mib = 1024 * 1024
+    print(f"{args.files} files, {len(diff_text) / mib:.1f} MiB of diff")
+    print(f"{'parser':<28} {'seconds':>8} {'peak MiB':>9}")
+    print(f"{'previous (two pass)':<28} {previous_time:>8.3f} {previous_peak / mib:>9.2f}")
+    print(f"{'parse_diff_per_file':<28} {current_time:>8.3f} {current_peak / mib:>9.2f}")
+    print(f"{'read file + previous':<28} {read_time:>8.3f} {read_peak / mib:>9.2f}")
+    print(f"{'iter_file_patches(file)':<28} {stream_time:>8.3f} {stream_peak / mib:>9.2f}")
+    print(f"first file patch from the file after {first * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Benchmark: streaming apply vs. in-memory apply on a large file.
+
+Writes a generated file, then patches it with a few hunks spread through it,
+once by reading it whole (apply_patch_to_lines, as apply_diff does for
+ordinary files) and once with apply_patch_to_stream. Reports wall time and
+peak Python memory (tracemalloc) for each.
+
+Usage:
+    python benchmarks/bench_stream_apply.py [--mb 200] [--hunks 20]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from gptdiff.applydiff import apply_patch_to_lines, apply_patch_to_stream
+
+LINE = "fixture_value = compute(%09d)  # padding padding padding\n"
+
+
+def make_file(path, mb):
+    count = mb * 2**20 // len(LINE % 0)
+    with open(path, "w") as f:
+        for start in range(0, count, 100000):
+            f.write("".join(LINE % i for i in range(start, min(start + 100000, count))))
+    return count
+
+
+def make_patch(lines, hunks):
+    parts = []
+    for h in range(hunks):
+        i = (h + 1) * lines // (hunks + 1)
+        parts += [f"@@ -{i},3 +{i},3 @@", " " + (LINE % (i - 1)).rstrip("\n"),
+                  "-" + (LINE % i).rstrip("\n"), f"+fixture_value = compute_fast({i:09d})",
+                  " " + (LINE % (i + 1)).rstrip("\n")]
+    return "\n".join(parts)
+
+
+def in_memory(source, dest, patch):
+    with open(source, encoding="utf8") as f:
+        new_lines = apply_patch_to_lines(f.read().splitlines(keepends=True), patch)
+    with open(dest, "w", encoding="utf8") as f:
+        f.writelines(new_lines)
+
+
+def streaming(source, dest, patch):
+    with open(source, "rb") as src, open(dest, "wb") as out:
+        apply_patch_to_stream(src, out, patch)
+
+
+def measure(label, run, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    run(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{label:<10} {elapsed:>8.2f}s {peak / 2**20:>10.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mb", type=int, default=200)
+    parser.add_argument("--hunks", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "fixture.py")
+        lines = make_file(source, args.mb)
+        patch = make_patch(lines, args.hunks)
+        print(f"{args.mb} MB file ({lines} lines), {args.hunks} hunks")
+        print(f"{'mode':<10} {'time':>9} {'peak memory':>13}")
+        measure("in memory", in_memory, source, os.path.join(tmp, "a.py"), patch)
+        measure("streaming", streaming, source, os.path.join(tmp, "b.py"), patch)
+        with open(os.path.join(tmp, "a.py"), "rb") as a, open(os.path.join(tmp, "b.py"), "rb") as b:
+            assert a.read() == b.read()
+
+
+if __name__ == "__main__":
+    main()
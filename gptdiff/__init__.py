@@ -1,3 +1,22 @@
-from .gptdiff import generate_diff, smartapply, load_project_files, build_environment, save_files
+import importlib
 
-__all__ = ['generate_diff', 'smartapply', 'load_project_files', 'build_environment', 'save_files']
+__all__ = ['generate_diff', 'generate_diff_stream', 'agenerate_diff', 'smartapply', 'asmartapply', 'apply_diff_to_files', 'parse_patchset', 'load_project_files', 'build_environment', 'save_files']
+
+
+# Public names that live in gptdiff.applydiff, which loads faster than gptdiff.gptdiff.
+_APPLYDIFF_NAMES = ('apply_diff_to_files', 'parse_patchset')
+
+
+def __getattr__(name):
+    # Resolve the public API on first use so that importing a submodule such as
+    # gptdiff.applydiff does not load gptdiff.gptdiff.
+    if name in _APPLYDIFF_NAMES:
+        return getattr(importlib.import_module(".applydiff", __name__), name)
+    if name in __all__ or name == "gptdiff":
+        module = importlib.import_module(".gptdiff", __name__)
+        return module if name == "gptdiff" else getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -5,191 +5,1067 @@ Contains the function to apply unified git diffs to files on disk.
 """
 
 from pathlib import Path
+import os
 import re
-import hashlib
-from collections import defaultdict
+import shutil
+from bisect import bisect_left
+from collections import Counter
 
-def apply_diff(project_dir, diff_text):
+class PatchApplyError(ValueError):
+    """Raised when a patch does not apply to the given content."""
+
+
+DEFAULT_MAX_FUZZ = 2
+# Files at least this large (in MB) are patched by streaming instead of in memory.
+DEFAULT_STREAM_APPLY_MB = 64
+# When streaming, hunks are searched for this many lines either side of their header's line.
+STREAM_SEARCH_LINES = 1000
+_STREAM_BLOCK = 1 << 20
+
+_hunk_header_re = re.compile(r"^@@(?: -(\d+)(?:,(\d+))?)?(?: \+(\d+)(?:,(\d+))?)? @@")
+
+
+def max_fuzz():
+    """Outer context lines a hunk may ignore when placed, from $GPTDIFF_PATCH_FUZZ (default 2)."""
+    return int(os.getenv("GPTDIFF_PATCH_FUZZ", DEFAULT_MAX_FUZZ))
+
+
+def stream_apply_bytes():
+    """Size from which apply_diff patches a file by streaming, from $GPTDIFF_STREAM_APPLY_MB (default 64)."""
+    return int(float(os.getenv("GPTDIFF_STREAM_APPLY_MB", DEFAULT_STREAM_APPLY_MB)) * 2**20)
+
+
+class Hunk:
+    """One @@ section of a file patch.
+
+    ops holds (op, text) pairs: " " for context, "-" for removals and "+" for
+    additions. Context lines that lost their leading space are kept as context.
+    hint is the 0-based line the header says the hunk starts at, or None.
+    no_newline is the index in ops of an added line marked "\\ No newline at
+    end of file", or None.
+    """
+    __slots__ = ("header", "lines", "ops", "hint", "valid", "no_newline")
+
+    def __init__(self, header, lines):
+        self.header = header
+        self.lines = lines
+        self.ops = []
+        self.no_newline = None
+        for line in lines:
+            if line.startswith("\\"):
+                # "\ No newline at end of file"
+                if self.ops and self.ops[-1][0] == "+":
+                    self.no_newline = len(self.ops) - 1
+                continue
+            if line[:1] in ("+", "-", " "):
+                self.ops.append((line[0], line[1:]))
+            else:
+                self.ops.append((" ", line))
+        stripped = header.strip()
+        m = _hunk_header_re.match(stripped)
+        self.valid = stripped == "@@" or m is not None
+        self.hint = None
+        if m and m.group(1) is not None:
+            start = int(m.group(1))
+            # "-5,0" inserts after line 5; otherwise the hunk starts at line 5.
+            self.hint = start if m.group(2) == "0" else max(start - 1, 0)
+
+    @property
+    def old_lines(self):
+        """The lines this hunk expects in the original: context and removals."""
+        return [text for op, text in self.ops if op != "+"]
+
+    @property
+    def text(self):
+        return "\n".join([self.header] + self.lines)
+
+    @property
+    def old_count(self):
+        """Lines of the original this hunk spans."""
+        return sum(1 for op, _ in self.ops if op != "+")
+
+    @property
+    def new_count(self):
+        """Lines of the result this hunk spans."""
+        return sum(1 for op, _ in self.ops if op != "-")
+
+
+def _header_path(header):
+    """Path named by a ---/+++ header, without a/ or b/, or None for /dev/null."""
+    path = header[4:].split("\t", 1)[0].strip()
+    if path == "/dev/null":
+        return None
+    return path[2:] if path.startswith(("a/", "b/")) else path
+
+
+class FilePatch:
+    """One file's part of a diff, parsed once.
+
+    operation is "modify", "create" or "delete". old_path and new_path come
+    from the ---/+++ headers (None for /dev/null or when missing), while path
+    is the file the patch applies to. text is the patch as given.
+    """
+    __slots__ = ("path", "text", "operation", "old_path", "new_path", "hunks")
+
+    def __init__(self, path, text):
+        self.path = path
+        self.text = text
+        self.old_path = self.new_path = None
+        deleted = created = False
+        sections = []
+        lines = text.splitlines()
+        in_hunk = False
+        for i, line in enumerate(lines):
+            if line.lstrip().startswith("@@"):
+                sections.append((line, []))
+                in_hunk = True
+            elif line.startswith("+++ /dev/null"):
+                # parse_diff_per_file marks deletions with this line, even after hunks.
+                deleted = True
+                in_hunk = False
+            elif line.startswith("diff --git ") or (
+                    line.startswith("--- ") and i + 1 < len(lines) and lines[i + 1].startswith("+++ ")):
+                # Another header for the same file (parse_diff_per_file merges them).
+                in_hunk = False
+                if line.startswith("--- "):
+                    created = created or line.startswith("--- /dev/null")
+                    self.old_path = self.old_path or _header_path(line)
+            elif in_hunk:
+                sections[-1][1].append(line)
+            elif line.startswith("--- "):
+                created = created or line.startswith("--- /dev/null")
+                self.old_path = self.old_path or _header_path(line)
+            elif line.startswith("+++ "):
+                self.new_path = self.new_path or _header_path(line)
+            elif line.startswith("new file mode"):
+                created = True
+            elif line.startswith("deleted file mode"):
+                deleted = True
+        for _, body in sections:
+            # Trailing blank lines are usually separators between file diffs, not context.
+            while body and body[-1] == "":
+                body.pop()
+        self.hunks = [Hunk(header, body) for header, body in sections]
+        self.operation = "delete" if deleted else "create" if created else "modify"
+
+    @property
+    def added(self):
+        return sum(1 for hunk in self.hunks for op, _ in hunk.ops if op == "+")
+
+    @property
+    def removed(self):
+        return sum(1 for hunk in self.hunks for op, _ in hunk.ops if op == "-")
+
+    def __repr__(self):
+        return f"<FilePatch {self.operation} {self.path} +{self.added} -{self.removed}>"
+
+
+class PatchSet:
+    """The FilePatches of a diff, in order. Iterate it, index it or look up .paths."""
+    __slots__ = ("files",)
+
+    def __init__(self, files):
+        self.files = list(files)
+
+    @property
+    def paths(self):
+        return [file_patch.path for file_patch in self.files]
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def __len__(self):
+        return len(self.files)
+
+    def __getitem__(self, index):
+        return self.files[index]
+
+    def __str__(self):
+        return "\n".join(file_patch.text for file_patch in self.files)
+
+
+def parse_patchset(diff_text):
+    """Parse diff_text (or an iterable of its lines) into a PatchSet.
+
+    A PatchSet is returned as is, so callers can parse once and pass it on.
+
+    Example:
+        >>> patchset = parse_patchset(diff_text)
+        >>> [(f.operation, f.path, len(f.hunks)) for f in patchset]
+        [('modify', 'src/app.py', 2), ('delete', 'old.py', 0)]
+    """
+    if isinstance(diff_text, PatchSet):
+        return diff_text
+    return PatchSet(FilePatch(path, patch) for path, patch in parse_diff_per_file(diff_text))
+
+
+def split_hunks(patch):
+    """Return the Hunks of a single file's patch (text or FilePatch), ignoring file headers."""
+    if isinstance(patch, FilePatch):
+        return patch.hunks
+    return FilePatch(None, patch).hunks
+
+
+class HunkPlacement:
+    """Where a hunk was applied, reported like GNU patch.
+
+    A hunk that could not be placed has error set; line is then the line its
+    header named, if any.
+    """
+    __slots__ = ("number", "line", "offset", "fuzz", "whitespace", "error")
+
+    def __init__(self, number, line, offset, fuzz, whitespace, error=None):
+        self.number = number
+        self.line = line
+        self.offset = offset
+        self.fuzz = fuzz
+        self.whitespace = whitespace
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def exact(self):
+        return self.ok and not (self.offset or self.fuzz or self.whitespace)
+
+    def __str__(self):
+        if self.error is not None:
+            where = f" at {self.line}" if self.line is not None else ""
+            return f"Hunk #{self.number} FAILED{where}: {self.error}"
+        notes = []
+        if self.offset:
+            notes.append(f"offset {self.offset} line{'s' if abs(self.offset) != 1 else ''}")
+        if self.fuzz:
+            notes.append(f"fuzz {self.fuzz}")
+        if self.whitespace:
+            notes.append("ignoring whitespace")
+        suffix = f" ({', '.join(notes)})" if notes else ""
+        return f"Hunk #{self.number} succeeded at {self.line}{suffix}."
+
+
+def _normalize_whitespace(text):
+    # Only trailing whitespace is ignored: indentation is significant.
+    return text.rstrip()
+
+
+class LineIndex:
+    """Where each line of a file occurs, for finding a hunk's lines in near-linear time.
+
+    Lines are keyed by their text without the newline, or (loose=True)
+    without any trailing whitespace. Each table is built once, on first use.
+    """
+    __slots__ = ("lines", "_tables")
+
+    def __init__(self, lines):
+        self.lines = lines
+        self._tables = {}
+
+    def _table(self, loose):
+        table = self._tables.get(loose)
+        if table is None:
+            if loose:
+                keys = [_normalize_whitespace(line) for line in self.lines]
+            else:
+                keys = [line.rstrip("\n") for line in self.lines]
+            # Most lines are unique: a dict built in C holds their position, and
+            # only lines that repeat get a list of every position.
+            last = dict(zip(keys, range(len(keys))))
+            repeated = {key: [] for key, count in Counter(keys).items() if count > 1}
+            if repeated:
+                for i, key in enumerate(keys):
+                    positions = repeated.get(key)
+                    if positions is not None:
+                        positions.append(i)
+            table = self._tables[loose] = (keys, last, repeated)
+        return table
+
+    def _occurrences(self, key, last, repeated):
+        positions = repeated.get(key)
+        if positions is None:
+            i = last.get(key)
+            positions = None if i is None else (i,)
+        return positions
+
+    def occurrences(self, line, loose=False):
+        """Every position of line, in order."""
+        keys, last, repeated = self._table(loose)
+        key = _normalize_whitespace(line) if loose else line.rstrip("\n")
+        return self._occurrences(key, last, repeated) or ()
+
+    def find(self, block, desired, lower=0, loose=False):
+        """Start of the occurrence of block at or after lower that is closest to desired, or None.
+
+        On a tie, the occurrence after desired wins.
+        """
+        n = len(block)
+        upper = len(self.lines) - n
+        if not n or upper < lower:
+            return None
+        keys, last, repeated = self._table(loose)
+        if loose:
+            block = [_normalize_whitespace(line) for line in block]
+        # Only the positions of the block's rarest line need checking.
+        anchor, found = None, None
+        for k, key in enumerate(block):
+            occurrences = self._occurrences(key, last, repeated)
+            if not occurrences:
+                return None
+            if found is None or len(occurrences) < len(found):
+                anchor, found = k, occurrences
+        desired = min(max(desired, lower), upper)
+        right = bisect_left(found, desired + anchor)
+        left = right - 1
+        while left >= 0 or right < len(found):
+            after = found[right] - anchor if right < len(found) else None
+            before = found[left] - anchor if left >= 0 else None
+            if after is not None and after > upper:
+                after, right = None, len(found)
+            if before is not None and before < lower:
+                before, left = None, -1
+            if after is None and before is None:
+                break
+            if before is None or (after is not None and after - desired <= desired - before):
+                pos, right = after, right + 1
+            else:
+                pos, left = before, left - 1
+            if keys[pos:pos + n] == block:
+                return pos
+        return None
+
+
+def _mismatch(original_lines, pos, ops):
+    """Describe why ops don't match at pos, for error messages."""
+    for op, expected in ops:
+        if op == "+":
+            continue
+        kind = "Context" if op == " " else "Removal"
+        if pos >= len(original_lines):
+            return f"{kind} line expected but file ended"
+        got = original_lines[pos].rstrip("\n")
+        if got != expected:
+            return f"{kind} line mismatch. Expected: {expected} Got: {got}"
+        pos += 1
+    return "no match"
+
+
+def _leading_context(ops):
+    count = 0
+    for op, _ in ops:
+        if op != " ":
+            break
+        count += 1
+    return count
+
+
+def _place_hunk(index, hunk, desired, current_index, fuzz):
+    """Find where hunk applies at or after current_index: (pos, lead, trail, loose), or None.
+
+    pos is where the hunk's remaining lines start once lead leading and trail
+    trailing context lines have been ignored; loose means trailing whitespace
+    was ignored. Loose matching is a last resort, tried only when fuzz > 0.
+    """
+    ops = hunk.ops
+    if not any(op != "+" for op, _ in ops):
+        # Pure insertion: only the header says where it goes.
+        return min(max(desired, current_index), len(index.lines)), 0, 0, False
+    lead_context = _leading_context(ops)
+    trail_context = _leading_context(reversed(ops))
+    for loose in (False, True) if fuzz > 0 else (False,):
+        tried = set()
+        for level in range(0, max(fuzz, 0) + 1):
+            lead = min(level, lead_context)
+            trail = min(level, trail_context)
+            if (lead, trail) in tried:
+                continue
+            tried.add((lead, trail))
+            old = [text for op, text in ops[lead:len(ops) - trail] if op != "+"]
+            if not old:
+                continue
+            pos = index.find(old, desired + lead, current_index, loose)
+            if pos is not None:
+                return pos, lead, trail, loose
+    return None
+
+
+def hunk_placements(original_lines, patch, fuzz=None):
+    """Yield (hunk, placement, placed) for each hunk of patch, as apply_patch_to_lines would place them.
+
+    placement is a HunkPlacement. placed is (pos, lead, trail, loose): the
+    hunk's lines after the first lead context lines start at pos, trail
+    trailing context lines were ignored, and loose is true if trailing
+    whitespace was. placed is None for a hunk that failed; later hunks are
+    still placed, as if the failed one had been skipped.
+    """
+    if fuzz is None:
+        fuzz = max_fuzz()
+    index = LineIndex(original_lines)
+    current_index = 0
+    shift = 0
+    for number, hunk in enumerate(split_hunks(patch), 1):
+        header_line = hunk.hint + 1 if hunk.hint is not None else None
+        if not hunk.valid:
+            yield hunk, HunkPlacement(number, None, 0, 0, False, f"Invalid hunk header: {hunk.header}"), None
+            continue
+        desired = current_index if hunk.hint is None else hunk.hint + shift
+        placed = _place_hunk(index, hunk, desired, current_index, fuzz)
+        if placed is None:
+            reason = _mismatch(original_lines, max(desired, current_index), hunk.ops)
+            yield hunk, HunkPlacement(number, header_line, 0, 0, False, reason), None
+            continue
+        pos, lead, trail, loose = placed
+        start = pos - lead
+        offset = start - hunk.hint if hunk.hint is not None else 0
+        if hunk.hint is not None:
+            shift = start - hunk.hint
+        yield hunk, HunkPlacement(number, start + 1, offset, max(lead, trail), loose), placed
+        current_index = pos + sum(1 for op, _ in hunk.ops[lead:len(hunk.ops) - trail] if op != "+")
+
+
+def check_patch_to_lines(original_lines, patch, fuzz=None):
+    """Return a HunkPlacement for every hunk of patch without applying it.
+
+    Unlike apply_patch_to_lines, a hunk that fails doesn't stop the check:
+    it is reported with its error and skipped, and the following hunks are
+    still checked.
+    """
+    return [placement for _, placement, _ in hunk_placements(original_lines, patch, fuzz)]
+
+
+def apply_patch_to_lines(original_lines, patch, fuzz=None, placements=None):
+    """
+    Apply a single file's unified diff patch (text or FilePatch) to
+    original_lines (as produced by splitlines(keepends=True)) and return the
+    new list of lines.
+
+    Like GNU patch, each hunk is looked for at its header's line (adjusted by
+    the offset of earlier hunks), then at growing offsets around it, and then
+    with up to `fuzz` outer context lines ignored (default: max_fuzz()). Only
+    if all of that fails, and fuzz is above 0, is trailing whitespace ignored
+    too. Removal lines must always match.
+    Lookups go through a LineIndex built once per call, so relocating hunks
+    stays near-linear even in very large files.
+    If placements is a list, a HunkPlacement is appended for each hunk.
+    Added lines end in a newline unless the patch marks them "\\ No newline
+    at end of file"; an original last line without one keeps it only while
+    nothing follows it.
+    Raises PatchApplyError when a hunk can't be placed.
+    """
+    new_lines = []
+    current_index = 0
+
+    for hunk, placement, placed in hunk_placements(original_lines, patch, fuzz):
+        if placed is None:
+            raise PatchApplyError(str(placement))
+        if placements is not None:
+            placements.append(placement)
+        pos, lead, trail = placed[:3]
+        _extend(new_lines, original_lines[current_index:pos])
+        current_index = pos
+        for i in range(lead, len(hunk.ops) - trail):
+            op, text = hunk.ops[i]
+            if op == " ":
+                # Keep the original's text, which may differ in whitespace.
+                _extend(new_lines, [original_lines[current_index]])
+                current_index += 1
+            elif op == "-":
+                current_index += 1
+            else:
+                _extend(new_lines, [text if i == hunk.no_newline else text + "\n"])
+
+    # Append any remaining lines from the original file.
+    _extend(new_lines, original_lines[current_index:])
+    return new_lines
+
+
+def _extend(new_lines, lines):
+    # A last line without a newline is no longer last once lines follow it.
+    if lines and new_lines and not new_lines[-1].endswith("\n"):
+        new_lines[-1] += "\n"
+    new_lines.extend(lines)
+
+
+def apply_patch_to_text(original_text, patch, fuzz=None, placements=None):
+    """
+    Apply a single file's patch to original_text in memory and return the result.
+
+    Hunks are placed as in apply_patch_to_lines, which also decides whether
+    the result ends in a newline. Raises PatchApplyError if a hunk can't be
+    placed.
+
+    Example:
+        >>> apply_patch_to_text("a\nb\n", "@@ -1,2 +1,2 @@\n a\n-b\n+c")
+        'a\nc\n'
+    """
+    return "".join(apply_patch_to_lines(original_text.splitlines(keepends=True), patch, fuzz, placements))
+
+
+class _LineReader:
+    """Reads a binary file by line number, copying skipped lines in large blocks."""
+    __slots__ = ("source", "buffer", "pos", "line")
+
+    def __init__(self, source):
+        self.source = source
+        self.buffer = b""
+        self.pos = 0
+        # Number of the next line to be read.
+        self.line = 0
+
+    def _fill(self):
+        block = self.source.read(_STREAM_BLOCK)
+        if not block:
+            return False
+        self.buffer = self.buffer[self.pos:] + block
+        self.pos = 0
+        return True
+
+    def copy_to(self, line, dest):
+        """Copy lines up to (not including) line to dest, or to the end of the file."""
+        while self.line < line:
+            buffer, pos = self.buffer, self.pos
+            needed = line - self.line
+            available = buffer.count(b"\n", pos)
+            if available >= needed:
+                end = pos
+                for _ in range(needed):
+                    end = buffer.index(b"\n", end) + 1
+                dest.write(buffer[pos:end])
+                self.pos, self.line = end, line
+                return
+            if available:
+                end = buffer.rindex(b"\n") + 1
+                dest.write(buffer[pos:end])
+                self.pos, self.line = end, self.line + available
+            if not self._fill():
+                if self.pos < len(self.buffer):
+                    # A last line without a newline.
+                    dest.write(self.buffer[self.pos:])
+                    self.pos, self.line = len(self.buffer), self.line + 1
+                return
+
+    def read_lines(self, count):
+        """Return up to count next lines, as bytes with their line endings."""
+        lines = []
+        while len(lines) < count:
+            end = self.buffer.find(b"\n", self.pos)
+            if end < 0:
+                if self._fill():
+                    continue
+                if self.pos < len(self.buffer):
+                    lines.append(self.buffer[self.pos:])
+                    self.pos = len(self.buffer)
+                break
+            lines.append(self.buffer[self.pos:end + 1])
+            self.pos = end + 1
+        self.line += len(lines)
+        return lines
+
+    def unread(self, lines):
+        self.buffer = b"".join(lines) + self.buffer[self.pos:]
+        self.pos = 0
+        self.line -= len(lines)
+
+    def copy_rest(self, dest):
+        dest.write(self.buffer[self.pos:])
+        self.buffer, self.pos = b"", 0
+        shutil.copyfileobj(self.source, dest, _STREAM_BLOCK)
+
+
+class _TailWriter:
+    """Remembers the last byte written, to tell whether the output ends with a newline."""
+    __slots__ = ("dest", "last")
+
+    def __init__(self, dest):
+        self.dest = dest
+        self.last = b""
+
+    def write(self, data):
+        if data:
+            self.dest.write(data)
+            self.last = data[-1:]
+
+
+def apply_patch_to_stream(source, dest, patch, fuzz=None, placements=None, search_lines=STREAM_SEARCH_LINES):
+    """
+    Apply a single file's patch, reading the original from the binary file
+    source and writing the result to the binary file dest.
+
+    Hunks are placed as in apply_patch_to_lines, except that each is only
+    looked for within search_lines lines of its header's line (adjusted by the
+    offset of earlier hunks). Lines between hunks are copied in large blocks,
+    so memory use is bounded by search_lines and the hunk size, not the file
+    size. Untouched lines are copied byte for byte; added lines get the line
+    ending of the first line read. Like apply_diff, the result always ends
+    with a newline.
+    Raises PatchApplyError when a hunk can't be placed; dest is then incomplete.
+    """
+    if fuzz is None:
+        fuzz = max_fuzz()
+    reader = _LineReader(source)
+    out = _TailWriter(dest)
+    newline = None
+    shift = 0
+    for number, hunk in enumerate(split_hunks(patch), 1):
+        header_line = hunk.hint + 1 if hunk.hint is not None else None
+        if not hunk.valid:
+            raise PatchApplyError(str(HunkPlacement(number, None, 0, 0, False, f"Invalid hunk header: {hunk.header}")))
+        desired = reader.line if hunk.hint is None else max(hunk.hint + shift, reader.line)
+        reader.copy_to(desired - search_lines, out)
+        start = reader.line
+        raw = reader.read_lines(desired - start + search_lines + hunk.old_count)
+        text = [line.decode("utf8") for line in raw]
+        if newline is None and text:
+            newline = "\r\n" if text[0].endswith("\r\n") else "\n"
+        lines = [line[:-2] + "\n" if line.endswith("\r\n") else line for line in text]
+        placed = _place_hunk(LineIndex(lines), hunk, desired - start, 0, fuzz)
+        if placed is None:
+            reason = _mismatch(lines, desired - start, hunk.ops)
+            raise PatchApplyError(str(HunkPlacement(number, header_line, 0, 0, False, reason)))
+        pos, lead, trail, loose = placed
+        hunk_start = start + pos - lead
+        offset = hunk_start - hunk.hint if hunk.hint is not None else 0
+        if hunk.hint is not None:
+            shift = offset
+        if placements is not None:
+            placements.append(HunkPlacement(number, hunk_start + 1, offset, max(lead, trail), loose))
+
+        out.write(b"".join(raw[:pos]))
+        i = pos
+        for op, line in hunk.ops[lead:len(hunk.ops) - trail]:
+            if op == " ":
+                # Keep the original's bytes, which may differ in whitespace.
+                out.write(raw[i] if raw[i].endswith(b"\n") else raw[i] + (newline or "\n").encode())
+                i += 1
+            elif op == "-":
+                i += 1
+            else:
+                out.write((line + (newline or "\n")).encode("utf8"))
+        reader.unread(raw[i:])
+    reader.copy_rest(out)
+    if out.last not in (b"", b"\n"):
+        out.write(b"\n")
+
+
+class FileApplyResult:
+    """Outcome of applying one FilePatch in memory.
+
+    status is "modified", "created", "deleted", "unchanged" or "failed".
+    error says why a failed patch did not apply, placements has a
+    HunkPlacement for each hunk (for failed files, every hunk is checked), and
+    patch is the FilePatch itself (e.g. to send failed files on to smartapply).
+    """
+    __slots__ = ("path", "status", "error", "placements", "patch")
+
+    def __init__(self, path, status, patch, error=None, placements=()):
+        self.path = path
+        self.status = status
+        self.patch = patch
+        self.error = error
+        self.placements = list(placements)
+
+    @property
+    def ok(self):
+        return self.status != "failed"
+
+    def __repr__(self):
+        detail = f": {self.error}" if self.error else ""
+        return f"<FileApplyResult {self.path} {self.status}{detail}>"
+
+
+def apply_diff_to_files(diff_text, files, fuzz=None):
+    """Apply a diff to a {path: content} dictionary in memory, without the LLM or the filesystem.
+
+    Hunks are placed as in apply_patch_to_text. Nothing is shared or mutated,
+    so candidates can be evaluated in parallel.
+
+    Args:
+        diff_text: Unified diff string, or a PatchSet
+        files: Dictionary of {file_path: content}
+        fuzz: Outer context lines a hunk may ignore (default: max_fuzz())
+
+    Returns:
+        (new_files, report): a new dictionary with every file patch that
+        applied (files whose patch failed keep their original content, and
+        deleted files are omitted), and {file_path: FileApplyResult} in diff
+        order.
+
+    Example:
+        >>> new_files, report = apply_diff_to_files(diff, files)
+        >>> failed = PatchSet(r.patch for r in report.values() if not r.ok)
+        >>> if failed:
+        ...     new_files = smartapply(failed, new_files)
+    """
+    new_files = dict(files)
+    report = {}
+    for file_patch in parse_patchset(diff_text):
+        path = file_patch.path
+        if file_patch.operation == "delete":
+            new_files.pop(path, None)
+            report[path] = FileApplyResult(path, "deleted", file_patch)
+            continue
+        original = new_files.get(path)
+        placements = []
+        try:
+            updated = apply_patch_to_text(original or "", file_patch, fuzz, placements)
+        except PatchApplyError as e:
+            # Report every hunk, not just the ones before the first failure.
+            placements = check_patch_to_lines((original or "").splitlines(keepends=True), file_patch, fuzz)
+            report[path] = FileApplyResult(path, "failed", file_patch, error=str(e), placements=placements)
+            continue
+        if original is None:
+            status = "created"
+        else:
+            status = "unchanged" if updated == original else "modified"
+        new_files[path] = updated
+        report[path] = FileApplyResult(path, status, file_patch, placements=placements)
+    return new_files, report
+
+
+_CHECK_STATUS = {
+    "modified": "would modify",
+    "created": "would create",
+    "deleted": "would delete",
+    "unchanged": "applies, but changes nothing",
+}
+
+
+def _report_check(report, files):
+    """Print apply_diff(check=True)'s per-file and per-hunk report."""
+    from .hunkwindow import plan_windows
+
+    llm_files = 0
+    llm_lines = 0
+    for path, result in report.items():
+        if result.ok:
+            print(f"{path}: {_CHECK_STATUS[result.status]}")
+        else:
+            original = files.get(path) or ""
+            windows = plan_windows(original, result.patch)
+            if windows:
+                lines = sum(window.end - window.start for window in windows)
+                estimate = f"{len(windows)} window(s), {lines} lines"
+            else:
+                lines = len(original.splitlines())
+                estimate = f"whole file, {lines} lines"
+            llm_files += 1
+            llm_lines += lines
+            print(f"{path}: needs smartapply ({estimate})")
+        for placement in result.placements:
+            print(f"  {placement}")
+    applied = len(report) - llm_files
+    summary = f"Check: {applied}/{len(report)} files apply without the LLM"
+    if llm_files:
+        summary += f"; {llm_files} {'needs' if llm_files == 1 else 'need'} smartapply (~{llm_lines} lines sent)"
+    print(summary + ". No files were changed.")
+
+
+def apply_diff(project_dir, diff_text, check=False):
     """
     Applies a unified diff (as generated by git diff) to the files in project_dir
     using pure Python (without calling the external 'patch' command).
 
     Handles file modifications, new file creation, and file deletions.
+    diff_text may also be a PatchSet that was already parsed.
+
+    The apply is all-or-nothing: every file's new content is computed in
+    memory first, and the results are written together by an
+    ApplyTransaction. Files of stream_apply_bytes() or more are instead
+    patched by apply_patch_to_stream straight into the transaction's temp
+    file, so memory use doesn't grow with their size. If any hunk fails, or writing fails part way, no file
+    in project_dir is changed.
+
+    With check=True, like `git apply --check`, every hunk is validated in
+    memory and a per-file, per-hunk report is printed, including which files
+    would need smartapply. Nothing is written.
 
     Returns:
         True if at least one file was modified (or deleted/created) as a result of the patch,
-        False otherwise.
+        False otherwise. With check=True: True if every file patch applies.
     """
-    from pathlib import Path
-    import re, hashlib
-
-    def file_hash(filepath):
-        h = hashlib.sha256()
-        with open(filepath, "rb") as f:
-            h.update(f.read())
-        return h.hexdigest()
+    from .transaction import ApplyTransaction
 
-    def apply_patch_to_file(file_path, patch):
+    def patched_lines(file_path, patch):
         """
-        Applies a unified diff patch (for a single file) to file_path.
+        Applies a unified diff patch (for a single file) to file_path in memory.
 
-        Returns True if the patch was applied successfully, False otherwise.
+        Returns (original_lines, new_lines), or None if the patch does not apply.
+        The file is read once; nothing else touches the disk.
         """
         # Read the original file lines; if the file doesn't exist, treat it as empty.
         if file_path.exists():
             original_lines = file_path.read_text(encoding="utf8").splitlines(keepends=True)
         else:
             original_lines = []
-        new_lines = []
-        current_index = 0
-
-        patch_lines = patch.splitlines()
-        # Regex for a hunk header, e.g., @@ -3,7 +3,6 @@
-        hunk_header_re = re.compile(r"^@@(?: -(\d+)(?:,(\d+))?)?(?: \+(\d+)(?:,(\d+))?)? @@")
-        i = 0
-        while i < len(patch_lines):
-            line = patch_lines[i]
-            if line.lstrip().startswith("@@"):
-                if line.strip() == "@@":
-                    # Handle minimal hunk header without line numbers.
-                    orig_start = 1
-                else:
-                    m = hunk_header_re.match(line.strip())
-                    if not m:
-                        print("Invalid hunk header:", line)
-                        return False
-                    orig_start = int(m.group(1)) if m.group(1) is not None else 1
-                hunk_start_index = orig_start - 1  # diff headers are 1-indexed
-                if hunk_start_index > len(original_lines):
-                    print("Hunk start index beyond file length")
-                    return False
-                new_lines.extend(original_lines[current_index:hunk_start_index])
-                current_index = hunk_start_index
-                i += 1
-                # Process the hunk lines until the next hunk header.
-                while i < len(patch_lines) and not patch_lines[i].startswith("@@"):
-                    pline = patch_lines[i]
-                    if pline.startswith(" "):
-                        # Context line must match exactly.
-                        expected = pline[1:]
-                        if current_index >= len(original_lines):
-                            print("Context line expected but file ended")
-                            return False
-                        orig_line = original_lines[current_index].rstrip("\n")
-                        if orig_line != expected:
-                            print("Context line mismatch. Expected:", expected, "Got:", orig_line)
-                            return False
-                        new_lines.append(original_lines[current_index])
-                        current_index += 1
-                    elif pline.startswith("-"):
-                        # Removal line: verify and skip from original.
-                        expected = pline[1:]
-                        if current_index >= len(original_lines):
-                            print("Removal line expected but file ended")
-                            return False
-                        orig_line = original_lines[current_index].rstrip("\n")
-                        if orig_line != expected:
-                            print("Removal line mismatch. Expected:", expected, "Got:", orig_line)
-                            return False
-                        current_index += 1
-                    elif pline.startswith("+"):
-                        # Addition line: add to new_lines.
-                        new_lines.append(pline[1:] + "\n")
-                    else:
-                        try:
-                            expected = pline
-                            if current_index >= len(original_lines):
-                                print("We are trying a smart diff, dumb diff failed")
-                                return False
-                            orig_line = original_lines[current_index].rstrip("\n")
-                            if orig_line != expected:
-                                print("We are trying a smart diff, dumb diff failed")
-                                return False
-                            new_lines.append(original_lines[current_index])
-                            current_index += 1
-                        except Exception as e:
-                            print("We are trying a smart diff, dumb diff failed")
-                            print("Exception while applying dumb diff:", e)
-                            return False
-
-                    i += 1
-            else:
-                # Skip non-hunk header lines.
-                i += 1
+        placements = []
+        try:
+            new_lines = apply_patch_to_lines(original_lines, patch, placements=placements)
+        except PatchApplyError as e:
+            print(e)
+            return None
+        for placement in placements:
+            if not placement.exact:
+                print(f"{file_path}: {placement}")
+        # Ensure the file ends with a newline to match typical patch behavior
+        # and avoid tooling conflicts.
+        if new_lines and not new_lines[-1].endswith("\n"):
+            new_lines[-1] += "\n"
+        return original_lines, new_lines
 
-        # Append any remaining lines from the original file.
-        new_lines.extend(original_lines[current_index:])
-        # Ensure parent directories exist before writing the file.
-        file_path.parent.mkdir(parents=True, exist_ok=True)
-        # Write the new content back to the file. Ensure the file ends with a newline
-        # to match typical patch behavior and avoid tooling conflicts.
-        content = "".join(new_lines)
-        if content and not content.endswith("\n"):
-            content += "\n"
-        file_path.write_text(content, encoding="utf8")
-        return True
+    def streamed(file_path, patch):
+        """A writer for ApplyTransaction that streams the patched file_path."""
+        def write(dest):
+            placements = []
+            with open(file_path, "rb") as source:
+                try:
+                    apply_patch_to_stream(source, dest, patch, placements=placements)
+                except PatchApplyError as e:
+                    print(e)
+                    print(f"Failed to apply patch to file: {file_path}")
+                    raise
+            for placement in placements:
+                if not placement.exact:
+                    print(f"{file_path}: {placement}")
+        return write
 
     # Parse the diff into per-file patches.
-    file_patches = parse_diff_per_file(diff_text)
+    file_patches = parse_patchset(diff_text)
     if not file_patches:
         print("No file patches found in diff.")
         return False
 
-    # Record original file hashes.
-    original_hashes = {}
-    for file_path, _ in file_patches:
-        target_file = Path(project_dir) / file_path
-        if target_file.exists():
-            original_hashes[file_path] = file_hash(target_file)
-        else:
-            original_hashes[file_path] = None
+    if check:
+        files = {}
+        for file_patch in file_patches:
+            target_file = Path(project_dir) / file_patch.path
+            if file_patch.operation != "delete" and target_file.exists():
+                files[file_patch.path] = target_file.read_text(encoding="utf8")
+        _, report = apply_diff_to_files(file_patches, files)
+        _report_check(report, files)
+        return all(result.ok for result in report.values())
 
+    # Compute every change before writing anything. Whether a file changed is
+    # decided by comparing its old and new lines in memory, so each file is
+    # read once and written once.
+    transaction = ApplyTransaction()
     any_change = False
-    # Process each file patch.
-    for file_path, patch in file_patches:
-        target_file = Path(project_dir) / file_path
-        if "+++ /dev/null" in patch:
-            # Deletion patch: delete the file if it exists.
-            if target_file.exists():
-                target_file.unlink()
-                if not target_file.exists():
-                    any_change = True
-                else:
-                    print(f"Failed to delete file: {target_file}")
-                    return False
-        else:
-            # Modification or new file creation.
-            success = apply_patch_to_file(target_file, patch)
-            if not success:
-                print(f"Failed to apply patch to file: {target_file}")
-                return False
-
-    # Verify that at least one file was changed by comparing hashes.
-    for file_path, patch in file_patches:
-        target_file = Path(project_dir) / file_path
-        if "+++ /dev/null" in patch:
-            if not target_file.exists():
-                any_change = True
-            else:
-                print(f"Expected deletion but file still exists: {target_file}")
-                return False
-        else:
-            old_hash = original_hashes.get(file_path)
-            if target_file.exists():
-                new_hash = file_hash(target_file)
-                if old_hash != new_hash:
-                    any_change = True
-                else:
-                    print(f"No change detected in file: {target_file}")
-            else:
-                print(f"Expected modification or creation but file is missing: {target_file}")
-                return False
+    for file_patch in file_patches:
+        target_file = Path(project_dir) / file_patch.path
+        if file_patch.operation == "delete":
+            transaction.delete(target_file)
+            any_change = True
+            continue
+        # Modification or new file creation.
+        existed = target_file.exists()
+        if existed and target_file.stat().st_size >= stream_apply_bytes():
+            # Too large to hold in memory: patched while the transaction writes it.
+            transaction.write(target_file, streamed(target_file, file_patch))
+            any_change = True
+            continue
+        result = patched_lines(target_file, file_patch)
+        if result is None:
+            print(f"Failed to apply patch to file: {target_file}")
+            return False
+        original_lines, new_lines = result
+        if existed and new_lines == original_lines:
+            print(f"No change detected in file: {target_file}")
+            continue
+        transaction.write(target_file, new_lines)
+        any_change = True
+    try:
+        transaction.commit()
+    except OSError as e:
+        print(f"Failed to write patched files, no files were changed: {e}")
+        return False
+    except PatchApplyError:
+        return False
 
     if not any_change:
         print("Patch applied but no file modifications detected.")
         return False
     return True
 
+_git_header_re = re.compile(r'^(?:diff --git\s+)?(a/[^ ]+)\s+(b/[^ ]+)\s*$')
+_from_header_re = re.compile(r'^-{2,3}\s+(.*)$')
+_to_header_re = re.compile(r'^\+{2,3}\s+(.*)$')
+
+
+# Lines that can change _FileSplitter's state once git headers are in use.
+_GIT_STATE_PREFIXES = ("diff --git", "a/", "+++ ")
+
+
+def _strip_prefix(path, prefixes=("a/", "b/")):
+    return path[2:] if path.startswith(prefixes) else path
+
+
+class _FileSplitter:
+    """Line-by-line state machine behind iter_file_patches.
+
+    Until a git file header ("diff --git a/x b/x" or "a/x b/x") is seen, files
+    are split on ---/+++ header pairs; from then on only on git headers. A
+    "*** Begin Patch" line switches to the Begin/End Patch format. feed()
+    returns the (path, patch) sections that a line completes.
+    """
+    __slots__ = ("git_headers", "begin_patch", "in_patch", "path", "lines",
+                 "deletion", "to_header", "to_null", "from_header")
+
+    def __init__(self):
+        self.git_headers = False
+        self.begin_patch = False
+        self.in_patch = False
+        self._reset(None, [])
+
+    def _reset(self, path, lines):
+        self.path = path
+        self.lines = lines
+        self.deletion = False
+        # Whether a "+++ " / "+++ /dev/null" line has been seen, so deletions
+        # can be marked without rescanning the section.
+        self.to_header = False
+        self.to_null = False
+        self.from_header = None
+
+    def _finish(self, marked):
+        """The current section as (path, patch), marked as a deletion if needed, or None."""
+        if self.path is None or not (self.lines or self.begin_patch):
+            return None
+        if self.deletion and not marked:
+            self.lines.append("+++ /dev/null")
+        return self.path, "\n".join(self.lines)
+
+    def feed(self, line):
+        if self.begin_patch:
+            return self._feed_begin_patch(line)
+        if line.strip() == "*** Begin Patch":
+            # The whole diff is in Begin/End Patch format; drop the unfinished section.
+            self.begin_patch = True
+            return self._feed_begin_patch(line)
+        if line.startswith(("diff --git", "a/")):
+            m = _git_header_re.match(line)
+            if m:
+                done = self._finish(self.to_header if self.git_headers else self.to_null)
+                self.git_headers = True
+                self._reset(_strip_prefix(m.group(2), ("b/",)), [line])
+                return (done,) if done else ()
+        if self.git_headers:
+            self.lines.append(line)
+            if "deleted file mode" in line:
+                self.deletion = True
+            if line.startswith("+++ "):
+                self.to_header = True
+                self.to_null = self.to_null or line.startswith("+++ /dev/null")
+                parts = line.split()
+                if len(parts) >= 2 and parts[1] != "/dev/null":
+                    self.path = _strip_prefix(parts[1])
+            return ()
+
+        # ---/+++ header pairs.
+        if line.startswith("--"):
+            m = _from_header_re.match(line)
+            if m:
+                done = self._finish(self.to_null)
+                self._reset(None, [line])
+                self.from_header = m.group(1).strip()
+                return (done,) if done else ()
+        if line.startswith("++") and self.lines:
+            m = _to_header_re.match(line)
+            if m:
+                self.lines.append(line)
+                if line.startswith("+++ "):
+                    self.to_header = True
+                    self.to_null = self.to_null or line.startswith("+++ /dev/null")
+                file_to = m.group(1).strip()
+                if file_to == "/dev/null":
+                    self.deletion = True
+                    if self.from_header and self.from_header != "/dev/null":
+                        self.path = _strip_prefix(self.from_header)
+                else:
+                    self.path = _strip_prefix(file_to)
+                return ()
+        self.lines.append(line)
+        if line.startswith("+++ "):
+            self.to_header = True
+            self.to_null = self.to_null or line.startswith("+++ /dev/null")
+        if "deleted file mode" in line:
+            self.deletion = True
+        return ()
+
+    def _feed_begin_patch(self, line):
+        stripped = line.strip()
+        if stripped == "*** Begin Patch":
+            self.in_patch = True
+            self._reset(None, [])
+        elif stripped == "*** End Patch":
+            done = self._finish(True) if self.in_patch else None
+            self.in_patch = False
+            self._reset(None, [])
+            return (done,) if done else ()
+        elif self.in_patch:
+            for marker, header in (("*** Update File:", None),
+                                   ("*** Add File:", "--- /dev/null\n+++ b/{}\n@@"),
+                                   ("*** Delete File:", "--- a/{}\n+++ /dev/null")):
+                if stripped.startswith(marker):
+                    path = stripped.split(":", 1)[1].strip()
+                    done = None
+                    if self.path is not None:
+                        done = self._finish(True)
+                        self._reset(None, [])
+                    self.path = path
+                    if header:
+                        self.lines.extend(header.format(path).splitlines())
+                    return (done,) if done else ()
+            if stripped != "*** End of File":
+                self.lines.append(line)
+        return ()
+
+    def close(self):
+        if self.begin_patch:
+            return ()
+        done = self._finish(self.to_header)
+        self._reset(None, [])
+        return (done,) if done else ()
+
+
+def iter_file_patches(lines):
+    """Yield (file_path, patch) for each file section of a diff as soon as it is complete.
+
+    lines may be diff text or any iterable of lines, such as an open file or a
+    stream of model output, and is read once. Handles git diffs, ---/+++
+    header pairs without git headers, and the "*** Begin Patch" format. A
+    file that appears in several sections is yielded once per section; see
+    parse_diff_per_file to merge them.
+
+    Example:
+        >>> with open("changes.diff", encoding="utf8") as f:
+        ...     for path, patch in iter_file_patches(f):
+        ...         print(path)
+    """
+    from_text = isinstance(lines, str)
+    # Lines containing these markers always go through the state machine. Text
+    # that contains neither (the usual case) can skip looking for them per line.
+    markers = not from_text or "deleted file mode" in lines or "*** Begin Patch" in lines
+    if from_text:
+        lines = lines.splitlines()
+    splitter = _FileSplitter()
+    feed = splitter.feed
+    fast = False
+    append = None
+    for line in lines:
+        if not from_text:
+            line = line.rstrip("\r\n")
+        # Most lines of a git diff only extend the current file's patch.
+        if (fast and not line.startswith(_GIT_STATE_PREFIXES)
+                and (not markers or ("deleted file mode" not in line and "*** Begin Patch" not in line))):
+            append(line)
+            continue
+        done = feed(line)
+        if done:
+            yield from done
+        fast = splitter.git_headers and not splitter.begin_patch
+        append = splitter.lines.append
+    yield from splitter.close()
+
+
 def parse_diff_per_file(diff_text):
     """Parse unified diff text into individual file patches.
 
@@ -197,131 +1073,23 @@ def parse_diff_per_file(diff_text):
     - File creations (+++ /dev/null)
     - File deletions (--- /dev/null)
     - Standard modifications
+    - The "*** Begin Patch" / "*** Update File:" format
 
     Args:
-        diff_text: Unified diff string as generated by `git diff`
+        diff_text: Unified diff string as generated by `git diff`, or an
+            iterable of its lines
 
     Returns:
         List of tuples (file_path, patch) where:
         - file_path: Relative path to modified file
-        - patch: Full diff fragment for this file
+        - patch: Full diff fragment for this file. Sections for the same
+          file are joined in order.
 
     Note:
         Uses 'b/' prefix detection from git diffs to determine target paths
         This doesn't work all the time and needs to be revised with stronger models
     """
-    def dedup_diffs(diffs):
-        groups = defaultdict(list)
-        for key, value in diffs:
-            groups[key].append(value)
-        return [[key, "\n".join(values)] for key, values in groups.items()]
-
-    # Special case: handle LLM-style patch delimiters
-    if "*** Begin Patch" in diff_text:
-        lines = diff_text.splitlines()
-        diffs = []
-        current_lines = []
-        current_file = None
-        in_patch = False
-        for line in lines:
-            stripped = line.strip()
-            if stripped == "*** Begin Patch":
-                in_patch = True
-                current_lines = []
-                current_file = None
-            elif stripped == "*** End Patch":
-                if current_file is not None:
-                    diffs.append((current_file, "\n".join(current_lines)))
-                in_patch = False
-            elif in_patch:
-                if stripped.startswith("*** Update File:"):
-                    current_file = stripped.split(":", 1)[1].strip()
-                else:
-                    current_lines.append(line)
-        return dedup_diffs(diffs)
-
-    header_re = re.compile(r'^(?:diff --git\s+)?(a/[^ ]+)\s+(b/[^ ]+)\s*$', re.MULTILINE)
-    lines = diff_text.splitlines()
-
-    # Check if any header line exists.
-    if not any(header_re.match(line) for line in lines):
-        # Fallback strategy: detect file headers starting with '---' / '+++' pairs
-        diffs = []
-        current_lines = []
-        current_file = None
-        deletion_mode = False
-        from_header = None
-        header_from_re = re.compile(r'^-{2,3}\s+(.*)$')
-        header_to_re = re.compile(r'^\+{2,3}\s+(.*)$')
-
-        for line in lines:
-            from_match = header_from_re.match(line)
-            to_match = header_to_re.match(line)
-
-            if from_match:
-                if current_file is not None and current_lines:
-                    if deletion_mode and not any(l.startswith("+++ /dev/null") for l in current_lines):
-                        current_lines.append("+++ /dev/null")
-                    diffs.append((current_file, "\n".join(current_lines)))
-                current_lines = [line]
-                deletion_mode = False
-                current_file = None
-                from_header = from_match.group(1).strip()
-                continue
-
-            if to_match and current_lines:
-                current_lines.append(line)
-                file_to = to_match.group(1).strip()
-
-                if file_to == "/dev/null":
-                    deletion_mode = True
-                    if from_header and from_header != "/dev/null":
-                        current_file = from_header[2:] if (from_header.startswith("a/") or from_header.startswith("b/")) else from_header
-                else:
-                    current_file = file_to[2:] if (file_to.startswith("a/") or file_to.startswith("b/")) else file_to
-                continue
-
-            current_lines.append(line)
-            if "deleted file mode" in line:
-                deletion_mode = True
-
-        if current_file is not None and current_lines:
-            if deletion_mode and not any(l.startswith("+++ ") for l in current_lines):
-                current_lines.append("+++ /dev/null")
-            diffs.append((current_file, "\n".join(current_lines)))
-        return dedup_diffs(diffs)
-    else:
-        # Use header-based strategy.
-        diffs = []
-        current_lines = []
-        current_file = None
-        deletion_mode = False
-        for line in lines:
-            m = header_re.match(line)
-            if m:
-                if current_file is not None and current_lines:
-                    if deletion_mode and not any(l.startswith("+++ ") for l in current_lines):
-                        current_lines.append("+++ /dev/null")
-                    diffs.append((current_file, "\n".join(current_lines)))
-                current_lines = [line]
-                deletion_mode = False
-                file_from = m.group(1)  # e.g. "a/index.html"
-                file_to = m.group(2)    # e.g. "b/index.html"
-                current_file = file_to[2:] if file_to.startswith("b/") else file_to
-            else:
-                current_lines.append(line)
-                if "deleted file mode" in line:
-                    deletion_mode = True
-                if line.startswith("+++ "):
-                    parts = line.split()
-                    if len(parts) >= 2:
-                        file_to = parts[1].strip()
-                        if file_to != "/dev/null":
-                            current_file = file_to[2:] if (file_to.startswith("a/") or file_to.startswith("b/")) else file_to
-        if current_file is not None and current_lines:
-            if deletion_mode and not any(l.startswith("+++ ") for l in current_lines):
-                current_lines.append("+++ /dev/null")
-            diffs.append((current_file, "\n".join(current_lines)))
-        return dedup_diffs(diffs)
-
-
+    groups = {}
+    for path, patch in iter_file_patches(diff_text):
+        groups.setdefault(path, []).append(patch)
+    return [[path, "\n".join(patches)] for path, patches in groups.items()]
@@ -0,0 +1,410 @@
+"""
+Module: cache
+
+Persistent caches kept in .gptdiff/cache.
+
+FileCache is the per-file cache used when loading project files. Each entry
+is keyed by absolute path and validated against the file's size, mtime_ns and
+inode, and stores the decoded text (or a binary verdict) plus its token
+count.
+
+ResponseCache stores LLM responses to deterministic (temperature 0)
+requests, keyed by a hash of the normalized request, so a rerun that sends
+byte-identical requests doesn't wait for the model again.
+
+Both live in SQLite databases, which give safe concurrent access from several
+gptdiff processes, and evict the least recently used entries once their
+contents exceed ``max_bytes``.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_DIR = os.path.join(".gptdiff", "cache")
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_RESPONSE_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_RESPONSE_TTL = 7 * 24 * 3600
+RACY_WINDOW_NS = 2 * 10**9
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    binary INTEGER NOT NULL,
+    text TEXT,
+    encoding TEXT,
+    tokens INTEGER,
+    nbytes INTEGER NOT NULL,
+    accessed REAL NOT NULL
+)
+"""
+
+
+_RESPONSE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    nbytes INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+)
+"""
+
+
+def _ensure_gitignore(directory):
+    # Keep the cache out of version control, like .pytest_cache does.
+    root = os.path.dirname(os.path.abspath(directory))
+    if os.path.basename(root) == ".gptdiff":
+        gitignore = os.path.join(root, ".gitignore")
+        if not os.path.exists(gitignore):
+            try:
+                with open(gitignore, "w") as f:
+                    f.write("*\n")
+            except OSError:
+                pass
+
+
+def _connect(directory, name, schema):
+    os.makedirs(directory, exist_ok=True)
+    _ensure_gitignore(directory)
+    conn = sqlite3.connect(os.path.join(directory, name), timeout=30,
+                           check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(schema)
+    return conn
+
+_response_caches = {}
+_response_caches_lock = threading.Lock()
+
+
+class CacheEntry:
+    __slots__ = ("binary", "text", "encoding", "tokens")
+
+    def __init__(self, binary, text, encoding=None, tokens=None):
+        self.binary = binary
+        self.text = text
+        self.encoding = encoding
+        self.tokens = tokens
+
+
+class FileCache:
+    """On-disk cache of decoded file contents and token counts.
+
+    Example:
+        >>> cache = FileCache.open(".gptdiff/cache")
+        >>> content = cache.read_text("main.py")
+        >>> cache.close()
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = _connect(directory, "files.sqlite3", _SCHEMA)
+        self._entries = {}
+        self._dirty = set()
+        self._touched = set()
+        self._volatile = set()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def open(cls, directory=None, max_bytes=None):
+        """Open the cache configured by the environment, or return None if disabled.
+
+        $GPTDIFF_CACHE=0 disables the cache, $GPTDIFF_CACHE_DIR overrides the
+        location and $GPTDIFF_CACHE_MAX_BYTES the eviction threshold.
+        """
+        if os.getenv("GPTDIFF_CACHE", "1").strip().lower() in ("0", "false", "no", "off"):
+            return None
+        directory = directory or os.getenv("GPTDIFF_CACHE_DIR") or DEFAULT_CACHE_DIR
+        if max_bytes is None:
+            max_bytes = int(os.getenv("GPTDIFF_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+        try:
+            return cls(directory, max_bytes=max_bytes)
+        except (OSError, sqlite3.Error) as e:
+            print(f"File cache disabled: {e}")
+            return None
+
+    def lookup(self, path, st):
+        """Return the CacheEntry for path if it matches the stat result st, else None."""
+        key = os.path.abspath(path)
+        stat_key = (st.st_size, st.st_mtime_ns, st.st_ino)
+        with self._lock:
+            known = self._entries.get(key)
+            if known is not None and known[0] == stat_key:
+                return known[1]
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, inode, binary, text, encoding, tokens FROM files WHERE path = ?",
+                (key,),
+            ).fetchone()
+            if row is None or tuple(row[:3]) != stat_key:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry = CacheEntry(bool(row[3]), row[4], row[5], row[6])
+            self._entries[key] = (stat_key, entry)
+            self._touched.add(key)
+        return entry
+
+    def store(self, path, st, entry):
+        """Record entry for path at the stat result st. Written on flush()."""
+        key = os.path.abspath(path)
+        with self._lock:
+            self._entries[key] = ((st.st_size, st.st_mtime_ns, st.st_ino), entry)
+            self._dirty.add(key)
+
+    def read_text(self, path, st=None):
+        """Return the decoded text of path, or None for files that are not valid text."""
+        if st is None:
+            st = os.stat(path)
+        entry = self.lookup(path, st)
+        if entry is None:
+            try:
+                with open(path, "r") as f:
+                    entry = CacheEntry(False, f.read())
+            except UnicodeDecodeError:
+                entry = CacheEntry(True, None)
+            # Files modified within the timestamp granularity window could change
+            # again without a visible mtime change; don't cache those yet.
+            if time.time_ns() - st.st_mtime_ns > RACY_WINDOW_NS:
+                self.store(path, st, entry)
+            else:
+                key = os.path.abspath(path)
+                with self._lock:
+                    self._entries[key] = ((st.st_size, st.st_mtime_ns, st.st_ino), entry)
+                    self._volatile.add(key)
+        return None if entry.binary else entry.text
+
+    def cached_token_count(self, path, text, encoding):
+        """Return the cached token count of text for encoding, or None.
+
+        Only text read for path through this cache in the current run is known.
+        """
+        with self._lock:
+            known = self._entries.get(os.path.abspath(path))
+        if known is None or known[1].text != text:
+            return None
+        entry = known[1]
+        if entry.encoding == encoding:
+            return entry.tokens
+        return None
+
+    def store_token_count(self, path, text, encoding, tokens):
+        """Remember the token count of path's text for encoding. Written on flush()."""
+        key = os.path.abspath(path)
+        with self._lock:
+            known = self._entries.get(key)
+            if known is None or known[1].text != text:
+                return
+            stat_key, entry = known
+            self._entries[key] = (stat_key, CacheEntry(entry.binary, entry.text, encoding, tokens))
+            if key not in self._volatile:
+                self._dirty.add(key)
+
+    def token_count(self, path, text, encoding, count_fn):
+        """Return the token count of text, computing it with count_fn on a cache miss."""
+        tokens = self.cached_token_count(path, text, encoding)
+        if tokens is None:
+            tokens = count_fn(text)
+            self.store_token_count(path, text, encoding, tokens)
+        return tokens
+
+    def flush(self):
+        """Write new entries and access times, then evict down to max_bytes."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            touched, self._touched = self._touched, set()
+            if not dirty and not touched:
+                return
+            now = time.time()
+            rows = []
+            for key in dirty:
+                (size, mtime_ns, inode), entry = self._entries[key]
+                rows.append((key, size, mtime_ns, inode, int(entry.binary), entry.text, entry.encoding,
+                             entry.tokens, len((entry.text or "").encode("utf-8")), now))
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO files (path, size, mtime_ns, inode, binary, text, encoding, tokens, nbytes, accessed) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                self._conn.executemany("UPDATE files SET accessed = ? WHERE path = ?",
+                                       [(now, key) for key in touched - dirty])
+                self._evict()
+                self._conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                print(f"File cache write failed: {e}")
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM files").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        doomed = []
+        for path, nbytes in self._conn.execute("SELECT path, nbytes FROM files ORDER BY accessed ASC"):
+            if total <= self.max_bytes:
+                break
+            doomed.append((path,))
+            total -= nbytes
+        self._conn.executemany("DELETE FROM files WHERE path = ?", doomed)
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ResponseCache:
+    """On-disk cache of LLM responses, keyed by a hash of the normalized request.
+
+    A response is a JSON-serializable dict; entries older than ttl seconds are
+    ignored and purged. Every get and put goes straight to the database, so
+    responses survive a crash and are shared with concurrent processes.
+
+    Example:
+        >>> cache = ResponseCache(".gptdiff/cache")
+        >>> key = ResponseCache.key(model, messages, 0.0, 30000, base_url)
+        >>> cache.get(key) or cache.put(key, {"content": text})
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_RESPONSE_MAX_BYTES, ttl=DEFAULT_RESPONSE_TTL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = _connect(directory, "responses.sqlite3", _RESPONSE_SCHEMA)
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def open(cls, directory=None, max_bytes=None, ttl=None):
+        """Open the response cache if $GPTDIFF_LLM_CACHE enables it, else return None.
+
+        $GPTDIFF_CACHE_DIR overrides the location, $GPTDIFF_LLM_CACHE_MAX_BYTES
+        the eviction threshold and $GPTDIFF_LLM_CACHE_TTL the lifetime in seconds.
+        """
+        if os.getenv("GPTDIFF_LLM_CACHE", "").strip().lower() not in ("1", "true", "yes", "on"):
+            return None
+        directory = directory or os.getenv("GPTDIFF_CACHE_DIR") or DEFAULT_CACHE_DIR
+        if max_bytes is None:
+            max_bytes = int(os.getenv("GPTDIFF_LLM_CACHE_MAX_BYTES", DEFAULT_RESPONSE_MAX_BYTES))
+        if ttl is None:
+            ttl = float(os.getenv("GPTDIFF_LLM_CACHE_TTL", DEFAULT_RESPONSE_TTL))
+        try:
+            return cls(directory, max_bytes=max_bytes, ttl=ttl)
+        except (OSError, sqlite3.Error) as e:
+            print(f"LLM response cache disabled: {e}")
+            return None
+
+    @staticmethod
+    def key(model, messages, temperature, max_tokens, base_url, **extra):
+        """Hash of the request. The same request always gives the same key."""
+        request = {
+            "model": model,
+            "messages": messages,
+            "temperature": float(temperature),
+            "max_tokens": max_tokens,
+            "base_url": (base_url or "").rstrip("/"),
+        }
+        request.update((name, value) for name, value in extra.items() if value is not None)
+        canonical = json.dumps(request, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(canonical.encode("utf8")).hexdigest()
+
+    def get(self, key):
+        """Return the cached response for key, or None."""
+        now = time.time()
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT response FROM responses WHERE key = ? AND created >= ?",
+                    (key, now - self.ttl),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            except sqlite3.Error as e:
+                print(f"LLM response cache read failed: {e}")
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, response):
+        """Store response under key, then drop expired entries and evict down to max_bytes."""
+        data = json.dumps(response, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, nbytes, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                    (key, data, len(data.encode("utf-8")), now, now),
+                )
+                self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+                self._evict()
+                self._conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                print(f"LLM response cache write failed: {e}")
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        doomed = []
+        for key, nbytes in self._conn.execute("SELECT key, nbytes FROM responses ORDER BY accessed ASC"):
+            if total <= self.max_bytes:
+                break
+            doomed.append((key,))
+            total -= nbytes
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def response_cache():
+    """The process-wide ResponseCache for the current environment, or None if disabled."""
+    config = tuple(os.getenv(name) for name in
+                   ("GPTDIFF_LLM_CACHE", "GPTDIFF_CACHE_DIR", "GPTDIFF_LLM_CACHE_MAX_BYTES", "GPTDIFF_LLM_CACHE_TTL"))
+    if config in _response_caches:
+        return _response_caches[config]
+    with _response_caches_lock:
+        if config not in _response_caches:
+            _response_caches[config] = ResponseCache.open()
+        return _response_caches[config]
+
+
+def response_cache_summary():
+    """Hit and miss counts of the response caches used in this process, or None."""
+    caches = [cache for cache in list(_response_caches.values()) if cache is not None]
+    hits = sum(cache.hits for cache in caches)
+    misses = sum(cache.misses for cache in caches)
+    if not hits and not misses:
+        return None
+    return f"LLM response cache: {hits} hits, {misses} misses."
@@ -8,28 +8,37 @@ import time
 import os
 import json
 import sys
-import fnmatch
+import functools
 import argparse
 import pkgutil
 import contextvars
 from pkgutil import get_data
-import threading
 from threading import Lock
 import shutil
 import base64
 import mimetypes
 
-import openai
-from openai import OpenAI
-import tiktoken
-import requests
-from ai_agent_toolbox import Toolbox, MarkdownParser, MarkdownPromptFormatter, XMLParser, XMLPromptFormatter
-from .applydiff import apply_diff, parse_diff_per_file
+# openai, requests and ai_agent_toolbox are imported where they are used so that
+# importing gptdiff (e.g. for gptpatch --dumb) stays fast.
+# apply_diff and apply_diff_to_files are re-exported: `from gptdiff.gptdiff import apply_diff` is public.
+from .applydiff import apply_diff, apply_diff_to_files, apply_patch_to_text, parse_diff_per_file, parse_patchset, FilePatch, PatchApplyError
+from .ignore import IgnoreMatcher
+from .cache import FileCache, ResponseCache, response_cache, response_cache_summary
+from .tokens import count_tokens, count_file_tokens
+from .transport import get_openai_client, get_requests_session
+from .retry import LLMHTTPError, RETRYABLE_STATUS, retry_policy, retry_stats
+from .ratelimit import get_rate_limiter, pacing_summary
+from .scheduler import ApplyPool
+from .transaction import ApplyTransaction
+from .hunkwindow import plan_windows, splice_windows
 
 VERBOSE = False
+DEFAULT_SMARTAPPLY_CONCURRENCY = 8
+DEFAULT_PROMPT_LAYOUT = "goal-first"
 diff_context = contextvars.ContextVar('diffcontent', default=[])
 
 def create_diff_toolbox():
+    from ai_agent_toolbox import Toolbox
     toolbox = Toolbox()
     diff_context.set([])
     
@@ -61,6 +70,7 @@ You must include the '--- file' and/or '+++ file' part of the diff. File modific
     return toolbox
 
 def create_think_toolbox():
+    from ai_agent_toolbox import Toolbox
     toolbox = Toolbox()
     
     def think(content: str):
@@ -98,6 +108,8 @@ def color_code_diff(diff_text: str) -> str:
 
     return '\n'.join(colorized_lines)
 
+DEFAULT_IGNORE_PATTERNS = (".gitignore", "diff.patch", "prompt.txt", ".*", ".gptignore", "*.pdf", "*.docx", ".git", "*.orig", "*.rej", "*.diff")
+
 def load_gitignore_patterns(gitignore_path):
     with open(gitignore_path, 'r') as f:
         patterns = [
@@ -105,63 +117,162 @@ def load_gitignore_patterns(gitignore_path):
         ]
     return patterns
 
+@functools.lru_cache(maxsize=32)
+def _compiled_matcher(root, patterns):
+    return IgnoreMatcher(root, patterns, ignore_filenames=())
+
 def is_ignored(filepath, gitignore_patterns):
-    filepath = Path(filepath).resolve()
-    ignored = False
-
-    for pattern in gitignore_patterns:
-        if pattern.startswith('!'):
-            negated_pattern = pattern[1:]
-            if fnmatch.fnmatch(str(filepath), negated_pattern) or fnmatch.fnmatch(str(filepath.relative_to(Path.cwd())), negated_pattern):
-                ignored = False
-        else:
-            relative_path = str(filepath.relative_to(Path.cwd()))
-            if fnmatch.fnmatch(str(filepath), pattern) or fnmatch.fnmatch(relative_path, pattern):
-                ignored = True
-                break
-            if pattern in relative_path:
-                ignored = True
-                break
+    """Return True if filepath (absolute or relative to the cwd) matches the patterns.
 
-    # Ensure .gitignore itself is not ignored unless explicitly mentioned
-    if filepath.name == ".gitignore" and not any(pattern == ".gitignore" for pattern in gitignore_patterns):
-        ignored = False
+    The patterns are compiled once per distinct pattern list; see IgnoreMatcher.
+    """
+    matcher = _compiled_matcher(os.getcwd(), tuple(gitignore_patterns))
+    return matcher.is_ignored(os.path.abspath(filepath))
+
+def _ignore_root(path, cwd):
+    """Use cwd as the ignore root unless path lies outside of it."""
+    path = os.path.abspath(path)
+    cwd = os.path.abspath(cwd)
+    if os.path.commonpath([path, cwd]) == cwd:
+        return cwd
+    return path
+
+def build_ignore_matcher(root, extra_patterns=DEFAULT_IGNORE_PATTERNS):
+    """Create an IgnoreMatcher for root seeded with extra_patterns and root's ignore files."""
+    matcher = IgnoreMatcher(root, extra_patterns)
+    matcher.load_directory("")
+    return matcher
+
+def list_files_and_dirs(path, ignore_list=None, workers=None):
+    """Recursively list paths under path, skipping ignored files and directories.
+
+    ignore_list may be an IgnoreMatcher or a list of patterns relative to the cwd.
+    Ignore files found in visited directories are applied to their subtrees.
+    See scan_project_tree for the meaning of workers.
+    """
+    return [item_path for item_path, _ in scan_project_tree(path, ignore_list, workers=workers)]
 
-    return ignored
+def scan_project_tree(path, ignore_list=None, workers=None):
+    """Walk path with os.scandir and return (path, is_file) tuples in pre-order, sorted by name.
 
-def list_files_and_dirs(path, ignore_list=None):
-    if ignore_list is None:
-        ignore_list = []
+    Ignored directories are pruned before they are opened, file types come
+    from the cached DirEntry data, and directories already visited through a
+    symlink (same device and inode) are not descended into again.
 
+    Args:
+        path: Directory to walk
+        ignore_list: IgnoreMatcher, or list of patterns relative to the cwd
+        workers: List directories on a thread pool of this size (useful on
+            network filesystems). Defaults to $GPTDIFF_SCAN_WORKERS, or a
+            sequential walk when unset.
+    """
+    if isinstance(ignore_list, IgnoreMatcher):
+        matcher = ignore_list
+    else:
+        matcher = IgnoreMatcher(_ignore_root(path, os.getcwd()), ignore_list or [])
+    rel_dir = matcher.relative(os.path.abspath(path))
+    if rel_dir is None:
+        raise ValueError(f"{path} is outside of the ignore root {matcher.root}")
+    matcher.load_path(rel_dir)
+    if workers is None:
+        workers = int(os.getenv("GPTDIFF_SCAN_WORKERS", "0") or 0)
+
+    visited = set()
+    visited_lock = Lock()
+
+    def first_visit(dir_path, entry=None):
+        try:
+            st = entry.stat() if entry is not None else os.stat(dir_path)
+        except OSError:
+            return False
+        key = (st.st_dev, st.st_ino)
+        with visited_lock:
+            if key in visited:
+                if VERBOSE:
+                    print(f"Skipping {dir_path}: already visited (symlink loop or duplicate)")
+                return False
+            visited.add(key)
+        return True
+
+    def scan_dir(dir_path, dir_rel):
+        """List one directory: [(item_path, item_rel, is_dir, is_file)] with ignored entries pruned."""
+        matcher.load_directory(dir_rel)
+        entries = []
+        try:
+            with os.scandir(dir_path) as it:
+                for entry in it:
+                    item_rel = f"{dir_rel}/{entry.name}" if dir_rel else entry.name
+                    try:
+                        is_dir = entry.is_dir()
+                        is_file = not is_dir and entry.is_file()
+                    except OSError:
+                        is_dir = is_file = False
+                    if matcher.match(item_rel, is_dir):
+                        continue
+                    if is_dir and not first_visit(entry.path, entry):
+                        continue
+                    entries.append((entry.path, item_rel, is_dir, is_file))
+        except OSError as e:
+            print(f"Skipping directory {dir_path} due to {e}")
+        # scandir order depends on the filesystem; sorting keeps prompts identical across runs.
+        entries.sort(key=lambda item: item[1])
+        return entries
+
+    first_visit(path)
     result = []
+    if workers and workers > 1:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            def scan_and_fan_out(dir_path, dir_rel):
+                # Submit subdirectories right away so listings proceed in parallel;
+                # workers never wait on each other, only collect() below does.
+                return [(item_path, is_file, executor.submit(scan_and_fan_out, item_path, item_rel) if is_dir else None)
+                        for item_path, item_rel, is_dir, is_file in scan_dir(dir_path, dir_rel)]
+
+            def collect(future):
+                for item_path, is_file, child in future.result():
+                    result.append((item_path, is_file))
+                    if child is not None:
+                        collect(child)
+
+            collect(executor.submit(scan_and_fan_out, path, rel_dir))
+    else:
+        def walk(dir_path, dir_rel):
+            for item_path, item_rel, is_dir, is_file in scan_dir(dir_path, dir_rel):
+                result.append((item_path, is_file))
+                if is_dir:
+                    walk(item_path, item_rel)
 
-    # List all items in the current directory
-    for item in os.listdir(path):
-        item_path = os.path.join(path, item)
-
-        if is_ignored(item_path, ignore_list):
-            continue
-
-        # Add the item to the result list
-        result.append(item_path)
-
-        # If it's a directory, recurse into it
-        if os.path.isdir(item_path):
-            result.extend(list_files_and_dirs(item_path, ignore_list))
-
+        walk(path, rel_dir)
     return result
 
 # Function to load project files considering .gitignore
-def load_project_files(project_dir, cwd): 
+def read_project_file(path, cache=None):
+    """Return the text of path, or None if it can't be decoded as text.
+
+    Goes through the FileCache when one is given, so unchanged files are not read again.
+    """
+    if cache is not None:
+        return cache.read_text(path)
+    try:
+        with open(path, 'r') as f:
+            return f.read()
+    except UnicodeDecodeError:
+        return None
+
+def load_project_files(project_dir, cwd, workers=None, cache=None):
     """Load project files while respecting .gitignore and .gptignore rules.
     
-    Recursively scans directories, skipping:
-    - Files/directories matching patterns in .gitignore/.gptignore
+    Recursively scans directories (see scan_project_tree), skipping:
+    - Files/directories matching patterns in .gitignore/.gptignore (including nested ones)
     - Binary files that can't be decoded as UTF-8 text
     
     Args:
         project_dir: Root directory to scan for files
         cwd: Base directory for resolving ignore files
+        workers: Optional thread pool size for directory listing
+        cache: Optional FileCache; unchanged files are served without reading them
     
     Returns:
         List of (absolute_path, file_content) tuples
@@ -169,26 +280,18 @@ def load_project_files(project_dir, cwd):
     Note:
         Prints skipped files to stdout for visibility
     """
-    ignore_paths = [Path(cwd) / ".gitignore", Path(cwd) / ".gptignore"]
-    gitignore_patterns = [".gitignore", "diff.patch", "prompt.txt", ".*", ".gptignore", "*.pdf", "*.docx", ".git", "*.orig", "*.rej", "*.diff"]
-
-    for p in ignore_paths:
-        if p.exists():
-            with open(p, 'r') as f:
-                gitignore_patterns.extend([line.strip() for line in f if line.strip() and not line.startswith('#')])
+    matcher = build_ignore_matcher(_ignore_root(project_dir, cwd))
 
     project_files = []
-    for file in list_files_and_dirs(project_dir, gitignore_patterns):
-        if os.path.isfile(file):
-            try:
-                with open(file, 'r') as f:
-                    content = f.read()
-                if VERBOSE:
-                    print(file)
-                project_files.append((file, content))
-            except UnicodeDecodeError:
+    for file, is_file in scan_project_tree(project_dir, matcher, workers=workers):
+        if is_file:
+            content = read_project_file(file, cache)
+            if content is None:
                 print(f"Skipping file {file} due to UnicodeDecodeError")
                 continue
+            if VERBOSE:
+                print(file)
+            project_files.append((file, content))
 
     print("")
     return project_files
@@ -219,7 +322,10 @@ def _convert_openai_message_to_anthropic(message):
         if not isinstance(block, dict):
             continue
         if block.get("type") == "text":
-            converted_content.append({"type": "text", "text": block.get("text", "")})
+            converted = {"type": "text", "text": block.get("text", "")}
+            if "cache_control" in block:
+                converted["cache_control"] = block["cache_control"]
+            converted_content.append(converted)
         elif block.get("type") == "image_url":
             url = block.get("image_url", {}).get("url", "")
             if url.startswith("data:") and ";base64," in url:
@@ -239,120 +345,368 @@ def _convert_openai_message_to_anthropic(message):
     return {**message, "content": converted_content}
 
 
-def call_llm(api_key, base_url, model, messages, max_tokens, temperature, budget_tokens=None):
-    # Check if we're using Anthropic
-    if "api.anthropic.com" in base_url:
-        anthropic_url = "https://api.anthropic.com/v1/messages"
-        
-        headers = {
-            "x-api-key": api_key,
-            "Content-Type": "application/json",
-            "anthropic-version": "2023-06-01"
-        }
-        
-        # Extract system message if present
-        system_message = None
-        filtered_messages = []
-        
-        for message in messages:
-            if message["role"] == "system":
-                system_message = message["content"]
-            else:
-                filtered_messages.append(message)
-        
-        # Prepare request data
-        filtered_messages = [_convert_openai_message_to_anthropic(m) for m in filtered_messages]
-        data = {
-            "model": model,
-            "messages": filtered_messages,
-            "max_tokens": max_tokens,
-            "temperature": temperature
-        }
-        
-        # Add system message as top-level parameter if found
-        if system_message:
-            data["system"] = system_message
+ANTHROPIC_MESSAGES_URL = "https://api.anthropic.com/v1/messages"
+# Marks the end of a prompt prefix for Anthropic's prompt cache.
+ANTHROPIC_CACHE_CONTROL = {"type": "ephemeral"}
 
-        if budget_tokens:
-            data["temperature"] = 1
-            data["thinking"] = {"budget_tokens": budget_tokens, "type": "enabled"}
-        
-        # Make the API call
-        response = requests.post(anthropic_url, headers=headers, json=data)
-        response_data = response.json()
-        
-        if 'error' in response_data:
-            print(f"Error from Anthropic API: {response_data}")
-            return response_data
-        
-        # Format response to match OpenAI structure for compatibility
-        class OpenAICompatResponse:
-            class Choice:
-                class Message:
-                    def __init__(self, content):
-                        self.content = content
-                
-                def __init__(self, message):
-                    self.message = message
-            
-            class Usage:
-                def __init__(self, prompt_tokens, completion_tokens, total_tokens):
-                    self.prompt_tokens = prompt_tokens
-                    self.completion_tokens = completion_tokens
-                    self.total_tokens = total_tokens
-            
-            def __init__(self, choices, usage):
-                self.choices = choices
-                self.usage = usage
-        
-        # Get content from the response
-        thinking_items = [item["thinking"] for item in response_data["content"] if item["type"] == "thinking"]
-        text_items = [item["text"] for item in response_data["content"] if item["type"] == "text"]
-        if not text_items:
-            raise ValueError("No 'text' type found in response content")
-        text_content = text_items[0]
-        if thinking_items:
-            wrapped_thinking = f"<think>{thinking_items[0]}</think>"
-            message_content = wrapped_thinking + "\n" + text_content
+def _is_anthropic(base_url):
+    return "api.anthropic.com" in (base_url or "")
+
+def _anthropic_request(api_key, model, messages, max_tokens, temperature, budget_tokens=None):
+    """Translate an OpenAI-style chat request into Anthropic (headers, data)."""
+    headers = {
+        "x-api-key": api_key,
+        "Content-Type": "application/json",
+        "anthropic-version": "2023-06-01"
+    }
+
+    # Extract system message if present
+    system_message = None
+    filtered_messages = []
+
+    for message in messages:
+        if message["role"] == "system":
+            system_message = message["content"]
         else:
-            message_content = text_content
-        
-        # Extract token usage information
-        input_tokens = response_data["usage"]["input_tokens"]
-        output_tokens = response_data["usage"]["output_tokens"]
-        total_tokens = input_tokens + output_tokens
-        
-        # Create the response object with usage information
-        message = OpenAICompatResponse.Choice.Message(message_content)
-        choice = OpenAICompatResponse.Choice(message)
-        usage = OpenAICompatResponse.Usage(input_tokens, output_tokens, total_tokens)
+            filtered_messages.append(message)
+
+    # Prepare request data
+    filtered_messages = [_convert_openai_message_to_anthropic(m) for m in filtered_messages]
+    data = {
+        "model": model,
+        "messages": filtered_messages,
+        "max_tokens": max_tokens,
+        "temperature": temperature
+    }
+
+    # Add system message as top-level parameter if found
+    if system_message:
+        data["system"] = system_message
+
+    if budget_tokens:
+        data["temperature"] = 1
+        data["thinking"] = {"budget_tokens": budget_tokens, "type": "enabled"}
+    return headers, data
+
+def _anthropic_compat_response(response_data):
+    """Wrap an Anthropic messages response in the OpenAI response shape used everywhere else."""
+    # Format response to match OpenAI structure for compatibility
+    class OpenAICompatResponse:
+        class Choice:
+            class Message:
+                def __init__(self, content):
+                    self.content = content
+
+            def __init__(self, message):
+                self.message = message
+
+        class Usage:
+            def __init__(self, prompt_tokens, completion_tokens, total_tokens, cache_read_input_tokens=0, cache_creation_input_tokens=0):
+                self.prompt_tokens = prompt_tokens
+                self.completion_tokens = completion_tokens
+                self.total_tokens = total_tokens
+                self.cache_read_input_tokens = cache_read_input_tokens
+                self.cache_creation_input_tokens = cache_creation_input_tokens
+
+        def __init__(self, choices, usage):
+            self.choices = choices
+            self.usage = usage
+
+    # Get content from the response
+    thinking_items = [item["thinking"] for item in response_data["content"] if item["type"] == "thinking"]
+    text_items = [item["text"] for item in response_data["content"] if item["type"] == "text"]
+    if not text_items:
+        raise ValueError("No 'text' type found in response content")
+    text_content = text_items[0]
+    if thinking_items:
+        wrapped_thinking = f"<think>{thinking_items[0]}</think>"
+        message_content = wrapped_thinking + "\n" + text_content
+    else:
+        message_content = text_content
+
+    # Extract token usage information. input_tokens doesn't include the
+    # tokens read from or written to the prompt cache.
+    cache_read = response_data["usage"].get("cache_read_input_tokens") or 0
+    cache_creation = response_data["usage"].get("cache_creation_input_tokens") or 0
+    input_tokens = response_data["usage"]["input_tokens"] + cache_read + cache_creation
+    output_tokens = response_data["usage"]["output_tokens"]
+    total_tokens = input_tokens + output_tokens
+
+    # Create the response object with usage information
+    message = OpenAICompatResponse.Choice.Message(message_content)
+    choice = OpenAICompatResponse.Choice(message)
+    usage = OpenAICompatResponse.Usage(input_tokens, output_tokens, total_tokens, cache_read, cache_creation)
+
+    return OpenAICompatResponse([choice], usage)
+
+def _estimate_prompt_tokens(messages):
+    """Rough prompt size at four characters a token, for pacing without loading tiktoken."""
+    chars = 0
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            chars += len(content)
+        else:
+            chars += sum(len(block.get("text", "")) for block in content if isinstance(block, dict))
+    return chars // 4
+
+def _rate_limited(base_url, model, messages, max_tokens, request, prompt_tokens=None):
+    """Wrap request(timeout) so each attempt first waits for the (base_url, model) rate limit."""
+    limiter = get_rate_limiter(base_url, model)
+    if limiter is None:
+        return request
+    if prompt_tokens is None:
+        prompt_tokens = _estimate_prompt_tokens(messages)
+
+    def attempt(timeout):
+        reserved = limiter.acquire(prompt_tokens + max_tokens)
+        response = request(timeout)
+        limiter.settle(reserved, sum(_usage_counts(response)[:2]))
+        return response
+    return attempt
+
+def _arate_limited(base_url, model, messages, max_tokens, request, prompt_tokens=None):
+    """Async variant of _rate_limited."""
+    limiter = get_rate_limiter(base_url, model)
+    if limiter is None:
+        return request
+    if prompt_tokens is None:
+        prompt_tokens = _estimate_prompt_tokens(messages)
+
+    async def attempt(timeout):
+        reserved = await limiter.aacquire(prompt_tokens + max_tokens)
+        response = await request(timeout)
+        limiter.settle(reserved, sum(_usage_counts(response)[:2]))
+        return response
+    return attempt
+
+def _cached_response(data):
+    """A response object, shaped like the providers' responses, for a cached reply."""
+    from types import SimpleNamespace
+    message = SimpleNamespace(content=data["content"])
+    # Nothing was sent, so no tokens were used.
+    usage = SimpleNamespace(prompt_tokens=0, completion_tokens=0, total_tokens=0)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage, cached=True)
+
+def _response_cache_key(base_url, model, messages, max_tokens, temperature, budget_tokens):
+    """The ResponseCache and key for a request, or (None, None) when it isn't cacheable.
+
+    Only temperature 0 requests are cached: at any other temperature a rerun
+    is expected to sample a new answer.
+    """
+    if temperature:
+        return None, None
+    cache = response_cache()
+    if cache is None:
+        return None, None
+    return cache, ResponseCache.key(model, messages, temperature, max_tokens, base_url, budget_tokens=budget_tokens)
+
+def _store_response(cache, key, response):
+    if hasattr(response, "choices"):
+        cache.put(key, {"content": response.choices[0].message.content})
+    return response
+
+def _cached(base_url, model, messages, max_tokens, temperature, budget_tokens, call):
+    """Return call(), or the response to an identical earlier request from the ResponseCache."""
+    cache, key = _response_cache_key(base_url, model, messages, max_tokens, temperature, budget_tokens)
+    if cache is None:
+        return call()
+    cached = cache.get(key)
+    if cached is not None:
+        return _cached_response(cached)
+    return _store_response(cache, key, call())
+
+async def _acached(base_url, model, messages, max_tokens, temperature, budget_tokens, call):
+    """Async variant of _cached: call() returns an awaitable."""
+    cache, key = _response_cache_key(base_url, model, messages, max_tokens, temperature, budget_tokens)
+    if cache is None:
+        return await call()
+    cached = cache.get(key)
+    if cached is not None:
+        return _cached_response(cached)
+    return _store_response(cache, key, await call())
+
+def call_llm(api_key, base_url, model, messages, max_tokens, temperature, budget_tokens=None, prompt_tokens=None):
+    """Send a chat request and return the response.
+
+    Requests are paced by the (base_url, model) rate limiter when one is
+    configured (see ratelimit.get_rate_limiter), charging prompt_tokens (or an
+    estimate from messages) plus max_tokens, and retried by retry_policy().
+    With $GPTDIFF_LLM_CACHE on, temperature 0 responses are served from the
+    on-disk ResponseCache when the same request was made before.
+    """
+    # Check if we're using Anthropic
+    if _is_anthropic(base_url):
+        anthropic_url = ANTHROPIC_MESSAGES_URL
+        headers, data = _anthropic_request(api_key, model, messages, max_tokens, temperature, budget_tokens)
         
-        return OpenAICompatResponse([choice], usage)
+        # Make the API call over the shared keep-alive session
+        session = get_requests_session(base_url, api_key)
+
+        def send(timeout):
+            response = session.post(anthropic_url, headers=headers, json=data, timeout=(min(10, timeout), timeout))
+            if response.status_code in RETRYABLE_STATUS:
+                raise LLMHTTPError(response.status_code, response.headers, response.text)
+            response_data = response.json()
+
+            if 'error' in response_data:
+                print(f"Error from Anthropic API: {response_data}")
+                return response_data
+
+            return _anthropic_compat_response(response_data)
     else:
-        # Use OpenAI client as before
-        client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
-        return client.chat.completions.create(
-            model=model,
-            messages=messages,
-            max_tokens=max_tokens,
-            temperature=temperature
-        )
+        # Use the shared OpenAI client for this endpoint
+        client = get_openai_client(base_url, api_key)
+
+        def send(timeout):
+            return client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                timeout=timeout
+            )
+    return _cached(base_url, model, messages, max_tokens, temperature, budget_tokens,
+                   lambda: retry_policy().call(_rate_limited(base_url, model, messages, max_tokens, send, prompt_tokens)))
 
-def call_llm_for_diff(system_prompt, user_prompt, files_content, model, temperature=1.0, max_tokens=30000, api_key=None, base_url=None, budget_tokens=None, images=None):
-    enc = tiktoken.get_encoding("o200k_base")
-    
-    # Use colors in print statements
-    red = "\033[91m"
-    green = "\033[92m"
-    blue = "\033[94m"
-    reset = "\033[0m"
-    start_time = time.time()
+def call_llm_stream(api_key, base_url, model, messages, max_tokens, temperature, budget_tokens=None, usage=None, prompt_tokens=None):
+    """Like call_llm, but yield the response text in chunks as the model writes it.
 
-    parser = MarkdownParser()
-    formatter = MarkdownPromptFormatter()
-    toolbox = create_diff_toolbox()
-    #tool_prompt = formatter.usage_prompt(toolbox)
-    tool_prompt="""Save the calculated diff as used in 'git apply'. Should include the file and line number. For example:
+    Thinking output is wrapped in <think></think> the same way call_llm does.
+    If usage is a dict, it receives prompt_tokens and completion_tokens when
+    the provider reports them. The request is paced like call_llm's. Opening
+    the stream is retried like call_llm's request, but once it is open a
+    failure is raised: a retry would repeat text already yielded.
+    """
+    limiter = get_rate_limiter(base_url, model)
+    if limiter is None:
+        yield from _llm_stream_chunks(api_key, base_url, model, messages, max_tokens, temperature, budget_tokens, usage)
+        return
+    if prompt_tokens is None:
+        prompt_tokens = _estimate_prompt_tokens(messages)
+    if usage is None:
+        usage = {}
+    reserved = limiter.acquire(prompt_tokens + max_tokens)
+    received = 0
+    try:
+        for chunk in _llm_stream_chunks(api_key, base_url, model, messages, max_tokens, temperature, budget_tokens, usage):
+            received += len(chunk)
+            yield chunk
+    finally:
+        # A stream that broke off reports no usage: charge what was sent and received so far.
+        used = usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0)
+        limiter.settle(reserved, used or prompt_tokens + received // 4)
+
+def _llm_stream_chunks(api_key, base_url, model, messages, max_tokens, temperature, budget_tokens, usage):
+    if _is_anthropic(base_url):
+        headers, data = _anthropic_request(api_key, model, messages, max_tokens, temperature, budget_tokens)
+        data["stream"] = True
+        session = get_requests_session(base_url, api_key)
+
+        def open_stream(timeout):
+            response = session.post(ANTHROPIC_MESSAGES_URL, headers=headers, json=data, stream=True,
+                                     timeout=(min(10, timeout), timeout))
+            if response.status_code != 200:
+                # An error is a JSON body without "data:" lines; don't mistake it for an empty reply.
+                with response:
+                    raise LLMHTTPError(response.status_code, response.headers, response.text)
+            return response
+
+        with retry_policy().call(open_stream) as response:
+            in_thinking = False
+            for raw in response.iter_lines(decode_unicode=True):
+                if not raw or not raw.startswith("data:"):
+                    continue
+                event = json.loads(raw[len("data:"):].strip())
+                kind = event.get("type")
+                if kind == "error":
+                    raise RuntimeError(f"Error from Anthropic API: {event.get('error')}")
+                if kind == "message_start" and usage is not None:
+                    start_usage = event["message"].get("usage", {})
+                    usage["cache_read_input_tokens"] = start_usage.get("cache_read_input_tokens") or 0
+                    usage["cache_creation_input_tokens"] = start_usage.get("cache_creation_input_tokens") or 0
+                    usage["prompt_tokens"] = (start_usage.get("input_tokens", 0) + usage["cache_read_input_tokens"]
+                                              + usage["cache_creation_input_tokens"])
+                elif kind == "message_delta" and usage is not None:
+                    usage["completion_tokens"] = event.get("usage", {}).get("output_tokens", 0)
+                elif kind == "content_block_delta":
+                    delta = event["delta"]
+                    if delta.get("type") == "thinking_delta":
+                        if not in_thinking:
+                            in_thinking = True
+                            yield "<think>"
+                        yield delta["thinking"]
+                    elif delta.get("type") == "text_delta":
+                        if in_thinking:
+                            in_thinking = False
+                            yield "</think>\n"
+                        yield delta["text"]
+        return
+
+    client = get_openai_client(base_url, api_key)
+    stream = retry_policy().call(lambda timeout: client.chat.completions.create(
+        model=model,
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        stream=True,
+        stream_options={"include_usage": True},
+        timeout=timeout,
+    ))
+    for chunk in stream:
+        if usage is not None and getattr(chunk, "usage", None):
+            usage["prompt_tokens"] = chunk.usage.prompt_tokens or 0
+            usage["completion_tokens"] = chunk.usage.completion_tokens or 0
+            usage["cache_read_input_tokens"] = _prompt_cache_counts(chunk.usage)[0]
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+async def acall_llm(api_key, base_url, model, messages, max_tokens, temperature, budget_tokens=None, timeout=None, prompt_tokens=None):
+    """Async variant of call_llm.
+
+    Waits on the event loop's shared semaphore (see transport.get_async_semaphore)
+    so the number of in-flight requests stays bounded however many tasks call
+    it. Requests are paced, failed attempts retried and responses cached as
+    in call_llm, without holding the semaphore while waiting. timeout, in seconds, limits
+    the whole call including retries and raises asyncio.TimeoutError;
+    cancelling the calling task aborts the request.
+    """
+    import asyncio
+    from .transport import get_async_http_client, get_async_openai_client, get_async_semaphore
+
+    if _is_anthropic(base_url):
+        headers, data = _anthropic_request(api_key, model, messages, max_tokens, temperature, budget_tokens)
+
+        async def send(attempt_timeout):
+            response = await get_async_http_client().post(ANTHROPIC_MESSAGES_URL, headers=headers, json=data,
+                                                          timeout=attempt_timeout)
+            if response.status_code in RETRYABLE_STATUS:
+                raise LLMHTTPError(response.status_code, response.headers, response.text)
+            response_data = response.json()
+            if 'error' in response_data:
+                print(f"Error from Anthropic API: {response_data}")
+                return response_data
+            return _anthropic_compat_response(response_data)
+    else:
+        async def send(attempt_timeout):
+            client = get_async_openai_client(base_url, api_key)
+            return await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                timeout=attempt_timeout
+            )
+
+    async def attempt(attempt_timeout):
+        async with get_async_semaphore():
+            return await asyncio.wait_for(send(attempt_timeout), attempt_timeout)
+
+    attempt = _arate_limited(base_url, model, messages, max_tokens, attempt, prompt_tokens)
+    return await _acached(base_url, model, messages, max_tokens, temperature, budget_tokens,
+                          lambda: asyncio.wait_for(retry_policy().acall(attempt), timeout))
+
+DIFF_TOOL_PROMPT = """Save the calculated diff as used in 'git apply'. Should include the file and line number. For example:
 ```diff
 a/file.py b/file.py
 --- a/file.py
@@ -364,16 +718,56 @@ a/file.py b/file.py
 
 You must include the '--- file' and/or '+++ file' part of the diff. File modifications should include both.
 """
-    system_prompt += "\n" + tool_prompt
+
+def prompt_layout(base_url=None):
+    """Order of the diff prompt for base_url, from $GPTDIFF_PROMPT_LAYOUT.
+
+    "goal-first" sends the goal before the project files. "cache" sends the
+    files first, so runs on the same files share a prompt prefix the provider
+    can cache. When the variable is unset, api.anthropic.com gets "cache",
+    since its files are marked for Anthropic's prompt cache, and every other
+    endpoint gets "goal-first".
+    """
+    layout = os.getenv("GPTDIFF_PROMPT_LAYOUT") or ("cache" if _is_anthropic(base_url) else DEFAULT_PROMPT_LAYOUT)
+    if layout not in ("cache", "goal-first"):
+        raise ValueError(f"GPTDIFF_PROMPT_LAYOUT must be 'cache' or 'goal-first', not {layout!r}")
+    return layout
+
+def _build_diff_messages(system_prompt, user_prompt, files_content, model, base_url, images=None, files_tokens=None):
+    """Assemble the chat messages for a diff request and print the request summary.
+
+    Returns (messages, input token count).
+    """
+    if files_tokens is None:
+        files_tokens = count_tokens(files_content)
+
+    green = "\033[92m"
+    blue = "\033[94m"
+    reset = "\033[0m"
+
+    system_prompt += "\n" + DIFF_TOOL_PROMPT
 
     if 'gemini' in model:
         user_prompt = system_prompt + "\n" + user_prompt
 
-    input_content = system_prompt + "\n" + user_prompt + "\n" + files_content
-    token_count = len(enc.encode(input_content))
-    user_content = user_prompt + "\n" + files_content
+    token_count = count_tokens(system_prompt + "\n" + user_prompt + "\n") + files_tokens
+    if prompt_layout(base_url) == "goal-first":
+        user_content = user_prompt + "\n" + files_content
+    elif _is_anthropic(base_url):
+        # The project files are the same on every call of an agent loop: send
+        # them first and end the cached prefix (system prompt + files) there,
+        # so only the goal is processed anew.
+        content_blocks = []
+        if files_content:
+            content_blocks.append({"type": "text", "text": files_content, "cache_control": ANTHROPIC_CACHE_CONTROL})
+        content_blocks.append({"type": "text", "text": user_prompt})
+        user_content = content_blocks
+    else:
+        # Opted in: OpenAI-compatible providers cache the longest prefix they
+        # have seen before on their own; only the goal follows the files.
+        user_content = files_content + "\n" + user_prompt if files_content else user_prompt
     if images:
-        content_blocks = [{"type": "text", "text": user_content}]
+        content_blocks = user_content if isinstance(user_content, list) else [{"type": "text", "text": user_content}]
         for image in images:
             data_url = f"data:{image['media_type']};base64,{image['data']}"
             content_blocks.append({"type": "image_url", "image_url": {"url": data_url}})
@@ -389,33 +783,21 @@ You must include the '--- file' and/or '+++ file' part of the diff. File modific
         print(f"{green}SYSTEM PROMPT{reset}")
         print(system_prompt)
         print(f"{green}USER PROMPT{reset}")
-        print(user_prompt, "+", len(enc.encode(files_content)), "tokens of file content")
+        print(user_prompt, "+", files_tokens, "tokens of file content")
     else:
         print(f"Generating diff using model '{green}{model}{reset}' from '{blue}{domain_for_url(base_url)}{reset}' with {token_count} input tokens...")
+    return messages, token_count
 
+def _resolve_llm_endpoint(api_key, base_url):
     if not api_key:
         api_key = os.getenv('GPTDIFF_LLM_API_KEY')
     if not base_url:
         base_url = os.getenv('GPTDIFF_LLM_BASE_URL', "https://nano-gpt.com/api/v1/")
     base_url = base_url or "https://nano-gpt.com/api/v1/"
+    return api_key, base_url
 
-    response = call_llm(
-        api_key=api_key,
-        base_url=base_url,
-        model=model,
-        messages=messages,
-        max_tokens=max_tokens,
-        budget_tokens=budget_tokens,
-        temperature=temperature
-    )
-    if VERBOSE:
-        print("Debug: Raw LLM Response\n---")
-        print(response.choices[0].message.content.strip())
-        print("---")
-    else:
-        print("Diff generated.")
-
-    # Robust token usage handling
+def _usage_counts(response):
+    """Return (prompt_tokens, completion_tokens, total_tokens) from any provider's response."""
     prompt_tokens = completion_tokens = total_tokens = 0
     usage = getattr(response, "usage", None)
 
@@ -433,16 +815,102 @@ You must include the '--- file' and/or '+++ file' part of the diff. File modific
         prompt_tokens = pricing.get("inputTokens") or pricing.get("cacheCreationInputTokens") or 0
         completion_tokens = pricing.get("outputTokens", 0)
         total_tokens = prompt_tokens + completion_tokens
+    return prompt_tokens, completion_tokens, total_tokens
 
+def _prompt_cache_counts(usage):
+    """(tokens read from, tokens written to) the provider's prompt cache, from a usage object or dict.
 
+    Anthropic reports cache_read_input_tokens and cache_creation_input_tokens;
+    OpenAI-compatible providers report prompt_tokens_details.cached_tokens and
+    nothing for writes.
+    """
+    def get(value, name):
+        return value.get(name) if isinstance(value, dict) else getattr(value, name, None)
+
+    if usage is None:
+        return 0, 0
+    read = get(usage, "cache_read_input_tokens")
+    details = get(usage, "prompt_tokens_details")
+    if not read and details is not None:
+        read = get(details, "cached_tokens")
+    return read or 0, get(usage, "cache_creation_input_tokens") or 0
+
+def _report_prompt_cache(usage, prompt_tokens):
+    read, written = _prompt_cache_counts(usage)
+    if read or written:
+        message = f"Prompt cache: {read} of {prompt_tokens} input tokens read from cache"
+        if written:
+            message += f", {written} written to cache"
+        print(message + ".")
+
+def _print_elapsed(label, start_time):
     elapsed = time.time() - start_time
     minutes, seconds = divmod(int(elapsed), 60)
     time_str = f"{minutes}m {seconds}s" if minutes else f"{seconds}s"
-    print(f"Diff creation time: {time_str}")
+    print(f"{label}: {time_str}")
 
-    # Now, these rates are updated to per million tokens
+def call_llm_for_diff(system_prompt, user_prompt, files_content, model, temperature=1.0, max_tokens=30000, api_key=None, base_url=None, budget_tokens=None, images=None, files_tokens=None):
+    """Request a diff from the LLM.
+
+    files_tokens is the token count of files_content when the caller already
+    computed it (see tokens.count_file_tokens); otherwise it is counted here once.
+    """
+    start_time = time.time()
 
-    full_response = response.choices[0].message.content.strip()
+    api_key, base_url = _resolve_llm_endpoint(api_key, base_url)
+    messages, prompt_tokens = _build_diff_messages(system_prompt, user_prompt, files_content, model, base_url,
+                                                   images=images, files_tokens=files_tokens)
+
+    response = call_llm(
+        api_key=api_key,
+        base_url=base_url,
+        model=model,
+        messages=messages,
+        max_tokens=max_tokens,
+        budget_tokens=budget_tokens,
+        temperature=temperature,
+        prompt_tokens=prompt_tokens
+    )
+    if VERBOSE:
+        print("Debug: Raw LLM Response\n---")
+        print(response.choices[0].message.content.strip())
+        print("---")
+    else:
+        print("Diff generated.")
+
+    # Robust token usage handling
+    prompt_tokens, completion_tokens, total_tokens = _usage_counts(response)
+    _report_prompt_cache(getattr(response, "usage", None), prompt_tokens)
+
+    _print_elapsed("Diff creation time", start_time)
+
+    full_response, diff_text = _diff_from_response(response.choices[0].message.content)
+    return full_response, diff_text, prompt_tokens, completion_tokens, total_tokens
+
+async def acall_llm_for_diff(system_prompt, user_prompt, files_content, model, temperature=1.0, max_tokens=30000, api_key=None, base_url=None, budget_tokens=None, images=None, files_tokens=None, timeout=None):
+    """Async variant of call_llm_for_diff, with the same return value."""
+    start_time = time.time()
+    api_key, base_url = _resolve_llm_endpoint(api_key, base_url)
+    messages, prompt_tokens = _build_diff_messages(system_prompt, user_prompt, files_content, model, base_url,
+                                                   images=images, files_tokens=files_tokens)
+
+    response = await acall_llm(api_key, base_url, model, messages, max_tokens, temperature,
+                               budget_tokens=budget_tokens, timeout=timeout, prompt_tokens=prompt_tokens)
+    print("Diff generated.")
+    prompt_tokens, completion_tokens, total_tokens = _usage_counts(response)
+    _report_prompt_cache(getattr(response, "usage", None), prompt_tokens)
+    _print_elapsed("Diff creation time", start_time)
+
+    full_response, diff_text = _diff_from_response(response.choices[0].message.content)
+    return full_response, diff_text, prompt_tokens, completion_tokens, total_tokens
+
+def _diff_from_response(content):
+    """Return (full_response, diff_text) extracted from the model's reply."""
+    from ai_agent_toolbox import MarkdownParser
+    parser = MarkdownParser()
+    toolbox = create_diff_toolbox()
+
+    full_response = content.strip()
     full_response, reasoning = swallow_reasoning(full_response)
     if reasoning and len(reasoning) > 0:
         print("Swallowed reasoning", reasoning)
@@ -451,8 +919,135 @@ You must include the '--- file' and/or '+++ file' part of the diff. File modific
     for event in events:
         toolbox.use(event)
     diff_response = diff_context.get()
+    return full_response, "\n".join(diff_response)
+
+def call_llm_for_diff_stream(system_prompt, user_prompt, files_content, model, temperature=1.0, max_tokens=30000, api_key=None, base_url=None, budget_tokens=None, images=None, files_tokens=None, result=None):
+    """Streaming variant of call_llm_for_diff.
+
+    Yields (file_path, patch) as soon as each file's diff is complete in the
+    response, while the model is still writing later files. When the stream
+    ends, the optional result dict receives the same values call_llm_for_diff
+    returns: full_response, diff_text, prompt_tokens, completion_tokens and
+    total_tokens.
+    """
+    start_time = time.time()
+    api_key, base_url = _resolve_llm_endpoint(api_key, base_url)
+    messages, prompt_tokens = _build_diff_messages(system_prompt, user_prompt, files_content, model, base_url,
+                                                   images=images, files_tokens=files_tokens)
+
+    usage = {}
+    chunks = []
+    stream_parser = DiffStreamParser()
+    for chunk in call_llm_stream(api_key, base_url, model, messages, max_tokens, temperature,
+                                 budget_tokens=budget_tokens, usage=usage, prompt_tokens=prompt_tokens):
+        chunks.append(chunk)
+        yield from stream_parser.feed(chunk)
+    yield from stream_parser.close()
+
+    _report_prompt_cache(usage, usage.get("prompt_tokens", 0))
+    _print_elapsed("Diff creation time", start_time)
+    full_response, reasoning = swallow_reasoning("".join(chunks).strip())
+    if reasoning:
+        print("Swallowed reasoning", reasoning)
+    if VERBOSE:
+        print("Debug: Raw LLM Response\n---")
+        print(full_response)
+        print("---")
+    if result is not None:
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+        result.update(
+            full_response=full_response,
+            diff_text=stream_parser.diff_text,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+        )
+
+class DiffStreamParser:
+    """Incrementally split streamed ```diff blocks into per-file patches.
+
+    feed() takes arbitrary text chunks and returns the (file_path, patch) pairs
+    completed so far; close() flushes whatever is left. A file's patch is
+    complete when the next file header starts or its diff block closes.
+    """
 
-    return full_response, "\n".join(diff_response), prompt_tokens, completion_tokens, total_tokens
+    _header_re = re.compile(r'^(?:diff --git\s+)?(a/[^ ]+)\s+(b/[^ ]+)\s*$')
+
+    def __init__(self):
+        self._partial = ""
+        self._in_block = False
+        self._block_lines = []
+        self._file_lines = []
+        self._has_hunk = False
+        self._pending_from = None
+        self.blocks = []
+
+    @property
+    def diff_text(self):
+        """All diff blocks seen so far, joined like the non-streaming diff tool output."""
+        return "\n".join(self.blocks)
+
+    def feed(self, text):
+        lines = (self._partial + text).split("\n")
+        self._partial = lines.pop()
+        completed = []
+        for line in lines:
+            completed.extend(self._line(line))
+        return completed
+
+    def close(self):
+        completed = []
+        if self._partial:
+            completed.extend(self._line(self._partial))
+            self._partial = ""
+        if self._in_block:
+            completed.extend(self._end_block())
+        return completed
+
+    def _line(self, line):
+        stripped = line.strip()
+        if not self._in_block:
+            if stripped.startswith("```diff"):
+                self._in_block = True
+                self._block_lines = []
+            return []
+        if stripped == "```":
+            return self._end_block()
+        self._block_lines.append(line)
+
+        completed = []
+        if self._pending_from is not None:
+            # A "--- " line followed by "+++ " starts a new file.
+            pending, self._pending_from = self._pending_from, None
+            if line.startswith("+++ ") and self._has_hunk:
+                completed.extend(self._flush())
+            self._file_lines.append(pending)
+        if line.startswith("--- "):
+            self._pending_from = line
+            return completed
+        if (line.startswith("diff --git ") or self._header_re.match(line)) and self._file_lines:
+            completed.extend(self._flush())
+        if line.startswith("@@"):
+            self._has_hunk = True
+        self._file_lines.append(line)
+        return completed
+
+    def _end_block(self):
+        if self._pending_from is not None:
+            self._file_lines.append(self._pending_from)
+            self._pending_from = None
+        self.blocks.append("\n".join(self._block_lines))
+        self._block_lines = []
+        self._in_block = False
+        return self._flush()
+
+    def _flush(self):
+        lines, self._file_lines = self._file_lines, []
+        self._has_hunk = False
+        if not lines:
+            return []
+        return [(path, patch) for path, patch in parse_diff_per_file("\n".join(lines))]
 
 # New API functions
 def build_environment(files_dict):
@@ -474,12 +1069,8 @@ def load_images(image_paths):
         images.append({"media_type": media_type, "data": encoded, "path": image_path})
     return images
 
-def generate_diff(environment, goal, model=None, temperature=1.0, max_tokens=32000, api_key=None, base_url=None, prepend=None, anthropic_budget_tokens=None, images=None):
-    """API: Generate a git diff from the environment and goal.
-
-If 'prepend' is provided, it should be a path to a file whose content will be
-prepended to the system prompt.
-    """
+def _diff_request_defaults(model, anthropic_budget_tokens, prepend):
+    """Resolve generate_diff's model, budget and system prompt."""
     if model is None:
         model = os.getenv('GPTDIFF_MODEL', 'deepseek-reasoner')
         # Use ANTHROPIC_BUDGET_TOKENS env var if set and no cli override provided
@@ -498,6 +1089,16 @@ prepended to the system prompt.
     
     diff_tag = "```diff"
     system_prompt = prepend + f"Output a full unified git diff into a \"{diff_tag}\" block."
+    budget_tokens = int(anthropic_budget_tokens) if anthropic_budget_tokens is not None else None
+    return model, budget_tokens, system_prompt
+
+def generate_diff(environment, goal, model=None, temperature=1.0, max_tokens=32000, api_key=None, base_url=None, prepend=None, anthropic_budget_tokens=None, images=None):
+    """API: Generate a git diff from the environment and goal.
+
+If 'prepend' is provided, it should be a path to a file whose content will be
+prepended to the system prompt.
+    """
+    model, budget_tokens, system_prompt = _diff_request_defaults(model, anthropic_budget_tokens, prepend)
     encoded_images = load_images(images)
 
     _, diff_text, _, _, _ = call_llm_for_diff(
@@ -509,26 +1110,83 @@ prepended to the system prompt.
         max_tokens=max_tokens,
         api_key=api_key,
         base_url=base_url,
-        budget_tokens=int(anthropic_budget_tokens) if anthropic_budget_tokens is not None else None,
+        budget_tokens=budget_tokens,
+        images=encoded_images,
+    )
+    return diff_text
+
+def generate_diff_stream(environment, goal, model=None, temperature=1.0, max_tokens=32000, api_key=None, base_url=None, prepend=None, anthropic_budget_tokens=None, images=None):
+    """API: Stream a git diff from the environment and goal, one file at a time.
+
+Takes the same arguments as generate_diff, but yields (file_path, patch) pairs
+as soon as each file's diff is complete, so callers can start applying the
+first files while the model is still writing the rest.
+
+Example:
+    >>> for path, patch in generate_diff_stream(env, "Add type hints"):
+    ...     files = smartapply(patch, files)
+    """
+    model, budget_tokens, system_prompt = _diff_request_defaults(model, anthropic_budget_tokens, prepend)
+    encoded_images = load_images(images)
+
+    yield from call_llm_for_diff_stream(
+        system_prompt,
+        goal,
+        environment,
+        model,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        api_key=api_key,
+        base_url=base_url,
+        budget_tokens=budget_tokens,
+        images=encoded_images,
+    )
+
+async def agenerate_diff(environment, goal, model=None, temperature=1.0, max_tokens=32000, api_key=None, base_url=None, prepend=None, anthropic_budget_tokens=None, images=None, timeout=None):
+    """API: Async variant of generate_diff for use inside an asyncio event loop.
+
+Requests share one async HTTP client per event loop, and a semaphore bounds
+the number in flight ($GPTDIFF_ASYNC_CONCURRENCY, default 16). timeout is in
+seconds and raises asyncio.TimeoutError; cancelling the task aborts the request.
+
+Example:
+    >>> diffs = await asyncio.gather(*(agenerate_diff(env, goal) for env in envs))
+    """
+    model, budget_tokens, system_prompt = _diff_request_defaults(model, anthropic_budget_tokens, prepend)
+    encoded_images = load_images(images)
+
+    _, diff_text, _, _, _ = await acall_llm_for_diff(
+        system_prompt,
+        goal,
+        environment,
+        model,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        api_key=api_key,
+        base_url=base_url,
+        budget_tokens=budget_tokens,
         images=encoded_images,
+        timeout=timeout,
     )
     return diff_text
 
-def smartapply(diff_text, files, model=None, api_key=None, base_url=None):
+def smartapply(diff_text, files, model=None, api_key=None, base_url=None, concurrency=None):
     """Applies unified diffs to file contents with AI-powered conflict resolution.
     
     Key features:
+    - Applies patches that match exactly, or at an offset, without calling the LLM
     - Handles file creations, modifications, and deletions
     - Maintains idempotency - reapplying same diff produces same result
     - Uses LLM to resolve ambiguous changes while preserving context
     - Returns new files dictionary without modifying input
 
     Args:
-        diff_text: Unified diff string compatible with git apply
+        diff_text: Unified diff string compatible with git apply, or a PatchSet
         files: Dictionary of {file_path: content} to modify
         model: LLM to use for conflict resolution (default: deepseek-reasoner)
         api_key: Optional API key override
         base_url: Optional API base URL override
+        concurrency: Files applied at once (default: $GPTDIFF_SMARTAPPLY_CONCURRENCY or 8)
 
     Returns:
         New dictionary with updated file contents. Deleted files are omitted.
@@ -551,34 +1209,101 @@ def smartapply(diff_text, files, model=None, api_key=None, base_url=None):
     """
     if model is None:
         model = os.getenv('GPTDIFF_MODEL', 'deepseek-reasoner')
-    parsed_diffs = parse_diff_per_file(diff_text)    
+    patchset = parse_patchset(diff_text)
     print("-" * 40)
     print("SMARTAPPLY")
     print(diff_text)
     print("-" * 40)
 
+    counts = {"exact": 0, "offset": 0, "total": 0}
+    counts_lock = Lock()
+
     def process_file(path, patch):
         original = files.get(path, '')
         # Handle file deletions
-        if '+++ /dev/null' in patch:
+        if patch.operation == "delete":
             if path in files:
                 del files[path]
-        else:
-            updated = call_llm_for_apply_with_think_tool_available(path, original, patch, model, api_key=api_key, base_url=base_url)
-            cleaned = strip_bad_output(updated, original)
-            files[path] = cleaned
+            return
+        placements = []
+        updated = _deterministic_apply(original, patch, path, placements)
+        with counts_lock:
+            counts["total"] += 1
+            if updated is not None:
+                counts["offset" if any(p.offset for p in placements) else "exact"] += 1
+        if updated is None:
+            try:
+                updated = call_llm_for_apply_windowed(path, original, patch, model, api_key=api_key, base_url=base_url)
+            except Exception as e:
+                print(f"Windowed smartapply failed for {path} ({e}), sending the whole file")
+        if updated is None:
+            updated = call_llm_for_apply_with_think_tool_available(path, original, patch.text, model, api_key=api_key, base_url=base_url)
+            updated = strip_bad_output(updated, original)
+        files[path] = updated
+
+    with ApplyPool(process_file, smartapply_concurrency(concurrency)) as pool:
+        for file_patch in patchset:
+            pool.submit(file_patch.path, file_patch, cost=_apply_cost(len(files.get(file_patch.path, '')), file_patch))
+
+    _report_exact_rate(counts["exact"], counts["total"], counts["offset"])
+    return files
 
-    threads = []
+async def asmartapply(diff_text, files, model=None, api_key=None, base_url=None, timeout=None):
+    """Async variant of smartapply.
 
-    for path, patch in parsed_diffs:
-        thread = threading.Thread(target=process_file, args=(path, patch))
-        thread.start()
-        threads.append(thread)
+    Every file in the diff is applied as a task on the running event loop
+    instead of a thread per file. timeout limits each file's LLM request. If
+    any file fails or the caller is cancelled, the remaining files are
+    cancelled and the error is raised.
 
-    # Wait for all threads to complete
-    for thread in threads:
-        thread.join()
+    Example:
+        >>> updated = await asmartapply(diff, original)
+    """
+    import asyncio
+    if model is None:
+        model = os.getenv('GPTDIFF_MODEL', 'deepseek-reasoner')
+    patchset = parse_patchset(diff_text)
+    print("-" * 40)
+    print("SMARTAPPLY")
+    print(diff_text)
+    print("-" * 40)
+
+    counts = {"exact": 0, "offset": 0, "total": 0}
 
+    async def process_file(path, patch):
+        original = files.get(path, '')
+        # Handle file deletions
+        if patch.operation == "delete":
+            if path in files:
+                del files[path]
+            return
+        placements = []
+        updated = _deterministic_apply(original, patch, path, placements)
+        counts["total"] += 1
+        if updated is not None:
+            counts["offset" if any(p.offset for p in placements) else "exact"] += 1
+        if updated is None:
+            try:
+                updated = await acall_llm_for_apply_windowed(path, original, patch, model, api_key=api_key, base_url=base_url, timeout=timeout)
+            except Exception as e:
+                print(f"Windowed smartapply failed for {path} ({e}), sending the whole file")
+        if updated is None:
+            updated = await acall_llm_for_apply_with_think_tool_available(path, original, patch.text, model, api_key=api_key, base_url=base_url, timeout=timeout)
+            updated = strip_bad_output(updated, original)
+        files[path] = updated
+
+    # The shared semaphore admits waiters in order, so start the largest files first.
+    file_patches = sorted(patchset, key=lambda f: _apply_cost(len(files.get(f.path, '')), f), reverse=True)
+    tasks = [asyncio.ensure_future(process_file(f.path, f)) for f in file_patches]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+    _report_exact_rate(counts["exact"], counts["total"], counts["offset"])
     return files
 
 def parse_arguments():
@@ -604,6 +1329,10 @@ def parse_arguments():
     parser.add_argument('--nowarn', action='store_true', help='Disable large token warning')
     parser.add_argument('--anthropic_budget_tokens', type=int, default=None, help='Budget tokens for Anthropic extended thinking')
     parser.add_argument('--verbose', action='store_true', help='Enable verbose output with detailed information')
+    parser.add_argument('--nocache', action='store_false', dest='cache', default=True, help='Do not use the file content and token cache in .gptdiff/cache')
+    parser.add_argument('--concurrency', type=int, default=None, help='Number of files smartapply works on at once. Overrides GPTDIFF_SMARTAPPLY_CONCURRENCY (default: 8)')
+    parser.add_argument('--stream', action='store_true', help='With --apply, stream the diff and smartapply each file as soon as its diff is complete')
+    parser.add_argument('--atomic', action='store_true', help='Apply all files or none: write results together once every file has applied, leaving the tree untouched if any file fails')
     return parser.parse_args()
 
 def absolute_to_relative(absolute_path):
@@ -615,16 +1344,23 @@ def colorize_warning_warning(message):
     return f"\033[91m\033[1m{message}\033[0m"
 
 def call_llm_for_apply_with_think_tool_available(file_path, original_content, file_diff, model, api_key=None, base_url=None, extra_prompt=None, max_tokens=30000):
+    full_response = call_llm_for_apply(file_path, original_content, file_diff, model, api_key=api_key, base_url=base_url, extra_prompt=extra_prompt, max_tokens=max_tokens)
+    return _strip_think_tool(full_response)
+
+async def acall_llm_for_apply_with_think_tool_available(file_path, original_content, file_diff, model, api_key=None, base_url=None, extra_prompt=None, max_tokens=30000, timeout=None):
+    full_response = await acall_llm_for_apply(file_path, original_content, file_diff, model, api_key=api_key, base_url=base_url, extra_prompt=extra_prompt, max_tokens=max_tokens, timeout=timeout)
+    return _strip_think_tool(full_response)
+
+def _strip_think_tool(full_response):
+    """Drop reasoning and <think> tool calls from a smartapply response."""
+    from ai_agent_toolbox import XMLParser
     parser = XMLParser("think")
-    formatter = XMLPromptFormatter(tag="think")
     toolbox = create_think_toolbox()
-    full_response = call_llm_for_apply(file_path, original_content, file_diff, model, api_key=api_key, base_url=base_url, extra_prompt=extra_prompt, max_tokens=max_tokens)
     full_response, reasoning = swallow_reasoning(full_response)
     if reasoning and len(reasoning) > 0:
         print("Swallowed reasoning", reasoning)
     notool_response = ""
     events = parser.parse(full_response)
-    is_in_tool = False
     appended_content = ""
     for event in events:
         if event.mode == 'append':
@@ -637,6 +1373,134 @@ def call_llm_for_apply_with_think_tool_available(file_path, original_content, fi
 
     return notool_response
 
+def _apply_messages(file_path, original_content, file_diff, model, extra_prompt=None):
+    system_prompt = """Please apply the diff to this file. Return the result in a block. Write the entire file.
+
+1. Carefully apply all changes from the diff
+2. Preserve surrounding context that isn't changed
+3. Only return the final file content, do not add any additional markup and do not add a code block
+4. You must return the entire file. It overwrites the existing file."""
+    user_prompt = f"""File: {file_path}
+File contents:
+```
+{original_content}
+```
+
+Diff to apply:
+```diff
+{file_diff}
+```"""
+    if extra_prompt:
+        user_prompt += f"\n\n{extra_prompt}"
+    if 'gemini' in model:
+        user_prompt = system_prompt+"\n"+user_prompt
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+
+def _apply_window_messages(file_path, excerpt, window, total_lines, model, extra_prompt=None):
+    first, last = window.start + 1, window.end
+    system_prompt = f"""Please apply the diff to this excerpt of a file. The excerpt is lines {first}-{last} of {total_lines}; the rest of the file is not shown and will not change.
+
+1. Carefully apply all changes from the diff
+2. Preserve surrounding context that isn't changed
+3. Only return the updated excerpt, do not add any additional markup and do not add a code block
+4. You must return every line of the excerpt, from its first line to its last. It replaces lines {first}-{last} of the file."""
+    user_prompt = f"""File: {file_path} (lines {first}-{last} of {total_lines})
+Excerpt:
+```
+{excerpt}
+```
+
+Diff to apply:
+```diff
+{window.patch}
+```"""
+    if extra_prompt:
+        user_prompt += f"\n\n{extra_prompt}"
+    if 'gemini' in model:
+        user_prompt = system_prompt+"\n"+user_prompt
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+
+def _window_replacement(response_text, excerpt):
+    updated = strip_bad_output(_strip_think_tool(response_text), excerpt)
+    if excerpt.strip() and not updated.strip():
+        raise ValueError("empty response for a non-empty excerpt")
+    return updated
+
+def _report_windows(file_path, windows, total_lines):
+    sent = sum(window.end - window.start for window in windows)
+    print(f"Smartapply '{file_path}': {len(windows)} window(s), {sent} of {total_lines} lines sent")
+
+def call_llm_for_apply_windowed(file_path, original_content, file_diff, model, api_key=None, base_url=None, extra_prompt=None, max_tokens=30000):
+    """Smartapply a large file one hunk window at a time.
+
+    Sends each hunk with a window of surrounding lines (see hunkwindow) instead
+    of the whole file, and splices the model's updated windows back in.
+    Windows are sent one after another, so a smartapply worker never has more
+    than one request in flight and --concurrency bounds the total.
+    Returns the updated content, or None when the patch can't be windowed and
+    the whole file has to be sent instead.
+    """
+    windows = plan_windows(original_content, file_diff)
+    if not windows:
+        return None
+    if not api_key:
+        api_key = os.getenv('GPTDIFF_LLM_API_KEY')
+    if not base_url:
+        base_url = os.getenv('GPTDIFF_LLM_BASE_URL', "https://nano-gpt.com/api/v1/")
+    lines = original_content.splitlines(keepends=True)
+    _report_windows(file_path, windows, len(lines))
+    start_time = time.time()
+
+    def apply_window(window):
+        excerpt = "".join(lines[window.start:window.end])
+        messages = _apply_window_messages(file_path, excerpt, window, len(lines), model, extra_prompt)
+        response = call_llm(api_key, base_url, model, messages, max_tokens, 0.0)
+        return _window_replacement(response.choices[0].message.content, excerpt)
+
+    replacements = [apply_window(window) for window in windows]
+    _report_apply_time(start_time)
+    return splice_windows(original_content, windows, replacements)
+
+async def acall_llm_for_apply_windowed(file_path, original_content, file_diff, model, api_key=None, base_url=None, extra_prompt=None, max_tokens=30000, timeout=None):
+    """Async variant of call_llm_for_apply_windowed."""
+    import asyncio
+    windows = plan_windows(original_content, file_diff)
+    if not windows:
+        return None
+    if not api_key:
+        api_key = os.getenv('GPTDIFF_LLM_API_KEY')
+    if not base_url:
+        base_url = os.getenv('GPTDIFF_LLM_BASE_URL', "https://nano-gpt.com/api/v1/")
+    lines = original_content.splitlines(keepends=True)
+    _report_windows(file_path, windows, len(lines))
+    start_time = time.time()
+
+    async def apply_window(window):
+        excerpt = "".join(lines[window.start:window.end])
+        messages = _apply_window_messages(file_path, excerpt, window, len(lines), model, extra_prompt)
+        response = await acall_llm(api_key, base_url, model, messages, max_tokens, 0.0, timeout=timeout)
+        return _window_replacement(response.choices[0].message.content, excerpt)
+
+    replacements = await asyncio.gather(*(apply_window(window) for window in windows))
+    _report_apply_time(start_time)
+    return splice_windows(original_content, windows, replacements)
+
+def _report_apply_time(start_time):
+    elapsed = time.time() - start_time
+    minutes, seconds = divmod(int(elapsed), 60)
+    time_str = f"{minutes}m {seconds}s" if minutes else f"{seconds}s"
+    if VERBOSE:
+        print(f"Smartapply time: {time_str}")
+        print("-" * 40)
+    else:
+        print(f"Smartapply completed in {time_str}")
+
 def call_llm_for_apply(file_path, original_content, file_diff, model, api_key=None, base_url=None, extra_prompt=None, max_tokens=30000):
     """AI-powered diff application with conflict resolution.
     
@@ -668,49 +1532,35 @@ def call_llm_for_apply(file_path, original_content, file_diff, model, api_key=No
         ... )
         >>> print(updated)
         def new(): pass"""
-    system_prompt = """Please apply the diff to this file. Return the result in a block. Write the entire file.
-
-1. Carefully apply all changes from the diff
-2. Preserve surrounding context that isn't changed
-3. Only return the final file content, do not add any additional markup and do not add a code block
-4. You must return the entire file. It overwrites the existing file."""
-    user_prompt = f"""File: {file_path}
-File contents:
-```
-{original_content}
-```
+    messages = _apply_messages(file_path, original_content, file_diff, model, extra_prompt)
+    if not api_key:
+        api_key = os.getenv('GPTDIFF_LLM_API_KEY')
+    if not base_url:
+        base_url = os.getenv('GPTDIFF_LLM_BASE_URL', "https://nano-gpt.com/api/v1/")
+    client = get_openai_client(base_url, api_key)
+    start_time = time.time()
+    response = _cached(base_url, model, messages, max_tokens, 0.0, None,
+        lambda: retry_policy().call(_rate_limited(base_url, model, messages, max_tokens,
+            lambda timeout: client.chat.completions.create(model=model,
+                messages=messages,
+                temperature=0.0,
+                max_tokens=max_tokens,
+                timeout=timeout))))
+    full_response = response.choices[0].message.content
+    _report_apply_time(start_time)
+    return full_response
 
-Diff to apply:
-```diff
-{file_diff}
-```"""
-    if extra_prompt:
-        user_prompt += f"\n\n{extra_prompt}"
-    if 'gemini' in model:
-        user_prompt = system_prompt+"\n"+user_prompt
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_prompt},
-    ]
+async def acall_llm_for_apply(file_path, original_content, file_diff, model, api_key=None, base_url=None, extra_prompt=None, max_tokens=30000, timeout=None):
+    """Async variant of call_llm_for_apply."""
+    messages = _apply_messages(file_path, original_content, file_diff, model, extra_prompt)
     if not api_key:
         api_key = os.getenv('GPTDIFF_LLM_API_KEY')
     if not base_url:
         base_url = os.getenv('GPTDIFF_LLM_BASE_URL', "https://nano-gpt.com/api/v1/")
-    client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
     start_time = time.time()
-    response = client.chat.completions.create(model=model,
-        messages=messages,
-        temperature=0.0,
-        max_tokens=max_tokens)
+    response = await acall_llm(api_key, base_url, model, messages, max_tokens, 0.0, timeout=timeout)
     full_response = response.choices[0].message.content
-    elapsed = time.time() - start_time
-    minutes, seconds = divmod(int(elapsed), 60)
-    time_str = f"{minutes}m {seconds}s" if minutes else f"{seconds}s"
-    if VERBOSE:
-        print(f"Smartapply time: {time_str}")
-        print("-" * 40)
-    else:
-        print(f"Smartapply completed in {time_str}")
+    _report_apply_time(start_time)
     return full_response
 
 def build_environment_from_filelist(file_list, cwd):
@@ -730,103 +1580,166 @@ def build_environment_from_filelist(file_list, cwd):
             continue
     return build_environment(files_dict)
 
-def smart_apply_patch(project_dir, diff_text, user_prompt, args):
+def _deterministic_apply(original_content, file_patch, file_path=None, placements=None):
+    """Apply file_patch (a FilePatch or patch text) to original_content without the LLM, or return None.
+
+    Hunks may be found at an offset from their header's line, which is
+    printed; hunks that only apply with fuzz or with whitespace ignored are
+    left to the LLM, as are applications that don't change the content.
+    The result keeps original_content's final newline, or lack of one,
+    unless the patch says "\\ No newline at end of file".
+    If placements is a list, a HunkPlacement is appended for each hunk.
     """
-    Attempt to apply a diff via smartapply: process each file concurrently using the LLM.
+    if not isinstance(file_patch, FilePatch):
+        file_patch = FilePatch(file_path, file_patch)
+    found = []
+    try:
+        updated = apply_patch_to_text(original_content, file_patch, placements=found)
+    except PatchApplyError as e:
+        if VERBOSE:
+            print(f"Deterministic apply failed: {e}")
+        return None
+    if any(placement.fuzz or placement.whitespace for placement in found):
+        if VERBOSE:
+            print(f"Deterministic apply of {file_path or 'patch'} needs fuzz or ignored whitespace, using the LLM")
+        return None
+    if updated == original_content:
+        return None
+    added = [text for hunk in file_patch.hunks for op, text in hunk.ops if op == "+"]
+    if added and all(text.startswith("+") for text in added):
+        # Doubled '+' prefixes are an LLM formatting slip, not file content.
+        return None
+    marked = any(line.startswith("\\") for hunk in file_patch.hunks for line in hunk.lines)
+    if not marked and not original_content.endswith("\n") and updated.endswith("\n"):
+        updated = updated[:-1]
+    for placement in found:
+        if not placement.exact:
+            print(f"{file_path or 'patch'}: {placement}")
+    if placements is not None:
+        placements.extend(found)
+    return updated
+
+def _smart_apply_file(project_dir, file_patch, user_prompt, args, transaction=None):
+    """Apply one FilePatch on disk, exactly if possible and with the LLM otherwise.
+
+    With a transaction, the result is staged in it instead of written.
+    Returns "exact", "offset" or "llm" for the method that succeeded, "failed", or
+    "deleted" for deletions, which are not counted in the smartapply summary.
     """
-    from pathlib import Path
-    start_time = time.time()
-    parsed_diffs = parse_diff_per_file(diff_text)
-    print("Found", len(parsed_diffs), "files in diff, processing smart apply concurrently:")
     green = "\033[92m"
-    red = "\033[91m"
     blue = "\033[94m"
     reset = "\033[0m"
+    file_path = file_patch.path
+    file_diff = file_patch.text
+    full_path = Path(project_dir) / file_path
+    if VERBOSE:
+        print(f"Processing file: {file_path}")
 
-    if len(parsed_diffs) == 0:
-        print(colorize_warning_warning("There were no entries in this diff. The LLM may have returned something invalid."))
-        if args.beep:
-            print("\a")
-        return
-    threads = []
-    success_files = []
-    failed_files = []
-    success_lock = Lock()
-
-    def process_file(file_path, file_diff):
-        full_path = Path(project_dir) / file_path
-        if VERBOSE:
-            print(f"Processing file: {file_path}")
-        if '+++ /dev/null' in file_diff:
-            if full_path.exists():
-                full_path.unlink()
-                print(f"\033[1;32mDeleted file {file_path}.\033[0m")
-            else:
-                print(colorize_warning_warning(f"File {file_path} not found - skipping deletion"))
-            return
+    def write(content):
+        if transaction is not None:
+            transaction.write(full_path, content)
+        else:
+            full_path.parent.mkdir(parents=True, exist_ok=True)
+            full_path.write_text(content)
 
-        original_content = ""
+    if file_patch.operation == "delete":
         if full_path.exists():
-            try:
-                original_content = full_path.read_text()
-            except (UnicodeDecodeError, IOError) as e:
-                print(f"Cannot read {file_path} due to {str(e)}, treating as new file")
+            if transaction is not None:
+                transaction.delete(full_path)
+            else:
+                full_path.unlink()
+            print(f"\033[1;32mDeleted file {file_path}.\033[0m")
         else:
-            print(f"File {file_path} does not exist, treating as new file")
+            print(colorize_warning_warning(f"File {file_path} not found - skipping deletion"))
+        return "deleted"
 
-        # Use SMARTAPPLY-specific environment variables if set, otherwise fallback.
-        # Determine model for smartapply: CLI flag > environment > recommended default
-        if hasattr(args, "applymodel") and args.applymodel:
-            model = args.applymodel
+    original_content = ""
+    readable = True
+    try:
+        # Earlier patches for this file may only be staged in the transaction so far.
+        original_content = transaction.read(full_path) if transaction is not None else full_path.read_text()
+    except FileNotFoundError:
+        print(f"File {file_path} does not exist, treating as new file")
+    except (UnicodeDecodeError, IOError) as e:
+        readable = False
+        print(f"Cannot read {file_path} due to {str(e)}, treating as new file")
+
+    placements = []
+    updated_content = _deterministic_apply(original_content, file_patch, file_path, placements) if readable else None
+    if updated_content is not None:
+        write(updated_content)
+        if any(placement.offset for placement in placements):
+            print(f"\033[1;32mApplied {file_path} at an offset, without the LLM.\033[0m")
+            return "offset"
+        print(f"\033[1;32mApplied {file_path} exactly, without the LLM.\033[0m")
+        return "exact"
+
+    # Use SMARTAPPLY-specific environment variables if set, otherwise fallback.
+    # Determine model for smartapply: CLI flag > environment > recommended default
+    if hasattr(args, "applymodel") and args.applymodel:
+        model = args.applymodel
+    else:
+        smart_apply_model = os.getenv("GPTDIFF_SMARTAPPLY_MODEL", "").strip()
+        if smart_apply_model:
+            model = smart_apply_model
         else:
-            smart_apply_model = os.getenv("GPTDIFF_SMARTAPPLY_MODEL", "").strip()
-            if smart_apply_model:
-                model = smart_apply_model
-            else:
-                model = 'openai/gpt-4.1-mini'
+            model = 'openai/gpt-4.1-mini'
 
-        smart_api_key = os.getenv("GPTDIFF_SMARTAPPLY_API_KEY")
-        if smart_api_key and smart_api_key.strip():
-            api_key = smart_api_key
-        else:
-            api_key = os.getenv("GPTDIFF_LLM_API_KEY")
+    smart_api_key = os.getenv("GPTDIFF_SMARTAPPLY_API_KEY")
+    if smart_api_key and smart_api_key.strip():
+        api_key = smart_api_key
+    else:
+        api_key = os.getenv("GPTDIFF_LLM_API_KEY")
 
-        smart_base_url = os.getenv("GPTDIFF_SMARTAPPLY_BASE_URL")
-        if smart_base_url and smart_base_url.strip():
-            base_url = smart_base_url
-        else:
-            base_url = os.getenv("GPTDIFF_LLM_BASE_URL", "https://nano-gpt.com/api/v1/")
+    smart_base_url = os.getenv("GPTDIFF_SMARTAPPLY_BASE_URL")
+    if smart_base_url and smart_base_url.strip():
+        base_url = smart_base_url
+    else:
+        base_url = os.getenv("GPTDIFF_LLM_BASE_URL", "https://nano-gpt.com/api/v1/")
 
-        print(f"Running smartapply in parallel for '{file_path}' using model '{green}{model}{reset}' from '{blue}{domain_for_url(base_url)}{reset}'...")
-        try:
+    print(f"Running smartapply in parallel for '{file_path}' using model '{green}{model}{reset}' from '{blue}{domain_for_url(base_url)}{reset}'...")
+    extra_prompt = f"This changeset is from the following instructions:\n{user_prompt}"
+    try:
+        updated_content = None
+        if readable:
+            try:
+                updated_content = call_llm_for_apply_windowed(
+                    file_path, original_content, file_patch, model,
+                    api_key=api_key, base_url=base_url,
+                    extra_prompt=extra_prompt, max_tokens=args.max_tokens)
+            except Exception as e:
+                print(colorize_warning_warning(f"Windowed smartapply failed for {file_path} ({e}), sending the whole file"))
+        if updated_content is None:
             updated_content = call_llm_for_apply_with_think_tool_available(
                 file_path, original_content, file_diff, model,
                 api_key=api_key, base_url=base_url,
-                extra_prompt=f"This changeset is from the following instructions:\n{user_prompt}",
+                extra_prompt=extra_prompt,
                 max_tokens=args.max_tokens)
-            if updated_content.strip() == "":
-                print("Cowardly refusing to write empty file to", file_path, "merge failed")
-                with success_lock:
-                    failed_files.append(file_path)
-                return
-            full_path.parent.mkdir(parents=True, exist_ok=True)
-            if updated_content and not updated_content.endswith("\n"):
-                updated_content += "\n"
-            full_path.write_text(updated_content)
-            print(f"\033[1;32mSuccessful 'smartapply' update {file_path}.\033[0m")
-            with success_lock:
-                success_files.append(file_path)
-        except Exception as e:
-            print(f"\033[1;31mFailed to process {file_path}: {str(e)}\033[0m")
-            with success_lock:
-                failed_files.append(file_path)
-
-    for file_path, file_diff in parsed_diffs:
-        thread = threading.Thread(target=process_file, args=(file_path, file_diff))
-        thread.start()
-        threads.append(thread)
-    for thread in threads:
-        thread.join()
+        if updated_content.strip() == "":
+            print("Cowardly refusing to write empty file to", file_path, "merge failed")
+            return "failed"
+        if updated_content and not updated_content.endswith("\n"):
+            updated_content += "\n"
+        write(updated_content)
+        print(f"\033[1;32mSuccessful 'smartapply' update {file_path}.\033[0m")
+        return "llm"
+    except Exception as e:
+        print(f"\033[1;31mFailed to process {file_path}: {str(e)}\033[0m")
+        return "failed"
+
+def _report_exact_rate(exact, total, offset=0):
+    if total:
+        shifted = f", {offset} more at an offset" if offset else ""
+        print(f"Deterministic apply: {exact}/{total} files applied exactly without the LLM ({exact / total:.0%}){shifted}")
+
+def _report_llm_stats():
+    for summary in (retry_stats().summary(), pacing_summary(), response_cache_summary()):
+        if summary:
+            print(colorize_warning_warning(summary))
+
+def _report_smart_apply(start_time, success_files, failed_files, args, exact_count=0, offset_count=0):
+    _report_exact_rate(exact_count, len(success_files) + len(failed_files), offset_count)
+    _report_llm_stats()
     elapsed = time.time() - start_time
     minutes, seconds = divmod(int(elapsed), 60)
     time_str = f"{minutes}m {seconds}s" if minutes else f"{seconds}s"
@@ -841,6 +1754,97 @@ def smart_apply_patch(project_dir, diff_text, user_prompt, args):
     if args.beep:
         print("\a")
 
+def smart_apply_patch(project_dir, diff_text, user_prompt, args):
+    """
+    Attempt to apply a diff (text or PatchSet) via smartapply: each file is
+    applied exactly when its patch matches, and concurrently with the LLM
+    otherwise.
+    """
+    start_time = time.time()
+    parsed_diffs = parse_patchset(diff_text)
+    print("Found", len(parsed_diffs), "files in diff, processing smart apply with",
+          smartapply_concurrency(getattr(args, "concurrency", None)), "workers:")
+
+    if len(parsed_diffs) == 0:
+        print(colorize_warning_warning("There were no entries in this diff. The LLM may have returned something invalid."))
+        if args.beep:
+            print("\a")
+        return
+    return smart_apply_stream(project_dir, parsed_diffs, user_prompt, args, start_time=start_time)
+
+def smartapply_concurrency(concurrency=None):
+    """Number of files smartapply works on at once: argument, $GPTDIFF_SMARTAPPLY_CONCURRENCY, or 8."""
+    if concurrency:
+        return int(concurrency)
+    env_value = os.getenv("GPTDIFF_SMARTAPPLY_CONCURRENCY", "").strip()
+    return int(env_value) if env_value else DEFAULT_SMARTAPPLY_CONCURRENCY
+
+def _apply_cost(original_size, file_patch):
+    # Smartapply time grows with the tokens sent and rewritten: the whole file plus the patch.
+    return original_size + len(file_patch.text)
+
+def smart_apply_stream(project_dir, file_patches, user_prompt, args, start_time=None):
+    """
+    Smartapply FilePatches or (path, patch) pairs as they arrive, e.g. from
+    call_llm_for_diff_stream.
+
+    Files are applied by at most --concurrency workers, largest first among
+    those waiting, starting as soon as they are received while the iterator
+    may still be producing later files. Patches for the same path are applied
+    in order. With args.atomic, results are staged and written together once
+    every file has succeeded; if any file fails, no file is changed.
+    """
+    if start_time is None:
+        start_time = time.time()
+    success_files = []
+    failed_files = []
+    progress_lock = Lock()
+    progress = {"received": 0, "done": 0, "exact": 0, "offset": 0}
+    transaction = ApplyTransaction() if getattr(args, "atomic", False) else None
+
+    def process_file(file_path, file_patch):
+        file_start = time.time()
+        result = _smart_apply_file(project_dir, file_patch, user_prompt, args, transaction=transaction)
+        with progress_lock:
+            progress["done"] += 1
+            if result == "failed":
+                failed_files.append(file_path)
+            elif result != "deleted":
+                success_files.append(file_path)
+                if result in ("exact", "offset"):
+                    progress[result] += 1
+            status = {"exact": "applied exactly", "offset": "applied at an offset", "llm": "applied",
+                      "failed": "\033[1;31mfailed\033[0m", "deleted": "deleted"}[result]
+            print(f"[{progress['done']}/{progress['received']}] {status} {file_path} ({time.time() - file_start:.1f}s)")
+
+    concurrency = smartapply_concurrency(getattr(args, "concurrency", None))
+    with ApplyPool(process_file, concurrency) as pool:
+        for file_patch in file_patches:
+            if not isinstance(file_patch, FilePatch):
+                file_patch = FilePatch(*file_patch)
+            full_path = Path(project_dir) / file_patch.path
+            original_size = full_path.stat().st_size if full_path.is_file() else 0
+            with progress_lock:
+                progress["received"] += 1
+            pool.submit(file_patch.path, file_patch, cost=_apply_cost(original_size, file_patch))
+
+    if not progress["received"]:
+        print(colorize_warning_warning("There were no entries in this diff. The LLM may have returned something invalid."))
+        return
+    if transaction is not None:
+        if failed_files:
+            print(f"\033[1;31mAtomic apply: {len(failed_files)} files failed, so no files were changed.\033[0m")
+            failed_files.extend(success_files)
+            success_files = []
+        else:
+            try:
+                transaction.commit()
+            except OSError as e:
+                print(f"\033[1;31mAtomic apply: writing files failed ({e}), so no files were changed.\033[0m")
+                failed_files, success_files = success_files, []
+    _report_smart_apply(start_time, success_files, failed_files, args, exact_count=progress["exact"],
+                        offset_count=progress["offset"])
+
 def save_files(files_dict, target_directory):
     """
     Save files from a dictionary mapping relative file paths to file contents
@@ -883,25 +1887,28 @@ def main():
 
     user_prompt = sys.argv[1]
     project_dir = os.getcwd()
-    enc = tiktoken.get_encoding("o200k_base")
-
     try:
         encoded_images = load_images(args.image)
     except FileNotFoundError as e:
         print(f"\033[1;31mError loading image: {e}\033[0m")
         sys.exit(1)
 
+    file_cache = FileCache.open() if args.cache else None
+
     # Load project files, defaulting to current working directory if no additional paths are specified
     if not args.files:
-        project_files = load_project_files(project_dir, project_dir)
+        project_files = load_project_files(project_dir, project_dir, cache=file_cache)
     else:
         project_files = []
         for additional_path in args.files:
             if os.path.isfile(additional_path):
-                with open(additional_path, 'r') as f:
-                    project_files.append((additional_path, f.read()))
+                content = read_project_file(additional_path, file_cache)
+                if content is None:
+                    print(f"Skipping file {additional_path} due to UnicodeDecodeError")
+                    continue
+                project_files.append((additional_path, content))
             elif os.path.isdir(additional_path):
-                project_files.extend(load_project_files(additional_path, project_dir))
+                project_files.extend(load_project_files(additional_path, project_dir, cache=file_cache))
 
     if args.prepend:
         prepend = args.prepend+"\n"
@@ -927,14 +1934,29 @@ def main():
 
     system_prompt = prepend + f"Output a full unified git diff into a ```diff block(diff --git ...)"
 
-    files_content = ""
-    for file, content in project_files:
-        if VERBOSE:
-            print(f"Including {len(enc.encode(content)):5d} tokens", absolute_to_relative(file))
-        files_content += f"File: {absolute_to_relative(file)}\nContent:\n{content}\n"
+    # Each file is encoded once (or served from the cache); the prompt total is a sum.
+    file_token_counts = count_file_tokens(project_files, file_cache)
+    if file_cache is not None:
+        file_cache.close()
 
-    full_prompt = f"{system_prompt}\n\n{user_prompt}\n\n{files_content}"
-    token_count = len(enc.encode(full_prompt))
+    content_parts = []
+    header_parts = []
+    for (file, content), tokens in zip(project_files, file_token_counts):
+        if VERBOSE:
+            print(f"Including {tokens:5d} tokens", absolute_to_relative(file))
+        header = f"File: {absolute_to_relative(file)}\nContent:\n"
+        header_parts.append(header)
+        content_parts.append(f"{header}{content}\n")
+    files_content = "".join(content_parts)
+
+    base_url = os.getenv('GPTDIFF_LLM_BASE_URL', "https://nano-gpt.com/api/v1/")
+    # The copied prompt is laid out as it would be sent to the configured endpoint.
+    if prompt_layout(base_url) == "goal-first":
+        full_prompt = f"{system_prompt}\n\n{user_prompt}\n\n{files_content}"
+    else:
+        full_prompt = f"{system_prompt}\n\n{files_content}\n\n{user_prompt}"
+    files_tokens = sum(file_token_counts) + count_tokens("\n".join(header_parts))
+    token_count = count_tokens(f"{system_prompt}\n\n{user_prompt}\n\n") + files_tokens
     if args.model is None:
         args.model = os.getenv('GPTDIFF_MODEL', 'deepseek-reasoner')
 
@@ -1003,14 +2025,28 @@ def main():
             if confirmation != 'y':
                 print("Request canceled")
                 sys.exit(0)
-        full_text, diff_text, prompt_tokens, completion_tokens, total_tokens = call_llm_for_diff(system_prompt, user_prompt, files_content, args.model,
-                                                                                                temperature=args.temperature,
-                                                                                                api_key=os.getenv('GPTDIFF_LLM_API_KEY'),
-                                                                                                base_url=os.getenv('GPTDIFF_LLM_BASE_URL', "https://nano-gpt.com/api/v1/"),
-                                                                                                max_tokens=args.max_tokens,
-                                                                                                budget_tokens=args.anthropic_budget_tokens,
-                                                                                                images=encoded_images
-                                                                                                )
+        llm_kwargs = dict(temperature=args.temperature,
+                          api_key=os.getenv('GPTDIFF_LLM_API_KEY'),
+                          base_url=base_url,
+                          max_tokens=args.max_tokens,
+                          budget_tokens=args.anthropic_budget_tokens,
+                          images=encoded_images,
+                          files_tokens=files_tokens)
+        if args.apply and args.stream:
+            # Smartapply each file while the model is still writing the rest of the diff.
+            print("\033[94m**Streaming diff, applying each file as soon as it is complete...**\033[0m")
+            result = {}
+            file_patches = call_llm_for_diff_stream(system_prompt, user_prompt, files_content, args.model,
+                                                    result=result, **llm_kwargs)
+            smart_apply_stream(project_dir, file_patches, user_prompt, args)
+            full_text = result["full_response"]
+            diff_text = result["diff_text"]
+            prompt_tokens = result["prompt_tokens"]
+            completion_tokens = result["completion_tokens"]
+            total_tokens = result["total_tokens"]
+        else:
+            full_text, diff_text, prompt_tokens, completion_tokens, total_tokens = call_llm_for_diff(
+                system_prompt, user_prompt, files_content, args.model, **llm_kwargs)
 
     if(diff_text.strip() == ""):
         print(f"\033[1;33mWarning: No valid diff data was generated. This could be due to an unclear prompt or an invalid LLM response.\033[0m")
@@ -1020,7 +2056,7 @@ def main():
             print("\a")
         return
 
-    elif args.apply:
+    elif args.apply and not args.stream:
         print("\nAttempting apply with the following diff:")
         print(color_code_diff(diff_text))
         print("\033[94m**Attempting to apply patch using basic method...**\033[0m")
@@ -1044,6 +2080,9 @@ def main():
         print(f"- Model used: {green}{args.model}{reset}")
     else:
         print(f"API Usage: {total_tokens} tokens, Model used: {green}{args.model}{reset}")
+    if not args.apply:
+        # With --apply, the smartapply summary has already reported these.
+        _report_llm_stats()
 
 def swallow_reasoning(full_response: str) -> (str, str):
     """
@@ -13,7 +13,10 @@ This tool uses the same patch-application logic as gptdiff.
 import sys
 import argparse
 from pathlib import Path
-from gptdiff.gptdiff import apply_diff, smart_apply_patch, color_code_diff
+from gptdiff.applydiff import apply_diff, parse_patchset
+
+# gptdiff.gptdiff (and the LLM client libraries it loads) is imported only when
+# smart apply or verbose output needs it, so `gptpatch --dumb` starts quickly.
 
 def parse_arguments():
     parser = argparse.ArgumentParser(
@@ -51,37 +54,48 @@ def parse_arguments():
     )
     parser.add_argument('--verbose', action='store_true', help='Enable verbose output with detailed information')
     parser.add_argument('--dumb', action='store_true', default=False, help='Attempt dumb apply before trying smart apply')
+    parser.add_argument('--check', action='store_true', help='Like git apply --check: report whether each file and hunk would apply, and which files would need smartapply, without writing anything. Exits 1 if any file would not apply.')
+    parser.add_argument('--atomic', action='store_true', help='Smart apply all files or none: write results together once every file has applied, leaving the tree untouched if any file fails')
     return parser.parse_args()
 
-def main():
-    args = parse_arguments()
+def _smart_apply_patch(project_dir, diff_text, args):
     import gptdiff.gptdiff as gd
     gd.VERBOSE = args.verbose
+    gd.smart_apply_patch(project_dir, diff_text, "", args)
+
+def main():
+    args = parse_arguments()
+    # Parse once; both the dumb and smart paths take the PatchSet.
     if args.diff:
-        diff_text = args.diff
+        patchset = parse_patchset(args.diff)
     else:
         diff_path = Path(args.diff_file)
         if not diff_path.exists():
             print(f"Error: Diff file '{args.diff_file}' does not exist.")
             sys.exit(1)
-        diff_text = diff_path.read_text(encoding="utf8")
+        # The file is parsed as it is read, so a huge diff is never held whole.
+        with diff_path.open(encoding="utf8") as diff_file:
+            patchset = parse_patchset(diff_file)
 
     project_dir = args.project_dir
 
     if args.verbose:
+        from gptdiff.gptdiff import color_code_diff
         print("\n\033[1;34mDiff to be applied:\033[0m")
-        print(color_code_diff(diff_text))
+        print(color_code_diff(args.diff or str(patchset)))
         print("")
 
+    if args.check:
+        sys.exit(0 if apply_diff(project_dir, patchset, check=True) else 1)
     if args.dumb:
-        success = apply_diff(project_dir, diff_text)
+        success = apply_diff(project_dir, patchset)
         if success:
             print("\033[1;32m✅ Diff applied successfully.\033[0m")
         else:
             print("\033[1;31m❌ Failed to apply diff using git apply. Attempting smart apply.\033[0m")
-            smart_apply_patch(project_dir, diff_text, "", args)
+            _smart_apply_patch(project_dir, patchset, args)
     else:
-        smart_apply_patch(project_dir, diff_text, "", args)
+        _smart_apply_patch(project_dir, patchset, args)
         
 if __name__ == "__main__":
     main()
@@ -0,0 +1,113 @@
+"""
+Module: hunkwindow
+
+Plans windowed smartapply for large files.
+
+Instead of sending a whole file to the model and asking for it back, each
+hunk of the patch is located in the original and only a window of lines
+around it is sent. The model returns the updated window, which is spliced
+back into the file. Hunks whose windows overlap share one window; a patch
+falls back to whole-file apply (plan_windows returns None) when a hunk
+cannot be located or two hunks claim the same lines.
+"""
+
+import os
+
+from .applydiff import LineIndex, hunk_placements, split_hunks
+
+DEFAULT_CONTEXT_LINES = 40
+# Files shorter than this are cheap enough to send whole.
+MIN_WINDOWED_LINES = 200
+
+class HunkWindow:
+    """Lines [start, end) of the original, and the hunks that fall inside them."""
+    __slots__ = ("start", "end", "hunks")
+
+    def __init__(self, start, end, hunks):
+        self.start = start
+        self.end = end
+        self.hunks = hunks
+
+    @property
+    def patch(self):
+        return "\n".join(hunk.text for hunk in self.hunks)
+
+
+def context_lines():
+    """Lines of context sent around each hunk, from $GPTDIFF_SMARTAPPLY_WINDOW. 0 disables windowing."""
+    return int(os.getenv("GPTDIFF_SMARTAPPLY_WINDOW", DEFAULT_CONTEXT_LINES))
+
+
+def locate_hunks(lines, patch):
+    """Return the (start, end) lines of the original that each hunk of patch changes.
+
+    Hunks are placed as apply_patch_to_lines would place them (offset,
+    whitespace and fuzz included). A hunk that can't be placed because it
+    has drifted from the file is anchored on its longest line, if that line
+    occurs once. Returns None if any hunk can't be located.
+    """
+    index = LineIndex(lines)
+    spans = []
+    for hunk, _, placed in hunk_placements(lines, patch):
+        if placed is not None:
+            start = placed[0] - placed[1]
+            spans.append((start, min(len(lines), start + hunk.old_count)))
+            continue
+        old = hunk.old_lines
+        if not hunk.valid or not old:
+            return None
+        anchor = max(range(len(old)), key=lambda i: len(old[i].strip()))
+        if len(old[anchor].strip()) < 8:
+            return None
+        matches = index.occurrences(old[anchor], loose=True)
+        if len(matches) != 1:
+            return None
+        start = max(0, matches[0] - anchor)
+        spans.append((start, min(len(lines), start + len(old))))
+    return spans
+
+
+def plan_windows(original_text, patch, context=None):
+    """Return the HunkWindows for patch on original_text, or None for whole-file apply."""
+    if context is None:
+        context = context_lines()
+    lines = original_text.splitlines(keepends=True)
+    if context <= 0 or len(lines) < MIN_WINDOWED_LINES:
+        return None
+    hunks = split_hunks(patch)
+    if not hunks:
+        return None
+    spans = locate_hunks(lines, patch)
+    if spans is None:
+        return None
+    located = sorted(zip(spans, hunks), key=lambda item: item[0])
+
+    windows = []
+    previous_end = -1
+    for (start, end), hunk in located:
+        if start < previous_end:
+            # Two hunks claim the same lines.
+            return None
+        previous_end = end
+        window_start = max(0, start - context)
+        window_end = min(len(lines), end + context)
+        if windows and window_start <= windows[-1].end:
+            windows[-1].end = max(windows[-1].end, window_end)
+            windows[-1].hunks.append(hunk)
+        else:
+            windows.append(HunkWindow(window_start, window_end, [hunk]))
+    return windows
+
+
+def splice_windows(original_text, windows, replacements):
+    """Replace each window's lines in original_text with its replacement text."""
+    lines = original_text.splitlines(keepends=True)
+    for window, replacement in sorted(zip(windows, replacements), key=lambda item: item[0].start, reverse=True):
+        new_lines = replacement.splitlines(keepends=True)
+        if new_lines and not new_lines[-1].endswith("\n") and window.end < len(lines):
+            new_lines[-1] += "\n"
+        lines[window.start:window.end] = new_lines
+    content = "".join(lines)
+    if original_text.endswith("\n") and content and not content.endswith("\n"):
+        content += "\n"
+    return content
@@ -0,0 +1,323 @@
+"""
+Module: ignore
+
+Compiled .gitignore / .gptignore matching.
+
+Patterns are compiled once into a small number of rule groups (literal name
+sets, suffix tuples and one combined regex per group) so that checking a path
+costs a few dict lookups and at most one regex match per group instead of an
+fnmatch call per pattern.
+
+Supported gitignore semantics:
+- blank lines and ``#`` comments are skipped, ``\\#`` / ``\\!`` escapes
+- ``!pattern`` negation, where the last matching pattern wins
+- a trailing ``/`` restricts the rule to directories
+- a leading or inner ``/`` anchors the rule to the directory of its ignore file
+- ``*``, ``?``, ``[...]``, leading ``**/``, inner ``/**/`` and trailing ``/**``
+- nested ignore files, whose rules override those of their parent directories
+- contents of an ignored directory are ignored as well
+"""
+
+import os
+import re
+import threading
+
+IGNORE_FILENAMES = (".gitignore", ".gptignore")
+
+_GLOB_CHARS = re.compile(r"[*?\[\\]")
+
+
+def parse_ignore_lines(lines):
+    """Return the effective patterns from the lines of an ignore file."""
+    patterns = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if not line or line.startswith("#"):
+            continue
+        # Trailing spaces are ignored unless escaped with a backslash.
+        stripped = line.rstrip(" ")
+        if stripped.endswith("\\") and len(stripped) < len(line):
+            stripped += " "
+        if stripped.strip():
+            patterns.append(stripped)
+    return patterns
+
+
+def _translate(body):
+    """Translate a gitignore glob (without anchors/slashes stripped) into a regex."""
+    out = []
+    i = 0
+    n = len(body)
+    while i < n:
+        c = body[i]
+        if c == "*":
+            if body.startswith("**", i):
+                at_start = i == 0 or body[i - 1] == "/"
+                j = i + 2
+                at_end = j == n or body[j] == "/"
+                if at_start and at_end:
+                    if j == n:
+                        # Trailing "/**": everything inside.
+                        out.append(".*")
+                    else:
+                        # Leading "**/" or inner "/**/": zero or more directories.
+                        out.append("(?:.*/)?")
+                        j += 1
+                    i = j
+                    continue
+                # Other consecutive asterisks behave like a single "*".
+                while i < n and body[i] == "*":
+                    i += 1
+                out.append("[^/]*")
+                continue
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            j = i + 1
+            if j < n and body[j] in "!^":
+                j += 1
+            if j < n and body[j] == "]":
+                j += 1
+            while j < n and body[j] != "]":
+                j += 1
+            if j >= n:
+                out.append(re.escape(c))
+            else:
+                inner = body[i + 1:j]
+                if inner[:1] in ("!", "^"):
+                    inner = "^" + inner[1:]
+                out.append("[" + inner.replace("\\", "\\\\") + "]")
+                i = j
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            out.append(re.escape(body[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+class _RuleGroup:
+    """A run of consecutive patterns sharing the same sign (ignore or negate)."""
+
+    __slots__ = ("negate", "names", "dir_names", "suffixes", "dir_suffixes", "regexes", "dir_regexes",
+                 "regex", "dir_regex")
+
+    def __init__(self, negate):
+        self.negate = negate
+        self.names = set()
+        self.dir_names = set()
+        self.suffixes = []
+        self.dir_suffixes = []
+        self.regexes = []
+        self.dir_regexes = []
+        self.regex = None
+        self.dir_regex = None
+
+    def compile(self):
+        self.suffixes = tuple(self.suffixes)
+        self.dir_suffixes = tuple(self.dir_suffixes)
+        if self.regexes:
+            self.regex = re.compile("|".join(f"(?:{r})" for r in self.regexes), re.DOTALL)
+        if self.dir_regexes:
+            self.dir_regex = re.compile("|".join(f"(?:{r})" for r in self.dir_regexes), re.DOTALL)
+
+    def matches(self, rel_path, name, is_dir):
+        if name in self.names or (self.suffixes and name.endswith(self.suffixes)):
+            return True
+        if self.regex is not None and self.regex.match(rel_path):
+            return True
+        if is_dir:
+            if name in self.dir_names or (self.dir_suffixes and name.endswith(self.dir_suffixes)):
+                return True
+            if self.dir_regex is not None and self.dir_regex.match(rel_path):
+                return True
+        return False
+
+
+class _RuleSet:
+    """Compiled patterns from one source, scoped to a base directory."""
+
+    __slots__ = ("base", "prefix", "groups")
+
+    def __init__(self, patterns, base=""):
+        self.base = base
+        self.prefix = base + "/" if base else ""
+        self.groups = []
+        for pattern in patterns:
+            self._add(pattern)
+        for group in self.groups:
+            group.compile()
+
+    def _add(self, pattern):
+        negate = False
+        if pattern.startswith("!"):
+            negate = True
+            pattern = pattern[1:]
+        elif pattern.startswith("\\!") or pattern.startswith("\\#"):
+            pattern = pattern[1:]
+        dir_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        if not pattern:
+            return
+        anchored = "/" in pattern
+        if pattern.startswith("**/"):
+            pattern = pattern[3:]
+            anchored = "/" in pattern
+            if anchored:
+                # "**/a/b" matches "a/b" at any depth.
+                pattern = "**/" + pattern
+        pattern = pattern.lstrip("/")
+
+        if not self.groups or self.groups[-1].negate != negate:
+            self.groups.append(_RuleGroup(negate))
+        group = self.groups[-1]
+
+        if not anchored:
+            # Basename patterns: use set / suffix fast paths where possible.
+            if not _GLOB_CHARS.search(pattern):
+                (group.dir_names if dir_only else group.names).add(pattern)
+                return
+            if pattern.startswith("*") and not _GLOB_CHARS.search(pattern[1:]):
+                (group.dir_suffixes if dir_only else group.suffixes).append(pattern[1:])
+                return
+            regex = re.escape(self.prefix) + "(?:.*/)?" + _translate(pattern) + r"\Z"
+        else:
+            regex = re.escape(self.prefix) + _translate(pattern) + r"\Z"
+        (group.dir_regexes if dir_only else group.regexes).append(regex)
+
+    def applies_to(self, rel_path):
+        return not self.prefix or rel_path.startswith(self.prefix)
+
+    def decide(self, rel_path, name, is_dir):
+        """Return True (ignored), False (re-included) or None (no rule matched)."""
+        for group in reversed(self.groups):
+            if group.matches(rel_path, name, is_dir):
+                return not group.negate
+        return None
+
+
+class IgnoreMatcher:
+    """Compiled ignore rules for a directory tree.
+
+    Paths are checked relative to ``root``. Rules can come from explicit
+    pattern lists (``add_patterns``) and from ignore files discovered in each
+    directory (``load_directory``); deeper ignore files take precedence.
+
+    Example:
+        >>> matcher = IgnoreMatcher(".", ["*.pyc", "build/", "!keep.pyc"])
+        >>> matcher.is_ignored("pkg/mod.pyc")
+        True
+        >>> matcher.is_ignored("pkg/keep.pyc")
+        False
+    """
+
+    def __init__(self, root, patterns=None, ignore_filenames=IGNORE_FILENAMES):
+        self.root = os.path.abspath(root)
+        self.ignore_filenames = tuple(ignore_filenames)
+        self._rulesets = []
+        self._loaded_dirs = set()
+        self._ancestor_cache = {}
+        self._lock = threading.Lock()
+        if patterns:
+            self.add_patterns(patterns)
+
+    def add_patterns(self, patterns, base=""):
+        """Add patterns scoped to ``base`` (a root-relative directory)."""
+        base = self._normalize(base) if base else ""
+        ruleset = _RuleSet(list(patterns), base)
+        if not ruleset.groups:
+            return
+        with self._lock:
+            # Keep rule sets ordered by depth so deeper files override parents.
+            rulesets = self._rulesets + [ruleset]
+            rulesets.sort(key=lambda r: r.base.count("/") + (1 if r.base else 0))
+            self._rulesets = rulesets
+            self._ancestor_cache = {}
+
+    def add_ignore_file(self, path, base=""):
+        """Read patterns from an ignore file and add them scoped to ``base``."""
+        try:
+            with open(path, "r", encoding="utf8", errors="replace") as f:
+                patterns = parse_ignore_lines(f)
+        except OSError:
+            return
+        self.add_patterns(patterns, base)
+
+    def load_directory(self, rel_dir=""):
+        """Load the ignore files found in ``rel_dir`` (once per directory)."""
+        rel_dir = self._normalize(rel_dir) if rel_dir else ""
+        with self._lock:
+            if rel_dir is None or rel_dir in self._loaded_dirs:
+                return
+            self._loaded_dirs.add(rel_dir)
+        directory = os.path.join(self.root, rel_dir) if rel_dir else self.root
+        for filename in self.ignore_filenames:
+            path = os.path.join(directory, filename)
+            if os.path.isfile(path):
+                self.add_ignore_file(path, rel_dir)
+
+    def load_path(self, rel_dir):
+        """Load the ignore files of the root and every directory down to ``rel_dir``."""
+        self.load_directory("")
+        rel_dir = self._normalize(rel_dir) if rel_dir else ""
+        if not rel_dir:
+            return
+        parts = rel_dir.split("/")
+        for depth in range(1, len(parts) + 1):
+            self.load_directory("/".join(parts[:depth]))
+
+    def relative(self, path):
+        """Return ``path`` as a root-relative posix path, or None if outside root."""
+        if os.path.isabs(path):
+            path = os.path.relpath(path, self.root)
+        return self._normalize(path)
+
+    def match(self, rel_path, is_dir=False):
+        """Check a single root-relative path, without considering its parents."""
+        name = rel_path.rsplit("/", 1)[-1]
+        for ruleset in reversed(self._rulesets):
+            if ruleset.applies_to(rel_path):
+                decision = ruleset.decide(rel_path, name, is_dir)
+                if decision is not None:
+                    return decision
+        return False
+
+    def is_ignored(self, path, is_dir=None, load_nested=False):
+        """Return True if ``path`` or any of its parent directories is ignored.
+
+        Args:
+            path: Absolute path, or path relative to the matcher root
+            is_dir: Whether the path is a directory; looked up on disk if None
+            load_nested: Load ignore files from the parent directories first
+        """
+        rel_path = self.relative(path)
+        if not rel_path:
+            return False
+        if is_dir is None:
+            is_dir = os.path.isdir(os.path.join(self.root, rel_path))
+        parts = rel_path.split("/")
+        if load_nested:
+            self.load_path("/".join(parts[:-1]))
+        for depth in range(1, len(parts)):
+            ancestor = "/".join(parts[:depth])
+            cached = self._ancestor_cache.get(ancestor)
+            if cached is None:
+                cached = self.match(ancestor, True)
+                self._ancestor_cache[ancestor] = cached
+            if cached:
+                return True
+        return self.match(rel_path, is_dir)
+
+    @staticmethod
+    def _normalize(path):
+        path = path.replace(os.sep, "/")
+        while path.startswith("./"):
+            path = path[2:]
+        path = path.strip("/")
+        if path == ".":
+            return ""
+        if path == ".." or path.startswith("../"):
+            return None
+        return path
@@ -24,7 +24,7 @@ import shutil
 import subprocess
 from pathlib import Path
 from typing import List, Set
-from gptdiff.gptdiff import load_gitignore_patterns, is_ignored
+from gptdiff.ignore import IgnoreMatcher
 
 # LLM helpers
 import json
@@ -183,18 +183,12 @@ def main() -> None:
     files = find_relevant_files(keywords)
 
     # Exclude prompt.txt and any files listed in .gitignore or .gptignore
-    ignore_patterns: List[str] = []
-    cwd = Path.cwd()
-    gitignore_path = cwd / ".gitignore"
-    gptignore_path = cwd / ".gptignore"
-    if gitignore_path.exists():
-        ignore_patterns.extend(load_gitignore_patterns(str(gitignore_path)))
-    if gptignore_path.exists():
-        ignore_patterns.extend(load_gitignore_patterns(str(gptignore_path)))
+    matcher = IgnoreMatcher(Path.cwd())
+    matcher.load_directory("")
     # Always ignore prompt.txt explicitly
-    ignore_patterns.append("prompt.txt")
+    matcher.add_patterns(["prompt.txt"])
     # Filter out ignored files
-    files = [f for f in files if not is_ignored(f, ignore_patterns)]
+    files = [f for f in files if not matcher.is_ignored(f, load_nested=True)]
 
     gptdiff_cmd = build_gptdiff_command(original_cmd, files, args.apply)
 
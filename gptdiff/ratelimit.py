@@ -0,0 +1,166 @@
+"""
+Module: ratelimit
+
+Client-side pacing of LLM requests.
+
+Each (base_url, model) gets a token bucket for requests per minute
+($GPTDIFF_RATE_LIMIT_RPM) and one for tokens per minute
+($GPTDIFF_RATE_LIMIT_TPM). A request takes one request and its estimated
+tokens (prompt plus max_tokens of output) before it is sent. Once the
+response reports its real usage, the unused part of the estimate is given
+back. Buckets hold at most BURST_SECONDS worth of their rate. Requests are
+therefore spread evenly through the minute instead of bursting into the
+provider's limit and stalling on 429s.
+
+Limiters are shared by every thread in the process. With
+$GPTDIFF_RATE_LIMIT_FILE set, bucket levels are kept in that file under an
+exclusive lock, so concurrent gptdiff processes share one budget as well.
+That needs fcntl; elsewhere the file is ignored.
+"""
+
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Largest burst a bucket allows, in seconds of its rate.
+BURST_SECONDS = 10
+
+_lock = threading.Lock()
+_limiters = {}
+
+
+class RateLimiter:
+    """Token buckets for one (base_url, model).
+
+    Example:
+        >>> limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=200000)
+        >>> reserved = limiter.acquire(prompt_tokens + max_tokens)
+        >>> response = send()
+        >>> limiter.settle(reserved, used_tokens)
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, path=None, key="default"):
+        self.limits = {}
+        if requests_per_minute:
+            self.limits["requests"] = float(requests_per_minute)
+        if tokens_per_minute:
+            self.limits["tokens"] = float(tokens_per_minute)
+        self.path = path if fcntl is not None else None
+        self.key = key
+        self.waited = 0.0
+        self._lock = threading.Lock()
+        self._state = {}
+
+    def _capacity(self, bucket):
+        return max(self.limits[bucket] * BURST_SECONDS / 60, 1.0)
+
+    def _levels(self, state, now):
+        """Current level of each bucket, refilled up to now."""
+        levels = {}
+        for bucket, limit in self.limits.items():
+            capacity = self._capacity(bucket)
+            level, updated = state.get(bucket, (capacity, now))
+            levels[bucket] = min(capacity, level + max(now - updated, 0) * limit / 60)
+        return levels
+
+    def _take(self, amounts):
+        def take(state, now):
+            levels = self._levels(state, now)
+            wait = 0.0
+            for bucket, limit in self.limits.items():
+                # A request larger than the bucket waits for a full bucket, then goes into debt.
+                needed = min(amounts[bucket], self._capacity(bucket))
+                if levels[bucket] < needed:
+                    wait = max(wait, (needed - levels[bucket]) * 60 / limit)
+            if not wait:
+                for bucket in self.limits:
+                    state[bucket] = [levels[bucket] - amounts[bucket], now]
+            return wait
+        return take
+
+    def _update(self, change):
+        """Run change(state, now) on this limiter's bucket state, in-process or in the shared file."""
+        with self._lock:
+            if self.path is None:
+                return change(self._state, time.time())
+            with open(self.path, "a+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    try:
+                        shared = json.loads(f.read() or "{}")
+                    except ValueError:
+                        shared = {}
+                    result = change(shared.setdefault(self.key, {}), time.time())
+                    f.seek(0)
+                    f.truncate()
+                    json.dump(shared, f)
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+            return result
+
+    def _wait_time(self, tokens):
+        return self._update(self._take({"requests": 1, "tokens": tokens}))
+
+    def acquire(self, tokens=0):
+        """Block until a request of tokens fits the limits, take it, and return tokens."""
+        while True:
+            wait = self._wait_time(tokens)
+            if not wait:
+                return tokens
+            with self._lock:
+                self.waited += wait
+            time.sleep(wait)
+
+    async def aacquire(self, tokens=0):
+        """Async variant of acquire that waits without blocking the event loop."""
+        import asyncio
+        while True:
+            wait = self._wait_time(tokens)
+            if not wait:
+                return tokens
+            with self._lock:
+                self.waited += wait
+            await asyncio.sleep(wait)
+
+    def settle(self, reserved, used):
+        """Give back the part of a reservation the request didn't use."""
+        if "tokens" not in self.limits or not used or used >= reserved:
+            return
+
+        def refund(state, now):
+            level = self._levels(state, now)["tokens"]
+            state["tokens"] = [min(self._capacity("tokens"), level + reserved - used), now]
+        self._update(refund)
+
+
+def get_rate_limiter(base_url, model):
+    """The shared RateLimiter for (base_url, model), or None when no limit is configured."""
+    rpm = float(os.getenv("GPTDIFF_RATE_LIMIT_RPM", 0) or 0)
+    tpm = float(os.getenv("GPTDIFF_RATE_LIMIT_TPM", 0) or 0)
+    if not rpm and not tpm:
+        return None
+    path = os.getenv("GPTDIFF_RATE_LIMIT_FILE") or None
+    key = (base_url, model, rpm, tpm, path)
+    limiter = _limiters.get(key)
+    if limiter is None:
+        with _lock:
+            limiter = _limiters.get(key)
+            if limiter is None:
+                limiter = _limiters[key] = RateLimiter(rpm, tpm, path, key=f"{base_url} {model}")
+    return limiter
+
+
+def pacing_summary():
+    """One line for the end-of-run report on time spent waiting for rate limits, or None."""
+    waited = sum(limiter.waited for limiter in list(_limiters.values()))
+    if not waited:
+        return None
+    return f"Rate limit: waited {waited:.1f}s pacing LLM requests."
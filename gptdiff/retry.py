@@ -0,0 +1,227 @@
+"""
+Module: retry
+
+Retry policy shared by every LLM request.
+
+Rate limits (429), overload (529), server errors (500, 502, 503, 504),
+timeouts and dropped connections are retried with exponential backoff and
+full jitter, or after the delay the server asks for in Retry-After. Other
+errors, such as a bad request or a wrong API key, are raised at once. A
+request is only retried when it failed as a whole, so a retry never repeats
+output the caller has already received.
+
+Each attempt is limited to $GPTDIFF_LLM_TIMEOUT seconds (600), at most
+$GPTDIFF_LLM_RETRIES retries (4) are made, and a call gives up once
+$GPTDIFF_LLM_DEADLINE seconds (900) have passed since it started, without
+sleeping past that deadline. Process-wide counters are kept for the
+end-of-run summary (see retry_stats()).
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_TIMEOUT = 600.0
+DEFAULT_DEADLINE = 900.0
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504, 529})
+
+
+class LLMHTTPError(Exception):
+    """An LLM endpoint answered with an error status."""
+
+    def __init__(self, status_code, headers=None, body=None):
+        super().__init__(f"HTTP {status_code} from LLM endpoint: {body}")
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.body = body
+
+
+class RetryStats:
+    """Thread-safe counters of retries made by every RetryPolicy in the process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = 0
+            self.retries = 0
+            self.gave_up = 0
+            self.waited = 0.0
+            self.reasons = Counter()
+
+    def _record(self, **changes):
+        with self._lock:
+            reason = changes.pop("reason", None)
+            if reason is not None:
+                self.reasons[reason] += 1
+            for name, amount in changes.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def summary(self):
+        """One line for the end-of-run report, or None if nothing was retried."""
+        with self._lock:
+            if not self.retries and not self.gave_up:
+                return None
+            reasons = ", ".join(f"{reason} x{count}" for reason, count in self.reasons.most_common())
+            return (f"LLM retries: {self.retries} over {self.calls} calls ({reasons}), "
+                    f"waited {self.waited:.1f}s; {self.gave_up} calls gave up.")
+
+
+_stats = RetryStats()
+
+
+def retry_stats():
+    """The process-wide RetryStats."""
+    return _stats
+
+
+def _status(exc):
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        # requests.HTTPError carries the response instead.
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def _is_network_error(exc):
+    # Only look at HTTP libraries that are already loaded: an exception can't
+    # come from one that isn't.
+    requests = sys.modules.get("requests")
+    if requests is not None and isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+        return True
+    openai = sys.modules.get("openai")
+    if openai is not None and isinstance(exc, openai.APIConnectionError):
+        return True
+    for name in ("httpx", "httpx2"):
+        httpx = sys.modules.get(name)
+        if httpx is not None and isinstance(exc, httpx.TransportError):
+            return True
+    return isinstance(exc, (ConnectionError, TimeoutError))
+
+
+def retry_reason(exc):
+    """Short name for why exc is worth retrying ("429", "timeout", ...), or None if it isn't."""
+    status = _status(exc)
+    if status is not None:
+        return str(status) if status in RETRYABLE_STATUS else None
+    if _is_network_error(exc):
+        return "timeout" if "timeout" in type(exc).__name__.lower() or isinstance(exc, TimeoutError) else "connection"
+    return None
+
+
+def retry_after(exc):
+    """Seconds the server asked us to wait (retry-after-ms or Retry-After), or None."""
+    headers = getattr(exc, "headers", None)
+    if headers is None:
+        headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    headers = {name.lower(): value for name, value in headers.items()}
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return max(float(value) / 1000, 0.0)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    import email.utils
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(when.timestamp() - time.time(), 0.0)
+
+
+class RetryPolicy:
+    """Run an LLM request with retries.
+
+    The request is a function taking the timeout, in seconds, for one attempt.
+
+    Example:
+        >>> policy = retry_policy()
+        >>> response = policy.call(lambda timeout: client.chat.completions.create(..., timeout=timeout))
+    """
+
+    def __init__(self, max_retries=DEFAULT_MAX_RETRIES, timeout=DEFAULT_TIMEOUT, deadline=DEFAULT_DEADLINE,
+                 base_delay=None, max_delay=None, stats=None):
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.deadline = deadline
+        self.base_delay = BASE_DELAY if base_delay is None else base_delay
+        self.max_delay = MAX_DELAY if max_delay is None else max_delay
+        self.stats = _stats if stats is None else stats
+
+    def _delay(self, retry, exc):
+        requested = retry_after(exc)
+        if requested is not None:
+            return requested
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+
+    def _next(self, retry, exc, started):
+        """Seconds to wait before retrying after exc, or None to give up."""
+        reason = retry_reason(exc)
+        if reason is None:
+            return None
+        delay = self._delay(retry, exc)
+        if retry >= self.max_retries or time.monotonic() + delay >= started + self.deadline:
+            self.stats._record(gave_up=1)
+            return None
+        self.stats._record(retries=1, waited=delay, reason=reason)
+        return delay
+
+    def _attempt_timeout(self, started):
+        return max(min(self.timeout, started + self.deadline - time.monotonic()), 0.001)
+
+    def call(self, request):
+        """Return request(timeout), retrying it as the policy allows."""
+        self.stats._record(calls=1)
+        started = time.monotonic()
+        retry = 0
+        while True:
+            try:
+                return request(self._attempt_timeout(started))
+            except Exception as e:
+                delay = self._next(retry, e, started)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+            retry += 1
+
+    async def acall(self, request):
+        """Async variant of call: request(timeout) returns an awaitable."""
+        import asyncio
+        self.stats._record(calls=1)
+        started = time.monotonic()
+        retry = 0
+        while True:
+            try:
+                return await request(self._attempt_timeout(started))
+            except Exception as e:
+                delay = self._next(retry, e, started)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+            retry += 1
+
+
+def retry_policy():
+    """The RetryPolicy configured by $GPTDIFF_LLM_RETRIES, $GPTDIFF_LLM_TIMEOUT and $GPTDIFF_LLM_DEADLINE."""
+    return RetryPolicy(
+        max_retries=int(os.getenv("GPTDIFF_LLM_RETRIES", DEFAULT_MAX_RETRIES)),
+        timeout=float(os.getenv("GPTDIFF_LLM_TIMEOUT", DEFAULT_TIMEOUT)),
+        deadline=float(os.getenv("GPTDIFF_LLM_DEADLINE", DEFAULT_DEADLINE)),
+    )
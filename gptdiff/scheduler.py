@@ -0,0 +1,103 @@
+"""
+Module: scheduler
+
+Bounded worker pool used by smartapply.
+
+Jobs are run by at most ``workers`` threads, costliest first: when a diff
+touches many files, starting the longest ones early keeps a single large file
+from finishing alone at the end. Jobs that share a key (the same file path)
+run one at a time, in the order they were submitted. Jobs can be submitted
+while earlier ones are running, so the pool also serves streamed diffs.
+"""
+
+import heapq
+import itertools
+import threading
+from collections import deque
+
+
+class ApplyPool:
+    """Run fn(key, item) for submitted jobs on a bounded set of threads.
+
+    Example:
+        >>> with ApplyPool(apply_one, workers=8) as pool:
+        ...     for path, patch in patches:
+        ...         pool.submit(path, patch, cost=len(patch))
+    """
+
+    def __init__(self, fn, workers):
+        self.fn = fn
+        self.workers = max(1, int(workers))
+        self._cond = threading.Condition()
+        self._heap = []
+        self._order = itertools.count()
+        self._waiting = {}
+        self._running = set()
+        self._threads = []
+        self._idle = 0
+        self._closed = False
+        self._error = None
+
+    def submit(self, key, item, cost=0):
+        """Queue fn(key, item). Higher cost runs earlier."""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("ApplyPool is closed")
+            jobs = self._waiting.get(key)
+            if jobs is None:
+                jobs = self._waiting[key] = [0, deque()]
+                if key not in self._running:
+                    heapq.heappush(self._heap, (-cost, next(self._order), key))
+            jobs[0] = max(jobs[0], cost)
+            jobs[1].append(item)
+            # Woken workers count as idle until they take the lock, so compare the
+            # runnable keys with idle workers rather than testing for any idle one.
+            if self._idle:
+                self._cond.notify()
+            if len(self._heap) > self._idle and len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, daemon=True)
+                self._threads.append(thread)
+                thread.start()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._heap and not self._closed:
+                    self._idle += 1
+                    self._cond.wait()
+                    self._idle -= 1
+                if not self._heap:
+                    return
+                _, _, key = heapq.heappop(self._heap)
+                items = self._waiting.pop(key)[1]
+                self._running.add(key)
+            try:
+                for item in items:
+                    self.fn(key, item)
+            except BaseException as e:
+                with self._cond:
+                    if self._error is None:
+                        self._error = e
+            finally:
+                with self._cond:
+                    self._running.discard(key)
+                    # Patches for this key that arrived while it ran go back in the queue.
+                    jobs = self._waiting.get(key)
+                    if jobs is not None:
+                        heapq.heappush(self._heap, (-jobs[0], next(self._order), key))
+
+    def close(self):
+        """Wait for every submitted job, then re-raise the first error, if any."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
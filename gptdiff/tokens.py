@@ -0,0 +1,70 @@
+"""
+Module: tokens
+
+Token accounting for prompts.
+
+The tiktoken encoding is loaded once per process, project files are encoded
+once each (batched across threads with ``encode_ordinary_batch``), and the
+resulting counts are summed and passed along instead of re-encoding the
+assembled prompt.
+"""
+
+import functools
+import os
+
+ENCODING_NAME = "o200k_base"
+
+# Number of files encoded per encode_ordinary_batch call; bounds the memory
+# held by token lists that are only needed for their length.
+BATCH_SIZE = 256
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(name=ENCODING_NAME):
+    """Return the tiktoken encoding, loading it on first use."""
+    import tiktoken
+    return tiktoken.get_encoding(name)
+
+
+def count_tokens(text, encoding_name=ENCODING_NAME):
+    """Count the tokens in text. Special-token text is counted as ordinary text."""
+    if not text:
+        return 0
+    return len(get_encoding(encoding_name).encode_ordinary(text))
+
+
+def count_tokens_batch(texts, encoding_name=ENCODING_NAME, num_threads=None):
+    """Count tokens for many texts at once using tiktoken's threaded batch encoder."""
+    texts = list(texts)
+    if not texts:
+        return []
+    if num_threads is None:
+        num_threads = min(8, os.cpu_count() or 1)
+    enc = get_encoding(encoding_name)
+    counts = []
+    for start in range(0, len(texts), BATCH_SIZE):
+        batch = texts[start:start + BATCH_SIZE]
+        counts.extend(len(tokens) for tokens in enc.encode_ordinary_batch(batch, num_threads=num_threads))
+    return counts
+
+
+def count_file_tokens(project_files, cache=None, encoding_name=ENCODING_NAME):
+    """Return the token count of each (path, content) pair, in order.
+
+    Counts found in the FileCache are reused; the rest are encoded in one
+    batch and stored back into the cache.
+    """
+    counts = [None] * len(project_files)
+    missing = []
+    for i, (path, content) in enumerate(project_files):
+        if cache is not None:
+            counts[i] = cache.cached_token_count(path, content, encoding_name)
+        if counts[i] is None:
+            missing.append(i)
+    if missing:
+        fresh = count_tokens_batch([project_files[i][1] for i in missing], encoding_name)
+        for i, tokens in zip(missing, fresh):
+            counts[i] = tokens
+            if cache is not None:
+                cache.store_token_count(project_files[i][0], project_files[i][1], encoding_name, tokens)
+    return counts
@@ -0,0 +1,174 @@
+"""
+Module: transaction
+
+All-or-nothing writes for multi-file applies.
+
+Changes are staged in memory. commit() first writes every new file to a temp
+file in its target directory, then moves them all into place with os.replace.
+Files that are overwritten or deleted are kept as backups (hard links where
+possible) in an undo journal until every change is in place, so a failure at
+any point restores the tree to how it was before commit().
+"""
+
+import io
+import itertools
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+
+
+class ApplyTransaction:
+    """Stage file writes and deletions, then commit them together.
+
+    Staging is thread-safe, so concurrent workers can share one transaction.
+    The last change staged for a path wins.
+
+    Example:
+        >>> transaction = ApplyTransaction()
+        >>> transaction.write("src/app.py", new_source)
+        >>> transaction.delete("src/old.py")
+        >>> transaction.commit()  # both happen, or neither
+    """
+
+    def __init__(self):
+        self._changes = {}
+        self._lock = threading.Lock()
+
+    def write(self, path, content):
+        """Stage content for path: bytes as is, or str encoded as UTF-8 with
+        newlines translated like Path.write_text.
+
+        content may also be a list of str lines (as from splitlines(keepends=True)),
+        which commit() streams to disk without joining them into one string,
+        or a function that commit() calls with the binary file to write to.
+        An exception from that function aborts the commit.
+        """
+        if isinstance(content, str):
+            if os.linesep != "\n":
+                content = content.replace("\n", os.linesep)
+            content = content.encode("utf8")
+        with self._lock:
+            self._changes[Path(path)] = content
+
+    def delete(self, path):
+        """Stage the deletion of path. Deleting a missing file is a no-op."""
+        with self._lock:
+            self._changes[Path(path)] = None
+
+    def read(self, path):
+        """Return the text path will have once committed, like Path.read_text.
+
+        That is its staged content, or the file on disk if nothing is staged
+        for it, so a later patch for the same file builds on earlier ones.
+        Raises FileNotFoundError if path is staged for deletion or missing.
+        """
+        path = Path(path)
+        with self._lock:
+            if path not in self._changes:
+                return path.read_text()
+            content = self._changes[path]
+        if content is None:
+            raise FileNotFoundError(f"{path} is staged for deletion")
+        if isinstance(content, list):
+            return "".join(content)
+        if callable(content):
+            buffer = io.BytesIO()
+            content(buffer)
+            content = buffer.getvalue()
+        return content.decode("utf8").replace(os.linesep, "\n")
+
+    def commit(self):
+        """Apply every staged change, or raise with the tree left as it was."""
+        with self._lock:
+            changes, self._changes = list(self._changes.items()), {}
+        created_dirs = []
+        prepared = []
+        try:
+            # Phase 1: write new contents next to their targets. Nothing visible changes yet.
+            for path, content in changes:
+                if content is None:
+                    if path.exists():
+                        prepared.append((path, None))
+                    continue
+                _make_parents(path.parent, created_dirs)
+                fd, temp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+                prepared.append((path, temp))
+                if isinstance(content, bytes):
+                    with os.fdopen(fd, "wb") as f:
+                        f.write(content)
+                elif callable(content):
+                    with os.fdopen(fd, "wb") as f:
+                        content(f)
+                else:
+                    with os.fdopen(fd, "w", encoding="utf8") as f:
+                        f.writelines(content)
+                if path.exists():
+                    shutil.copymode(path, temp)
+
+            # Phase 2: move everything into place, journaling what it replaces.
+            journal = []
+            counter = itertools.count()
+            try:
+                for path, temp in prepared:
+                    backup = None
+                    if path.exists():
+                        backup = path.with_name(f".{path.name}.{os.getpid()}.{next(counter)}.orig")
+                        if temp is None:
+                            os.replace(path, backup)
+                        else:
+                            _link_or_copy(path, backup)
+                    journal.append((path, temp, backup))
+                    if temp is not None:
+                        os.replace(temp, path)
+            except BaseException:
+                _undo(journal)
+                raise
+        except BaseException:
+            for _, temp in prepared:
+                if temp is not None and os.path.exists(temp):
+                    os.unlink(temp)
+            for directory in reversed(created_dirs):
+                try:
+                    directory.rmdir()
+                except OSError:
+                    pass
+            raise
+
+        for _, _, backup in journal:
+            if backup is not None:
+                backup.unlink()
+
+
+def _make_parents(directory, created):
+    missing = []
+    while not directory.exists():
+        missing.append(directory)
+        directory = directory.parent
+    for directory in reversed(missing):
+        directory.mkdir()
+        created.append(directory)
+
+
+def _link_or_copy(path, backup):
+    try:
+        os.link(path, backup)
+    except OSError:
+        shutil.copy2(path, backup)
+
+
+def _undo(journal):
+    # Best effort: one file that can't be restored shouldn't stop the others.
+    for path, temp, backup in reversed(journal):
+        try:
+            if backup is not None:
+                os.replace(backup, path)
+                if backup.exists():
+                    # path was never replaced, so both names were links to one file.
+                    backup.unlink()
+            elif temp is not None and path.exists():
+                # The file was created by this commit.
+                path.unlink()
+        except OSError:
+            pass
@@ -0,0 +1,176 @@
+"""
+Module: transport
+
+Process-wide HTTP clients for LLM calls.
+
+Clients are created once per (base_url, api_key) and reused by every call,
+so concurrent smartapply threads share keep-alive connections instead of
+paying a fresh TCP and TLS handshake per request. The connection pool size
+defaults to $GPTDIFF_HTTP_POOL_SIZE (32) and can be changed with
+configure_http_pool().
+
+The asyncio API uses the same scheme with async clients, kept per event loop
+because they cannot be shared between loops, plus one semaphore per loop
+bounding in-flight LLM requests to $GPTDIFF_ASYNC_CONCURRENCY (16).
+"""
+
+import os
+import threading
+import weakref
+
+DEFAULT_POOL_SIZE = 32
+DEFAULT_ASYNC_CONCURRENCY = 16
+
+_lock = threading.Lock()
+_openai_clients = {}
+_sessions = {}
+_pool_size = None
+# event loop -> {"openai": {(base_url, api_key): client}, "http": client, "semaphore": semaphore}
+_loop_state = weakref.WeakKeyDictionary()
+
+
+def pool_size():
+    """Maximum number of connections kept per client."""
+    if _pool_size is not None:
+        return _pool_size
+    return int(os.getenv("GPTDIFF_HTTP_POOL_SIZE", DEFAULT_POOL_SIZE))
+
+
+def configure_http_pool(size):
+    """Set the connection pool size and drop existing clients so new ones use it."""
+    global _pool_size
+    _pool_size = int(size) if size else None
+    close_clients()
+
+
+def _httpx():
+    try:
+        import httpx
+    except ImportError:
+        # Newer openai releases ship their HTTP stack as httpx2.
+        import httpx2 as httpx
+    return httpx
+
+
+def _limits(httpx):
+    size = pool_size()
+    return httpx.Limits(max_connections=size, max_keepalive_connections=size)
+
+
+def _timeout(httpx):
+    return httpx.Timeout(600.0, connect=10.0)
+
+
+def _verify():
+    # Honor a custom CA bundle (corporate proxies, local test servers).
+    cafile = os.getenv("SSL_CERT_FILE")
+    if cafile:
+        import ssl
+        return ssl.create_default_context(cafile=cafile)
+    return True
+
+
+def get_openai_client(base_url, api_key):
+    """Return the shared OpenAI client for (base_url, api_key)."""
+    key = (base_url, api_key)
+    client = _openai_clients.get(key)
+    if client is not None:
+        return client
+    with _lock:
+        client = _openai_clients.get(key)
+        if client is None:
+            from openai import OpenAI
+            httpx = _httpx()
+            http_client = httpx.Client(limits=_limits(httpx), timeout=_timeout(httpx), verify=_verify())
+            client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0, http_client=http_client)
+            _openai_clients[key] = client
+    return client
+
+
+def get_requests_session(base_url, api_key):
+    """Return the shared requests.Session for (base_url, api_key)."""
+    key = (base_url, api_key)
+    session = _sessions.get(key)
+    if session is not None:
+        return session
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            size = pool_size()
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=size, pool_maxsize=size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[key] = session
+    return session
+
+
+def close_clients():
+    """Close and forget every shared client."""
+    with _lock:
+        clients = list(_openai_clients.values())
+        sessions = list(_sessions.values())
+        _openai_clients.clear()
+        _sessions.clear()
+    for client in clients:
+        client.close()
+    for session in sessions:
+        session.close()
+
+
+def async_concurrency():
+    """Maximum number of concurrent async LLM requests per event loop."""
+    return int(os.getenv("GPTDIFF_ASYNC_CONCURRENCY", DEFAULT_ASYNC_CONCURRENCY))
+
+
+def _state_for_running_loop():
+    import asyncio
+    loop = asyncio.get_running_loop()
+    state = _loop_state.get(loop)
+    if state is None:
+        state = {"openai": {}, "http": None, "semaphore": None}
+        _loop_state[loop] = state
+    return state
+
+
+def get_async_semaphore():
+    """Return the semaphore shared by every async LLM call on the running loop."""
+    import asyncio
+    state = _state_for_running_loop()
+    if state["semaphore"] is None:
+        state["semaphore"] = asyncio.Semaphore(async_concurrency())
+    return state["semaphore"]
+
+
+def get_async_http_client():
+    """Return the shared async HTTP client for the running loop."""
+    state = _state_for_running_loop()
+    if state["http"] is None:
+        httpx = _httpx()
+        state["http"] = httpx.AsyncClient(limits=_limits(httpx), timeout=_timeout(httpx), verify=_verify())
+    return state["http"]
+
+
+def get_async_openai_client(base_url, api_key):
+    """Return the shared AsyncOpenAI client for (base_url, api_key) on the running loop."""
+    clients = _state_for_running_loop()["openai"]
+    key = (base_url, api_key)
+    client = clients.get(key)
+    if client is None:
+        from openai import AsyncOpenAI
+        client = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0,
+                             http_client=get_async_http_client())
+        clients[key] = client
+    return client
+
+
+async def aclose_clients():
+    """Close the async clients of the running loop. Call before the loop ends."""
+    import asyncio
+    loop = asyncio.get_running_loop()
+    state = _loop_state.pop(loop, None)
+    if state is not None and state["http"] is not None:
+        # The OpenAI clients share this HTTP client, so closing it closes them all.
+        await state["http"].aclose()
@@ -0,0 +1,76 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from gptdiff import apply_diff_to_files
+
+FILES = {
+    "app.py": "def main():\n    return 1\n",
+    "util.py": "x = 1\n",
+    "old.py": "gone = True\n",
+}
+
+DIFF = """diff --git a/app.py b/app.py
+--- a/app.py
++++ b/app.py
+@@ -1,2 +1,2 @@
+ def main():
+-    return 1
++    return 2
+diff --git a/util.py b/util.py
+--- a/util.py
++++ b/util.py
+@@ -1 +1 @@
+-y = 1
++y = 2
+diff --git a/new.py b/new.py
+--- /dev/null
++++ b/new.py
+@@ -0,0 +1 @@
++print("hi")
+diff --git a/old.py b/old.py
+--- a/old.py
++++ /dev/null
+@@ -1 +0,0 @@
+-gone = True
+"""
+
+
+def test_applies_in_memory_and_reports_each_file():
+    new_files, report = apply_diff_to_files(DIFF, FILES)
+
+    assert new_files == {
+        "app.py": "def main():\n    return 2\n",
+        # util.py's patch doesn't match, so it keeps its content.
+        "util.py": "x = 1\n",
+        "new.py": 'print("hi")\n',
+    }
+    assert {path: result.status for path, result in report.items()} == {
+        "app.py": "modified", "util.py": "failed", "new.py": "created", "old.py": "deleted",
+    }
+    assert not report["util.py"].ok
+    assert "Removal line mismatch" in report["util.py"].error
+    assert report["util.py"].patch.path == "util.py"
+    # The input is untouched.
+    assert FILES["app.py"] == "def main():\n    return 1\n" and "old.py" in FILES
+
+
+def test_unchanged_and_offset_placements_are_reported():
+    files = {"a.txt": "intro\n" * 5 + "a\nb\n"}
+    _, report = apply_diff_to_files("--- a/a.txt\n+++ b/a.txt\n@@ -1,2 +1,2 @@\n-a\n+A\n b", files)
+    assert report["a.txt"].status == "modified"
+    assert str(report["a.txt"].placements[0]) == "Hunk #1 succeeded at 6 (offset 5 lines)."
+    _, report = apply_diff_to_files("--- a/a.txt\n+++ b/a.txt\n@@ -6,2 +6,2 @@\n a\n b", files)
+    assert report["a.txt"].status == "unchanged"
+
+
+def test_candidates_can_be_evaluated_in_parallel():
+    candidates = [DIFF.replace("return 2", f"return {n}") for n in range(20)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda diff: apply_diff_to_files(diff, FILES), candidates))
+    assert [new_files["app.py"] for new_files, _ in results] == [f"def main():\n    return {n}\n" for n in range(20)]
+
+
+def test_is_also_importable_from_gptdiff_gptdiff():
+    from gptdiff.applydiff import apply_diff
+    from gptdiff import gptdiff
+    assert gptdiff.apply_diff_to_files is apply_diff_to_files
+    assert gptdiff.apply_diff is apply_diff
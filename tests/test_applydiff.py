@@ -41,15 +41,15 @@ def test_apply_diff_success(tmp_project_dir_with_file):
 
 def test_apply_diff_failure(tmp_project_dir_with_file):
     """
-    Test that apply_diff fails when provided with an incorrect hunk header.
-    The diff references a non-existent line, so the patch should not apply.
+    Test that apply_diff fails when the lines a hunk removes aren't in the file,
+    even when offsets and fuzz are allowed.
     """
     diff_text = (
         "diff --git a/example.txt b/example.txt\n"
         "--- a/example.txt\n"
         "+++ a/example.txt\n"
         "@@ -2,1 +2,1 @@\n"
-        "-original content\n"
+        "-missing content\n"
         "+modified content\n"
     )
     result = apply_diff(str(tmp_project_dir_with_file), diff_text)
@@ -169,3 +169,133 @@ index 1234567..89abcde 100644
     from gptdiff.gptdiff import apply_diff
     result = apply_diff(str(tmp_project_dir_with_gptdiff), diff_text)
     assert result is False, "apply_diff should fail, needs smartapply"
+
+
+def test_apply_patch_to_text_in_memory():
+    from gptdiff.applydiff import apply_patch_to_text
+    patch = "--- a/a.py\n+++ b/a.py\n@@ -1,2 +1,3 @@\n a\n-b\n+c\n+d"
+    assert apply_patch_to_text("a\nb\n", patch) == "a\nc\nd\n"
+    # Added lines end in a newline, including in new files.
+    assert apply_patch_to_text("a\nb", patch) == "a\nc\nd\n"
+    assert apply_patch_to_text("", "@@ -0,0 +1,2 @@\n+a\n+b") == "a\nb\n"
+    assert apply_patch_to_text("x", "@@ -1 +1,2 @@\n x\n+y\n") == "x\ny\n"
+    # A missing final newline is kept when the last line is untouched or the patch says so.
+    assert apply_patch_to_text("a\nb", "@@ -1,2 +1,2 @@\n-a\n+z\n b") == "z\nb"
+    no_newline = "@@ -1,2 +1,2 @@\n a\n-b\n\\ No newline at end of file\n+c\n\\ No newline at end of file"
+    assert apply_patch_to_text("a\nb", no_newline) == "a\nc"
+
+
+def test_apply_patch_to_text_mismatch_raises():
+    from gptdiff.applydiff import PatchApplyError, apply_patch_to_text
+    with pytest.raises(PatchApplyError, match="Removal line mismatch"):
+        apply_patch_to_text("a\nz\n", "@@ -1,2 +1,2 @@\n a\n-b\n+c")
+
+
+def test_hunk_is_found_at_an_offset():
+    from gptdiff.applydiff import apply_patch_to_text
+    original = "".join(f"line {i}\n" for i in range(20))
+    # The header says line 3, but the lines are at 11 (offset 8).
+    patch = "@@ -3,3 +3,3 @@\n line 10\n-line 11\n+LINE 11\n line 12"
+    placements = []
+    assert apply_patch_to_text(original, patch, placements=placements) == original.replace("line 11\n", "LINE 11\n")
+    assert str(placements[0]) == "Hunk #1 succeeded at 11 (offset 8 lines)."
+
+
+def test_later_hunks_inherit_earlier_offsets():
+    from gptdiff.applydiff import apply_patch_to_text
+    original = "a\nb\nx\n" + "".join(f"{i}\n" for i in range(10)) + "a\nb\nx\n"
+    # Thirteen lines were added above both hunks since the diff was made.
+    patch = "@@ -1,2 +1,2 @@\n-a\n+A\n b\n@@ -14,2 +14,2 @@\n-a\n+A\n b"
+    placements = []
+    result = apply_patch_to_text("\n" * 13 + original, patch, placements=placements)
+    assert result == "\n" * 13 + "A\nb\nx\n" + "".join(f"{i}\n" for i in range(10)) + "A\nb\nx\n"
+    assert [p.offset for p in placements] == [13, 13]
+
+
+def test_fuzz_ignores_drifted_outer_context():
+    from gptdiff.applydiff import PatchApplyError, apply_patch_to_text
+    original = "one\ntwo\nthree\nfour\nfive\n"
+    patch = "@@ -1,5 +1,5 @@\n ONE\n two\n-three\n+THREE\n four\n FIVE"
+    placements = []
+    assert apply_patch_to_text(original, patch, placements=placements) == "one\ntwo\nTHREE\nfour\nfive\n"
+    assert placements[0].fuzz == 1
+    with pytest.raises(PatchApplyError):
+        apply_patch_to_text(original, patch, fuzz=0)
+
+
+def test_fuzz_never_drops_removals_or_all_context():
+    from gptdiff.applydiff import PatchApplyError, apply_patch_to_text
+    with pytest.raises(PatchApplyError, match="Removal line mismatch"):
+        apply_patch_to_text("a\nz\nc\n", "@@ -1,3 +1,3 @@\n a\n-b\n+B\n c", fuzz=3)
+    # Trimming every context line would turn this into a blind insertion.
+    with pytest.raises(PatchApplyError):
+        apply_patch_to_text("", "@@ -1,2 +1,3 @@\n x\n+y\n z", fuzz=3)
+
+
+def test_trailing_whitespace_differences_are_ignored_but_original_kept():
+    from gptdiff.applydiff import PatchApplyError, apply_patch_to_text
+    original = "def f():  \n    if x:\t\n        return 1 \n"
+    patch = "@@ -1,3 +1,3 @@\n def f():\n     if x:\n-        return 1\n+        return 2"
+    placements = []
+    assert apply_patch_to_text(original, patch, placements=placements) == "def f():  \n    if x:\t\n        return 2\n"
+    assert str(placements[0]) == "Hunk #1 succeeded at 1 (ignoring whitespace)."
+    # Without fuzz, whitespace must match exactly.
+    with pytest.raises(PatchApplyError):
+        apply_patch_to_text(original, patch, fuzz=0)
+
+
+def test_indentation_differences_are_never_ignored():
+    from gptdiff.applydiff import PatchApplyError, apply_patch_to_text
+    original = "def f():\n\tif x:\n\t\treturn 1\n"
+    patch = "@@ -1,3 +1,3 @@\n def f():\n     if x:\n-        return 1\n+        return 2"
+    with pytest.raises(PatchApplyError):
+        apply_patch_to_text(original, patch)
+
+
+def test_zero_length_hunk_inserts_after_header_line():
+    from gptdiff.applydiff import apply_patch_to_text
+    assert apply_patch_to_text("a\nb\nc\n", "@@ -2,0 +3,1 @@\n+new") == "a\nb\nnew\nc\n"
+
+
+def test_hunk_placements_reports_where_each_hunk_goes():
+    from gptdiff.applydiff import hunk_placements
+    lines = ["x\n", "a\n", "b\n", "c\n"]
+    patch = "@@ -1,2 +1,2 @@\n a\n-b\n+B\n@@ -9,1 +9,1 @@\n-missing\n+gone"
+    (first, placement, placed), (_, failed, not_placed) = hunk_placements(lines, patch)
+    assert placed == (1, 0, 0, False) and placement.offset == 1 and first.old_count == 2
+    assert not failed.ok and not_placed is None
+
+def test_line_index_finds_closest_occurrence_to_desired_line():
+    from gptdiff.applydiff import LineIndex
+    lines = ["x\n", "a\n", "b\n", "x\n", "x\n", "a\n", "b\n", "a\n", "c\n"]
+    index = LineIndex(lines)
+    assert index.find(["a", "b"], 0) == 1
+    assert index.find(["a", "b"], 4) == 5
+    # Occurrences before lower are never returned.
+    assert index.find(["a", "b"], 0, lower=2) == 5
+    assert index.find(["a", "c"], 0) == 7
+    assert index.find(["a", "d"], 0) is None
+    assert index.find(["a  ", "b"], 0) is None
+    assert index.find(["a  ", "b"], 0, loose=True) == 1
+    assert index.find(["  a", "b"], 0, loose=True) is None
+
+
+def test_apply_diff_check_reports_every_hunk_and_writes_nothing(tmp_path, capsys):
+    (tmp_path / "app.py").write_text("def main():\n    return 1\n")
+    (tmp_path / "util.py").write_text("x = 1\n")
+    diff_text = (
+        "--- a/app.py\n+++ b/app.py\n@@ -3,2 +3,2 @@\n def main():\n-    return 1\n+    return 2\n"
+        "--- a/util.py\n+++ b/util.py\n@@ -1 +1 @@\n-y = 1\n+y = 2\n@@ -1 +1,2 @@\n x = 1\n+z = 3\n"
+    )
+    assert apply_diff(str(tmp_path), diff_text, check=True) is False
+    out = capsys.readouterr().out
+    assert "app.py: would modify\n  Hunk #1 succeeded at 1 (offset -2 lines)." in out
+    assert "util.py: needs smartapply (whole file, 1 lines)" in out
+    # The failed hunk doesn't stop the check of the next one.
+    assert "  Hunk #1 FAILED at 1: Removal line mismatch" in out
+    assert "  Hunk #2 succeeded at 1." in out
+    assert "Check: 1/2 files apply without the LLM; 1 needs smartapply" in out
+    assert (tmp_path / "app.py").read_text() == "def main():\n    return 1\n"
+
+    assert apply_diff(str(tmp_path), diff_text.split("--- a/util.py")[0], check=True) is True
+    assert (tmp_path / "app.py").read_text() == "def main():\n    return 1\n"
@@ -183,3 +183,25 @@ def test_diff_file_deletion_edge(tmp_project_dir):
     result = apply_diff(str(tmp_project_dir), diff_text)
     assert result is True, "Deletion diff on a minimal file should return True"
     assert not (tmp_project_dir / "small.txt").exists(), "File should be deleted"
+
+
+def test_diff_without_net_change_leaves_file_untouched(tmp_project_dir):
+    """
+    A patch whose result equals the original is detected in memory, and the
+    file is neither rewritten nor read back.
+    """
+    file = tmp_project_dir / "same.txt"
+    file.write_text("alpha\nbeta\n")
+    before = file.stat()
+    diff_text = (
+        "--- a/same.txt\n"
+        "+++ b/same.txt\n"
+        "@@ -1,2 +1,2 @@\n"
+        " alpha\n"
+        "-beta\n"
+        "+beta\n"
+    )
+    result = apply_diff(str(tmp_project_dir), diff_text)
+    assert result is False, "A patch that changes nothing should report no modification"
+    assert file.stat().st_ino == before.st_ino
+    assert file.stat().st_mtime_ns == before.st_mtime_ns
@@ -0,0 +1,125 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from gptdiff import agenerate_diff, asmartapply, gptdiff, transport
+
+
+class SlowCompletionHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    delay = 0.1
+    content = "ok"
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        cls = type(self)
+        with cls.lock:
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        time.sleep(cls.delay)
+        with cls.lock:
+            cls.in_flight -= 1
+        body = json.dumps({
+            "id": "cmpl-1", "object": "chat.completion", "created": 0, "model": "test-model",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": cls.content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }).encode()
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def slow_server():
+    handler = type("Handler", (SlowCompletionHandler,), {"in_flight": 0, "max_in_flight": 0, "lock": threading.Lock()})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1/", handler
+    server.shutdown()
+
+
+def run(coro):
+    async def main():
+        try:
+            return await coro
+        finally:
+            await transport.aclose_clients()
+    return asyncio.run(main())
+
+
+def multi_file_diff(count):
+    return "\n".join(
+        f"diff --git a/f{i}.py b/f{i}.py\n--- a/f{i}.py\n+++ b/f{i}.py\n@@ -1 +1 @@\n-old\n+new"
+        for i in range(count)
+    )
+
+
+def test_asmartapply_bounds_concurrency_with_shared_semaphore(slow_server, monkeypatch):
+    base_url, handler = slow_server
+    handler.content = "new\n"
+    monkeypatch.setenv("GPTDIFF_ASYNC_CONCURRENCY", "3")
+    # Stale originals, so the patches need the LLM instead of applying exactly.
+    files = {f"f{i}.py": "stale\n" for i in range(8)}
+
+    async def both():
+        # Two independent smartapply calls share one limit on the loop.
+        return await asyncio.gather(
+            asmartapply(multi_file_diff(8), dict(files), model="m", api_key="k", base_url=base_url),
+            asmartapply(multi_file_diff(8), dict(files), model="m", api_key="k", base_url=base_url),
+        )
+
+    first, second = run(both())
+    assert first == second == {f"f{i}.py": "new" for i in range(8)}
+    assert handler.max_in_flight == 3
+
+
+def test_asmartapply_timeout_cancels_remaining_files(slow_server):
+    base_url, handler = slow_server
+    handler.delay = 1.0
+    started = time.perf_counter()
+    with pytest.raises(asyncio.TimeoutError):
+        run(asmartapply(multi_file_diff(4), {}, model="m", api_key="k", base_url=base_url, timeout=0.1))
+    assert time.perf_counter() - started < 1.0
+
+
+def test_cancelling_agenerate_diff_aborts_request(slow_server, monkeypatch):
+    base_url, handler = slow_server
+    handler.delay = 1.0
+    monkeypatch.setattr(gptdiff, "count_tokens", lambda text: 0)
+
+    async def cancel_soon():
+        task = asyncio.ensure_future(agenerate_diff("File: a.py\nContent:\n", "goal", model="m", api_key="k", base_url=base_url))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    started = time.perf_counter()
+    run(cancel_soon())
+    assert time.perf_counter() - started < 1.0
+
+
+def test_agenerate_diff_returns_diff(slow_server, monkeypatch):
+    base_url, handler = slow_server
+    handler.delay = 0
+    handler.content = "```diff\n--- a/a.py\n+++ b/a.py\n@@ -1 +1 @@\n-a\n+b\n```"
+    monkeypatch.setattr(gptdiff, "count_tokens", lambda text: 0)
+
+    diff = run(agenerate_diff("File: a.py\nContent:\na\n", "goal", model="m", api_key="k", base_url=base_url))
+    assert "+++ b/a.py" in diff and "+b" in diff
@@ -0,0 +1,205 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+import gptdiff.gptdiff as gptdiff
+from gptdiff import cache as cache_module
+from gptdiff.cache import FileCache, ResponseCache
+from gptdiff.gptdiff import load_project_files
+
+
+def write_old(path, text, age=10):
+    """Write a file with an mtime safely outside the racy-timestamp window."""
+    path.write_text(text)
+    past = time.time() - age
+    os.utime(path, (past, past))
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return str(tmp_path / ".gptdiff" / "cache")
+
+
+def test_read_text_hits_after_reopen(tmp_path, cache_dir, monkeypatch):
+    source = tmp_path / "a.py"
+    write_old(source, "print('a')\n")
+    with FileCache(cache_dir) as cache:
+        assert cache.read_text(str(source)) == "print('a')\n"
+        assert cache.misses == 1
+
+    # A second process must not open the file again.
+    real_open = open
+    def no_source_open(path, *args, **kwargs):
+        assert os.path.abspath(str(path)) != str(source), "cached file was re-read"
+        return real_open(path, *args, **kwargs)
+    monkeypatch.setattr("builtins.open", no_source_open)
+    with FileCache(cache_dir) as cache:
+        assert cache.read_text(str(source)) == "print('a')\n"
+        assert cache.hits == 1
+    assert (tmp_path / ".gptdiff" / ".gitignore").read_text() == "*\n"
+
+
+def test_modified_file_invalidates_entry(tmp_path, cache_dir):
+    source = tmp_path / "a.py"
+    write_old(source, "one\n", age=20)
+    with FileCache(cache_dir) as cache:
+        cache.read_text(str(source))
+    write_old(source, "two, longer\n", age=10)
+    with FileCache(cache_dir) as cache:
+        assert cache.read_text(str(source)) == "two, longer\n"
+        assert cache.hits == 0
+
+
+def test_binary_verdict_is_cached(tmp_path, cache_dir):
+    source = tmp_path / "blob.bin"
+    source.write_bytes(b"\xff\xfe\x00\x81" * 10)
+    past = time.time() - 10
+    os.utime(source, (past, past))
+    with FileCache(cache_dir) as cache:
+        assert cache.read_text(str(source)) is None
+    with FileCache(cache_dir) as cache:
+        assert cache.read_text(str(source)) is None
+        assert cache.hits == 1
+
+
+def test_token_counts_are_reused(tmp_path, cache_dir):
+    source = tmp_path / "a.py"
+    write_old(source, "x = 1\n")
+    calls = []
+    def count(text):
+        calls.append(text)
+        return 42
+
+    with FileCache(cache_dir) as cache:
+        text = cache.read_text(str(source))
+        assert cache.token_count(str(source), text, "o200k_base", count) == 42
+    with FileCache(cache_dir) as cache:
+        text = cache.read_text(str(source))
+        assert cache.token_count(str(source), text, "o200k_base", count) == 42
+        # Different encodings are counted separately
+        assert cache.token_count(str(source), text, "cl100k_base", count) == 42
+    assert len(calls) == 2
+
+
+def test_eviction_keeps_recently_used_entries(tmp_path, cache_dir):
+    paths = []
+    for i in range(5):
+        path = tmp_path / f"f{i}.txt"
+        write_old(path, str(i) * 100)
+        paths.append(str(path))
+
+    with FileCache(cache_dir, max_bytes=250) as cache:
+        for path in paths:
+            cache.read_text(path)
+    with FileCache(cache_dir, max_bytes=250) as cache:
+        cached = [path for path in paths if cache.lookup(path, os.stat(path)) is not None]
+    assert len(cached) <= 2
+
+
+def test_eviction_counts_bytes_not_characters(tmp_path, cache_dir):
+    path = tmp_path / "wide.txt"
+    path.write_text("\u00e9" * 100, encoding="utf-8")
+    past = time.time() - 10
+    os.utime(path, (past, past))
+
+    with FileCache(cache_dir, max_bytes=150) as cache:
+        cache.read_text(str(path), os.stat(path))
+    with FileCache(cache_dir, max_bytes=150) as cache:
+        assert cache.lookup(str(path), os.stat(path)) is None
+
+def test_concurrent_writers_share_the_cache(tmp_path, cache_dir):
+    paths = []
+    for i in range(30):
+        path = tmp_path / f"f{i}.txt"
+        write_old(path, f"content {i}\n")
+        paths.append(str(path))
+
+    def worker(offset):
+        with FileCache(cache_dir) as cache:
+            for path in paths[offset:] + paths[:offset]:
+                assert cache.read_text(path).startswith("content")
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(worker, range(0, 30, 8)))
+
+    with FileCache(cache_dir) as cache:
+        for path in paths:
+            cache.read_text(path)
+        assert cache.hits == len(paths)
+
+
+def test_load_project_files_with_cache(tmp_path, cache_dir):
+    write_old(tmp_path / "a.py", "a\n")
+    write_old(tmp_path / "b.py", "b\n")
+    with FileCache(cache_dir) as cache:
+        first = load_project_files(str(tmp_path), str(tmp_path), cache=cache)
+    with FileCache(cache_dir) as cache:
+        second = load_project_files(str(tmp_path), str(tmp_path), cache=cache)
+        assert cache.hits == 2
+    assert first == second
+
+
+def test_cache_can_be_disabled(monkeypatch):
+    monkeypatch.setenv("GPTDIFF_CACHE", "0")
+    assert FileCache.open() is None
+
+
+MESSAGES = [{"role": "system", "content": "apply"}, {"role": "user", "content": "x = 1"}]
+
+
+def test_response_key_normalizes_the_request():
+    key = ResponseCache.key("model", MESSAGES, 0, 100, "https://api.example/v1/")
+    assert key == ResponseCache.key("model", [dict(m) for m in MESSAGES], 0.0, 100, "https://api.example/v1")
+    assert key != ResponseCache.key("model", MESSAGES, 0, 101, "https://api.example/v1/")
+    assert key != ResponseCache.key("other", MESSAGES, 0, 100, "https://api.example/v1/")
+    assert key != ResponseCache.key("model", MESSAGES, 0, 100, "https://api.example/v1/", budget_tokens=10)
+
+
+def test_responses_expire_and_least_recently_used_are_evicted(cache_dir, monkeypatch):
+    clock = iter(range(1000, 2000))
+    monkeypatch.setattr(cache_module.time, "time", lambda: next(clock))
+    with ResponseCache(cache_dir, max_bytes=100, ttl=60) as cache:
+        cache.put("a", {"content": "a" * 30})
+        cache.put("b", {"content": "b" * 30})
+        assert cache.get("a") == {"content": "a" * 30}
+        # "b" is now the least recently used, so it makes room for "c".
+        cache.put("c", {"content": "c" * 30})
+        assert cache.get("b") is None
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        monkeypatch.setattr(cache_module.time, "time", lambda: 1000 + 61)
+        assert cache.get("a") is None
+
+
+def test_identical_apply_requests_are_served_from_the_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("GPTDIFF_LLM_CACHE", "1")
+    monkeypatch.setenv("GPTDIFF_CACHE_DIR", str(tmp_path / "cache"))
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="x = 2\n"))])
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    monkeypatch.setattr(gptdiff, "get_openai_client", lambda base_url, api_key: client)
+    apply = lambda diff: gptdiff.call_llm_for_apply("a.py", "x = 1\n", diff, "model", api_key="k", base_url="http://llm.test/")
+
+    assert apply("@@ -1 +1 @@\n-x = 1\n+x = 2") == "x = 2\n"
+    assert apply("@@ -1 +1 @@\n-x = 1\n+x = 2") == "x = 2\n"
+    assert len(calls) == 1
+    apply("@@ -1 +1 @@\n-x = 1\n+x = 3")
+    assert len(calls) == 2
+
+    # Sampled requests are never cached.
+    gptdiff.call_llm("k", "http://llm.test/", "model", MESSAGES, 100, 1.0)
+    gptdiff.call_llm("k", "http://llm.test/", "model", MESSAGES, 100, 1.0)
+    assert len(calls) == 4
+    assert cache_module.response_cache_summary().startswith("LLM response cache: 1 hits, 2 misses")
+
+
+def test_response_cache_is_off_by_default(monkeypatch):
+    monkeypatch.delenv("GPTDIFF_LLM_CACHE", raising=False)
+    assert ResponseCache.open() is None
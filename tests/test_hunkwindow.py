@@ -0,0 +1,116 @@
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from gptdiff import smartapply
+from gptdiff.applydiff import check_patch_to_lines, split_hunks
+from gptdiff.hunkwindow import plan_windows, splice_windows
+
+BIG = "".join(f"line {i}\n" for i in range(1000))
+
+
+def hunk(start, old, new):
+    body = [f"-{line}" for line in old] + [f"+{line}" for line in new]
+    return f"@@ -{start + 1},{len(old)} +{start + 1},{len(new)} @@\n" + "\n".join(body)
+
+
+def test_windows_cover_each_located_hunk_with_context():
+    patch_text = "--- a/big.py\n+++ b/big.py\n" + hunk(100, ["line 100"], ["LINE 100"]) + "\n" + hunk(700, ["line 700"], ["LINE 700"])
+    windows = plan_windows(BIG, patch_text, context=10)
+    assert [(w.start, w.end) for w in windows] == [(90, 111), (690, 711)]
+
+
+def test_wrong_line_numbers_are_corrected_by_content():
+    windows = plan_windows(BIG, hunk(5, ["line 500"], ["LINE 500"]), context=10)
+    assert [(w.start, w.end) for w in windows] == [(490, 511)]
+
+
+def test_windows_agree_with_where_the_patch_would_apply():
+    # Repeated blocks, and a header near the second one: apply_patch_to_lines
+    # picks the occurrence closest to the header, and so must the window.
+    text = "".join(f"def f{i}():\n    return 0\n" for i in range(300))
+    patch_text = "@@ -401,2 +401,2 @@\n-    return 0\n+    return 1"
+    placement, = check_patch_to_lines(text.splitlines(keepends=True), patch_text)
+    windows = plan_windows(text, patch_text, context=1)
+    assert [(w.start, w.end) for w in windows] == [(placement.line - 2, placement.line + 1)]
+
+
+def test_nearby_hunks_share_a_window():
+    patch_text = hunk(100, ["line 100"], ["x"]) + "\n" + hunk(115, ["line 115"], ["y"])
+    windows = plan_windows(BIG, patch_text, context=10)
+    assert len(windows) == 1
+    assert (windows[0].start, windows[0].end) == (90, 126)
+    assert len(split_hunks(windows[0].patch)) == 2
+
+
+def test_falls_back_to_whole_file():
+    # Not found anywhere.
+    assert plan_windows(BIG, hunk(100, ["no such line in the file"], ["x"]), context=10) is None
+    # Two hunks changing the same lines.
+    assert plan_windows(BIG, hunk(100, ["line 100", "line 101"], ["x"]) + "\n" + hunk(101, ["line 101"], ["y"]), context=10) is None
+    # Small files are sent whole.
+    assert plan_windows("a\nb\n", "@@ -1 +1 @@\n-a\n+c", context=10) is None
+
+
+def test_splice_replaces_only_window_lines():
+    windows = plan_windows(BIG, hunk(500, ["line 500"], ["LINE 500"]), context=2)
+    updated = splice_windows(BIG, windows, ["line 498\nline 499\nLINE 500\nline 501\nline 502"])
+    assert updated == BIG.replace("line 500\n", "LINE 500\n")
+
+
+def test_smartapply_sends_only_windows_for_large_files():
+    original = {"big.py": BIG.replace("line 500\n", "line 500 drifted\n")}
+    # The file has drifted from the diff, so it can't be applied exactly.
+    diff_text = "diff --git a/big.py b/big.py\n--- a/big.py\n+++ b/big.py\n@@ -500,3 +500,3 @@\n line 499\n-line 500\n+LINE 500\n line 501"
+    sent = []
+
+    def fake_call_llm(api_key, base_url, model, messages, max_tokens, temperature, budget_tokens=None):
+        sent.append(messages[1]["content"])
+        excerpt = messages[1]["content"].split("```\n", 1)[1].split("```", 1)[0]
+        updated = excerpt.replace("line 500 drifted", "LINE 500")
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=updated))])
+
+    with patch("gptdiff.gptdiff.call_llm", side_effect=fake_call_llm), \
+            patch("gptdiff.gptdiff.call_llm_for_apply") as whole_file:
+        updated = smartapply(diff_text, original)
+
+    assert not whole_file.called
+    assert updated["big.py"] == BIG.replace("line 500\n", "LINE 500\n")
+    assert len(sent) == 1 and len(sent[0]) < len(BIG) // 5
+
+
+def test_window_failures_fall_back_to_the_whole_file():
+    original = {"big.py": BIG.replace("line 500\n", "line 500 drifted\n")}
+    diff_text = "diff --git a/big.py b/big.py\n--- a/big.py\n+++ b/big.py\n@@ -500,3 +500,3 @@\n line 499\n-line 500\n+LINE 500\n line 501"
+    fixed = BIG.replace("line 500\n", "LINE 500\n")
+
+    with patch("gptdiff.gptdiff.call_llm", side_effect=ConnectionError("window request failed")), \
+            patch("gptdiff.gptdiff.call_llm_for_apply", return_value=fixed) as whole_file:
+        updated = smartapply(diff_text, original)
+
+    assert whole_file.called
+    assert "LINE 500" in updated["big.py"]
+
+
+def test_windows_of_one_file_are_sent_one_at_a_time():
+    drifted = BIG.replace("line 300\n", "line 300 drifted\n").replace("line 800\n", "line 800 drifted\n")
+    diff_text = ("diff --git a/big.py b/big.py\n--- a/big.py\n+++ b/big.py\n"
+                 "@@ -300,3 +300,3 @@\n line 299\n-line 300\n+LINE 300\n line 301\n"
+                 "@@ -800,3 +800,3 @@\n line 799\n-line 800\n+LINE 800\n line 801")
+    in_flight = []
+    peak = []
+
+    def fake_call_llm(api_key, base_url, model, messages, max_tokens, temperature, budget_tokens=None):
+        in_flight.append(1)
+        peak.append(len(in_flight))
+        time.sleep(0.01)
+        excerpt = messages[1]["content"].split("```\n", 1)[1].split("```", 1)[0]
+        in_flight.pop()
+        updated = excerpt.replace("line 300 drifted", "LINE 300").replace("line 800 drifted", "LINE 800")
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=updated))])
+
+    with patch("gptdiff.gptdiff.call_llm", side_effect=fake_call_llm):
+        updated = smartapply(diff_text, {"big.py": drifted})
+
+    assert updated["big.py"] == BIG.replace("line 300\n", "LINE 300\n").replace("line 800\n", "LINE 800\n")
+    assert peak == [1, 1]
@@ -0,0 +1,103 @@
+import os
+
+import pytest
+
+from gptdiff.gptdiff import is_ignored, list_files_and_dirs, load_project_files
+from gptdiff.ignore import IgnoreMatcher, parse_ignore_lines
+
+
+def test_basename_patterns_match_at_any_depth():
+    matcher = IgnoreMatcher("/repo", ["*.pyc", "node_modules", "build/"])
+    assert matcher.is_ignored("pkg/mod.pyc", is_dir=False)
+    assert matcher.is_ignored("web/node_modules/react/index.js", is_dir=False)
+    assert matcher.is_ignored("src/build", is_dir=True)
+    # Directory-only rules do not match files of the same name
+    assert not matcher.is_ignored("src/build", is_dir=False)
+    # No substring matching: "build" must be a whole path component
+    assert not matcher.is_ignored("src/rebuild.py", is_dir=False)
+
+
+def test_anchored_patterns():
+    matcher = IgnoreMatcher("/repo", ["/config.py", "docs/*.md"])
+    assert matcher.is_ignored("config.py", is_dir=False)
+    assert not matcher.is_ignored("pkg/config.py", is_dir=False)
+    assert matcher.is_ignored("docs/index.md", is_dir=False)
+    assert not matcher.is_ignored("docs/api/index.md", is_dir=False)
+    assert not matcher.is_ignored("other/docs/index.md", is_dir=False)
+
+
+def test_double_star_patterns():
+    matcher = IgnoreMatcher("/repo", ["**/logs/*.log", "a/**/b", "out/**"])
+    assert matcher.is_ignored("logs/x.log", is_dir=False)
+    assert matcher.is_ignored("deep/er/logs/x.log", is_dir=False)
+    assert matcher.is_ignored("a/b", is_dir=False)
+    assert matcher.is_ignored("a/x/y/b", is_dir=False)
+    assert matcher.is_ignored("out/anything/here.txt", is_dir=False)
+    assert not matcher.is_ignored("out", is_dir=True)
+
+
+def test_negation_last_match_wins():
+    matcher = IgnoreMatcher("/repo", ["*.log", "!keep.log", "keep.log.bak", "*.tmp", "!important.tmp"])
+    assert matcher.is_ignored("debug.log", is_dir=False)
+    assert not matcher.is_ignored("keep.log", is_dir=False)
+    assert not matcher.is_ignored("sub/important.tmp", is_dir=False)
+    assert matcher.is_ignored("sub/other.tmp", is_dir=False)
+
+    reordered = IgnoreMatcher("/repo", ["!keep.log", "*.log"])
+    assert reordered.is_ignored("keep.log", is_dir=False)
+
+
+def test_negation_cannot_reinclude_inside_ignored_directory():
+    matcher = IgnoreMatcher("/repo", ["vendor/", "!vendor/keep.py"])
+    assert matcher.is_ignored("vendor/keep.py", is_dir=False)
+
+
+def test_parse_ignore_lines_comments_and_escapes():
+    lines = ["# comment\n", "\n", "\\#hash\n", "trailing   \n", "escaped\\ \n"]
+    assert parse_ignore_lines(lines) == ["\\#hash", "trailing", "escaped\\ "]
+    matcher = IgnoreMatcher("/repo", parse_ignore_lines(lines))
+    assert matcher.is_ignored("#hash", is_dir=False)
+    assert matcher.is_ignored("escaped ", is_dir=False)
+
+
+def test_nested_gitignore_files(tmp_path):
+    (tmp_path / ".gitignore").write_text("*.log\n")
+    sub = tmp_path / "sub"
+    sub.mkdir()
+    (sub / ".gitignore").write_text("!keep.log\n/local.txt\n")
+    (sub / "keep.log").write_text("keep")
+    (sub / "drop.log").write_text("drop")
+    (sub / "local.txt").write_text("local")
+    (tmp_path / "local.txt").write_text("root local")
+
+    matcher = IgnoreMatcher(tmp_path)
+    listed = {os.path.relpath(p, tmp_path) for p in list_files_and_dirs(str(tmp_path), matcher)}
+    assert os.path.join("sub", "keep.log") in listed
+    assert os.path.join("sub", "drop.log") not in listed
+    assert os.path.join("sub", "local.txt") not in listed
+    assert "local.txt" in listed
+
+    fresh = IgnoreMatcher(tmp_path)
+    assert not fresh.is_ignored(str(sub / "keep.log"), load_nested=True)
+    assert fresh.is_ignored(str(sub / "local.txt"), load_nested=True)
+
+
+def test_load_project_files_skips_ignored_trees(tmp_path, monkeypatch):
+    (tmp_path / ".gitignore").write_text("node_modules/\n*.min.js\n")
+    (tmp_path / "node_modules" / "pkg").mkdir(parents=True)
+    (tmp_path / "node_modules" / "pkg" / "index.js").write_text("module.exports = 1")
+    (tmp_path / "app.js").write_text("console.log(1)")
+    (tmp_path / "app.min.js").write_text("console.log(1)")
+    (tmp_path / ".env").write_text("SECRET=1")
+    monkeypatch.chdir(tmp_path)
+
+    files = [os.path.relpath(path, tmp_path) for path, _ in load_project_files(str(tmp_path), str(tmp_path))]
+    assert files == ["app.js"]
+
+
+def test_is_ignored_compat(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    patterns = ["*.pyc", "prompt.txt"]
+    assert is_ignored("prompt.txt", patterns)
+    assert is_ignored(str(tmp_path / "a" / "b.pyc"), patterns)
+    assert not is_ignored("a/b.py", patterns)
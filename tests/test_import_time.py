@@ -0,0 +1,53 @@
+"""Startup regression checks: CLI entry points must not load the LLM client stack."""
+import os
+import subprocess
+import sys
+
+import pytest
+
+HEAVY_MODULES = ("openai", "tiktoken", "requests", "ai_agent_toolbox", "httpx", "httpx2")
+
+# Generous budget for the cumulative import time of an entry point; a regression
+# that pulls in the LLM client libraries costs several hundred milliseconds.
+IMPORT_BUDGET_US = int(os.getenv("GPTDIFF_IMPORT_BUDGET_MS", "150")) * 1000
+
+
+def import_profile(module):
+    """Import module in a fresh interpreter with -X importtime.
+
+    Returns ({imported module: cumulative microseconds}, loaded top-level module names).
+    """
+    code = f"import sys, {module}; print(' '.join(sorted(sys.modules)))"
+    # Warm the bytecode cache so that compilation isn't counted.
+    subprocess.run([sys.executable, "-c", code], check=True, capture_output=True)
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                               check=True, capture_output=True, text=True)
+    cumulative = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumul, name = line.split("|")
+        cumulative[name.strip()] = int(cumul)
+    loaded = {name.split(".")[0] for name in completed.stdout.split()}
+    return cumulative, loaded
+
+
+@pytest.mark.parametrize("module", ["gptdiff", "gptdiff.gptpatch", "gptdiff.plangptdiff", "gptdiff.applydiff"])
+def test_entry_points_do_not_import_llm_clients(module):
+    _, loaded = import_profile(module)
+    assert not loaded.intersection(HEAVY_MODULES)
+
+
+def test_gptpatch_dumb_path_skips_gptdiff_module():
+    code = "import sys, gptdiff.gptpatch; print('gptdiff.gptdiff' in sys.modules)"
+    completed = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True)
+    assert completed.stdout.strip() == "False"
+
+
+@pytest.mark.parametrize("module", ["gptdiff.gptpatch", "gptdiff.plangptdiff"])
+def test_import_time_budget(module):
+    cumulative, _ = import_profile(module)
+    assert cumulative[module] < IMPORT_BUDGET_US, (
+        f"importing {module} took {cumulative[module] / 1000:.1f} ms "
+        f"(budget {IMPORT_BUDGET_US / 1000:.0f} ms)"
+    )
@@ -38,7 +38,7 @@ DIFF 2"""
 
  
     # Define a dummy call_llm function that returns our fake response
-    def dummy_call_llm(api_key, base_url, model, messages, max_tokens, budget_tokens, temperature):
+    def dummy_call_llm(api_key, base_url, model, messages, max_tokens, budget_tokens, temperature, prompt_tokens=None):
         return DummyResponse(diff_str, prompt_tokens=10, completion_tokens=20, total_tokens=30)
 
     # Patch call_llm in the gptdiff module with our dummy function.
@@ -202,5 +202,42 @@ def test_begin_patch_format():
     assert "-changes1" in patch
     assert "+changes2" in patch
 
+def test_begin_patch_with_several_files():
+    diff_text = """*** Begin Patch
+*** Update File: a.py
+@@
+-a
++A
+*** Add File: new.py
++hello
+*** Delete File: old.py
+*** End Patch"""
+    result = dict(parse_diff_per_file(diff_text))
+    assert list(result) == ["a.py", "new.py", "old.py"]
+    assert result["a.py"] == "@@\n-a\n+A"
+    assert result["new.py"] == "--- /dev/null\n+++ b/new.py\n@@\n+hello"
+    assert "+++ /dev/null" in result["old.py"]
+
+def test_iter_file_patches_yields_each_file_before_reading_the_rest():
+    from gptdiff.applydiff import iter_file_patches
+    read = []
+
+    def lines():
+        for line in ["diff --git a/one.py b/one.py", "+1", "diff --git a/two.py b/two.py", "+2"]:
+            read.append(line)
+            yield line + "\n"
+
+    patches = iter_file_patches(lines())
+    assert next(patches) == ("one.py", "diff --git a/one.py b/one.py\n+1")
+    assert len(read) == 3
+    assert list(patches) == [("two.py", "diff --git a/two.py b/two.py\n+2")]
+
+def test_iter_file_patches_reads_a_file_handle(tmp_path):
+    from gptdiff.applydiff import iter_file_patches
+    diff_file = tmp_path / "changes.diff"
+    diff_file.write_bytes(b"--- a/x.py\r\n+++ b/x.py\r\n@@ -1 +1 @@\r\n-a\r\n+b\r\n")
+    with open(diff_file, encoding="utf8", newline="") as f:
+        assert list(iter_file_patches(f)) == [("x.py", "--- a/x.py\n+++ b/x.py\n@@ -1 +1 @@\n-a\n+b")]
+
 if __name__ == '__main__':
     unittest.main()
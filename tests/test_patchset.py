@@ -0,0 +1,97 @@
+from gptdiff import parse_patchset, smartapply
+from gptdiff.applydiff import FilePatch, PatchSet, apply_diff
+
+DIFF = """diff --git a/src/app.py b/src/app.py
+--- a/src/app.py
++++ b/src/app.py
+@@ -1,3 +1,3 @@
+ def main():
+-    return 1
++    return 2
+ # end
+@@ -10,2 +10,3 @@
+ x = 1
++y = 2
+ z = 3
+diff --git a/new.txt b/new.txt
+new file mode 100644
+--- /dev/null
++++ b/new.txt
+@@ -0,0 +1,2 @@
++hello
++world
+diff --git a/old.txt b/old.txt
+deleted file mode 100644
+--- a/old.txt
++++ /dev/null
+@@ -1 +0,0 @@
+-bye
+"""
+
+
+def test_parse_patchset_describes_each_file():
+    patchset = parse_patchset(DIFF)
+    assert isinstance(patchset, PatchSet)
+    assert patchset.paths == ["src/app.py", "new.txt", "old.txt"]
+    assert [f.operation for f in patchset] == ["modify", "create", "delete"]
+
+    app = patchset[0]
+    assert (app.old_path, app.new_path) == ("src/app.py", "src/app.py")
+    assert [(h.old_count, h.new_count) for h in app.hunks] == [(3, 3), (2, 3)]
+    assert (app.added, app.removed) == (2, 1)
+    assert app.hunks[0].ops[1] == ("-", "    return 1")
+
+    assert (patchset[1].old_path, patchset[1].new_path) == (None, "new.txt")
+    assert (patchset[2].old_path, patchset[2].new_path) == ("old.txt", None)
+
+
+def test_patchset_is_parsed_once_and_passed_through():
+    patchset = parse_patchset(DIFF)
+    assert parse_patchset(patchset) is patchset
+    assert parse_patchset(str(patchset)).paths == patchset.paths
+
+
+def test_file_patch_marks_parser_deletions():
+    # parse_diff_per_file appends "+++ /dev/null" after the hunks of deletions.
+    file_patch = FilePatch("TODO", "--- a/TODO\n-gone\n+++ /dev/null")
+    assert file_patch.operation == "delete"
+
+
+def test_apply_diff_and_smartapply_accept_a_patchset(tmp_path):
+    (tmp_path / "src").mkdir()
+    app = "def main():\n    return 1\n# end\n" + "".join(f"{n}\n" for n in range(6)) + "x = 1\nz = 3\n"
+    (tmp_path / "src" / "app.py").write_text(app)
+    (tmp_path / "old.txt").write_text("bye\n")
+    patchset = parse_patchset(DIFF)
+
+    updated = smartapply(patchset, {"src/app.py": app, "old.txt": "bye\n"})
+    assert updated["src/app.py"] == app.replace("return 1", "return 2").replace("x = 1\n", "x = 1\ny = 2\n")
+    assert updated["new.txt"] == "hello\nworld"
+    assert "old.txt" not in updated
+
+    assert apply_diff(str(tmp_path), patchset)
+    assert (tmp_path / "src" / "app.py").read_text() == updated["src/app.py"]
+    assert (tmp_path / "new.txt").read_text() == "hello\nworld\n"
+    assert not (tmp_path / "old.txt").exists()
+
+
+def test_gptpatch_streams_a_diff_file(tmp_path, monkeypatch):
+    import pathlib
+    from gptdiff import gptpatch
+    (tmp_path / "src").mkdir()
+    app = "def main():\n    return 1\n# end\n" + "".join(f"{n}\n" for n in range(6)) + "x = 1\nz = 3\n"
+    (tmp_path / "src" / "app.py").write_text(app)
+    (tmp_path / "old.txt").write_text("bye\n")
+    diff_file = tmp_path / "changes.diff"
+    diff_file.write_text(DIFF)
+    read_text = pathlib.Path.read_text
+
+    def no_whole_diff(self, *args, **kwargs):
+        assert self != diff_file, "the diff file should be streamed, not read whole"
+        return read_text(self, *args, **kwargs)
+
+    monkeypatch.setattr(pathlib.Path, "read_text", no_whole_diff)
+    monkeypatch.setattr("sys.argv", ["gptpatch", str(diff_file), "--project-dir", str(tmp_path), "--dumb", "--nobeep"])
+    gptpatch.main()
+    assert (tmp_path / "new.txt").read_text() == "hello\nworld\n"
+    assert not (tmp_path / "old.txt").exists()
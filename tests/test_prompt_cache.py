@@ -0,0 +1,113 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from types import SimpleNamespace
+
+import pytest
+
+import gptdiff.gptdiff as gptdiff
+from gptdiff import transport
+from gptdiff.gptdiff import (_anthropic_request, _build_diff_messages, _prompt_cache_counts, _report_prompt_cache,
+                             call_llm_for_diff)
+
+ANTHROPIC = "https://api.anthropic.com/v1/"
+FILES = "File: a.py\nContent:\nx = 1\n"
+
+
+class AnthropicHandler(BaseHTTPRequestHandler):
+    """Records each request body and answers with a cache-hit usage block."""
+    protocol_version = "HTTP/1.1"
+    bodies = []
+
+    def do_POST(self):
+        self.bodies.append(json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0)))))
+        body = json.dumps({
+            "content": [{"type": "text", "text": "```diff\n--- a/a.py\n+++ b/a.py\n@@ -1 +1 @@\n-x = 1\n+x = 2\n```"}],
+            "usage": {"input_tokens": 12, "output_tokens": 30,
+                      "cache_read_input_tokens": 900, "cache_creation_input_tokens": 0},
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def anthropic_server(monkeypatch):
+    handler = type("Handler", (AnthropicHandler,), {"bodies": []})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(gptdiff, "ANTHROPIC_MESSAGES_URL", f"http://127.0.0.1:{server.server_address[1]}/v1/messages")
+    monkeypatch.setattr(gptdiff, "count_tokens", lambda text: len(text.split()))
+    yield handler
+    server.shutdown()
+    transport.close_clients()
+
+
+def test_anthropic_messages_put_files_first_with_a_cache_breakpoint(monkeypatch):
+    monkeypatch.setattr(gptdiff, "count_tokens", lambda text: len(text.split()))
+    messages, _ = _build_diff_messages("system", "goal", FILES, "claude", ANTHROPIC, files_tokens=5)
+    _, data = _anthropic_request("key", "claude", messages, 100, 0.0)
+    assert data["system"].startswith("system")
+    assert data["messages"][0]["content"] == [
+        {"type": "text", "text": FILES, "cache_control": {"type": "ephemeral"}},
+        {"type": "text", "text": "goal"},
+    ]
+
+    # Other providers keep the goal first unless the cache layout is chosen.
+    messages, _ = _build_diff_messages("system", "goal", FILES, "gpt", "http://localhost/", files_tokens=5)
+    assert messages[1]["content"] == "goal\n" + FILES
+
+
+def test_cache_layout_is_opt_in_for_other_providers(monkeypatch):
+    monkeypatch.setattr(gptdiff, "count_tokens", lambda text: len(text.split()))
+    monkeypatch.setenv("GPTDIFF_PROMPT_LAYOUT", "cache")
+    messages, _ = _build_diff_messages("system", "goal", FILES, "gpt", "http://localhost/", files_tokens=5)
+    assert messages[1]["content"] == FILES + "\ngoal"
+
+
+def test_goal_first_layout(monkeypatch):
+    monkeypatch.setattr(gptdiff, "count_tokens", lambda text: len(text.split()))
+    monkeypatch.setenv("GPTDIFF_PROMPT_LAYOUT", "goal-first")
+    messages, _ = _build_diff_messages("system", "goal", FILES, "claude", ANTHROPIC, files_tokens=5)
+    assert messages[1]["content"] == "goal\n" + FILES
+    monkeypatch.setenv("GPTDIFF_PROMPT_LAYOUT", "random")
+    with pytest.raises(ValueError):
+        _build_diff_messages("system", "goal", FILES, "gpt", "http://localhost/", files_tokens=5)
+
+
+def test_openai_cached_tokens_are_reported(capsys):
+    usage = SimpleNamespace(prompt_tokens=2000, completion_tokens=10,
+                            prompt_tokens_details=SimpleNamespace(cached_tokens=1920))
+    assert _prompt_cache_counts(usage) == (1920, 0)
+    assert _prompt_cache_counts({"prompt_tokens": 5, "prompt_tokens_details": None}) == (0, 0)
+    _report_prompt_cache(usage, 2000)
+    assert capsys.readouterr().out == "Prompt cache: 1920 of 2000 input tokens read from cache.\n"
+
+
+def test_cached_tokens_count_as_input_and_are_reported(anthropic_server, capsys):
+    _, diff_text, prompt_tokens, completion_tokens, total_tokens = call_llm_for_diff(
+        "system", "goal", FILES, "claude", temperature=0.5, api_key="key", base_url=ANTHROPIC, files_tokens=5)
+    assert "+x = 2" in diff_text
+    assert (prompt_tokens, completion_tokens, total_tokens) == (912, 30, 942)
+    assert "Prompt cache: 900 of 912 input tokens read from cache." in capsys.readouterr().out
+    assert anthropic_server.bodies[0]["messages"][0]["content"][0]["cache_control"] == {"type": "ephemeral"}
+
+
+def test_cli_prompt_uses_the_configured_endpoints_layout(tmp_path, monkeypatch):
+    (tmp_path / "a.py").write_text("x = 1\n")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(gptdiff.shutil, "which", lambda name: None)
+    monkeypatch.setattr(gptdiff, "count_tokens", lambda text: len(text.split()))
+    monkeypatch.setattr(gptdiff, "count_file_tokens", lambda files, cache=None: [len(c.split()) for _, c in files])
+    monkeypatch.setattr("sys.argv", ["gptdiff", "the goal", "a.py", "--nocache"])
+    monkeypatch.setenv("GPTDIFF_LLM_BASE_URL", ANTHROPIC)
+    with pytest.raises(SystemExit):
+        gptdiff.main()
+    prompt = (tmp_path / "prompt.txt").read_text()
+    assert prompt.index("File: a.py") < prompt.index("the goal")
@@ -0,0 +1,123 @@
+from types import SimpleNamespace
+
+import pytest
+
+import gptdiff.gptdiff as gptdiff
+from gptdiff import ratelimit
+from gptdiff.ratelimit import RateLimiter, get_rate_limiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ratelimit, "time", clock)
+    return clock
+
+
+def test_requests_are_paced_after_the_burst(clock):
+    # 60 requests a minute: a burst of 10 (BURST_SECONDS), then one a second.
+    limiter = RateLimiter(requests_per_minute=60)
+    for _ in range(10):
+        limiter.acquire()
+    assert clock.slept == []
+    limiter.acquire()
+    limiter.acquire()
+    assert clock.slept == [pytest.approx(1.0), pytest.approx(1.0)]
+    assert limiter.waited == pytest.approx(2.0)
+
+
+def test_tokens_are_reserved_then_unused_tokens_given_back(clock):
+    # 6000 tokens a minute: 100 a second, at most 1000 at once.
+    limiter = RateLimiter(tokens_per_minute=6000)
+    reserved = limiter.acquire(1000)
+    limiter.settle(reserved, used=400)
+    limiter.acquire(600)
+    assert clock.slept == []
+    # The bucket is empty now: 500 tokens take five seconds to come back.
+    limiter.acquire(500)
+    assert clock.slept == [pytest.approx(5.0)]
+
+
+def test_request_larger_than_the_bucket_waits_for_a_full_bucket(clock):
+    limiter = RateLimiter(tokens_per_minute=6000)
+    limiter.acquire(5000)
+    assert clock.slept == []
+    # The first request went 4000 tokens into debt.
+    limiter.acquire(100)
+    assert clock.slept == [pytest.approx(41.0)]
+
+
+def test_limiters_share_state_through_the_lock_file(clock, tmp_path):
+    path = str(tmp_path / "limits.json")
+    # Two processes, each with its own limiter for the same endpoint and model.
+    first = RateLimiter(requests_per_minute=60, path=path, key="https://api.example/ model")
+    second = RateLimiter(requests_per_minute=60, path=path, key="https://api.example/ model")
+    other_model = RateLimiter(requests_per_minute=60, path=path, key="https://api.example/ other")
+    for _ in range(5):
+        first.acquire()
+        second.acquire()
+    other_model.acquire()
+    assert clock.slept == []
+    second.acquire()
+    assert clock.slept == [pytest.approx(1.0)]
+
+
+def test_limiter_is_shared_per_endpoint_and_model(monkeypatch):
+    monkeypatch.delenv("GPTDIFF_RATE_LIMIT_RPM", raising=False)
+    monkeypatch.delenv("GPTDIFF_RATE_LIMIT_TPM", raising=False)
+    assert get_rate_limiter("https://api.example/", "model") is None
+    monkeypatch.setenv("GPTDIFF_RATE_LIMIT_TPM", "100000")
+    limiter = get_rate_limiter("https://api.example/", "model")
+    assert get_rate_limiter("https://api.example/", "model") is limiter
+    assert get_rate_limiter("https://api.example/", "other") is not limiter
+    assert limiter.limits == {"tokens": 100000}
+
+
+def test_call_llm_charges_prompt_and_max_tokens_then_settles(monkeypatch, clock):
+    monkeypatch.setenv("GPTDIFF_RATE_LIMIT_TPM", "60000")
+    base_url = "http://ratelimit.test/v1/"
+    limiter = get_rate_limiter(base_url, "test-model")
+    acquired, settled = [], []
+    monkeypatch.setattr(limiter, "acquire", lambda tokens: acquired.append(tokens) or tokens)
+    monkeypatch.setattr(limiter, "settle", lambda reserved, used: settled.append((reserved, used)))
+    response = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="ok"))],
+                               usage=SimpleNamespace(prompt_tokens=120, completion_tokens=30, total_tokens=150))
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=lambda **kwargs: response)))
+    monkeypatch.setattr(gptdiff, "get_openai_client", lambda base_url, api_key: client)
+
+    gptdiff.call_llm("key", base_url, "test-model", [{"role": "user", "content": "x" * 400}], 1000, 0.0)
+    gptdiff.call_llm("key", base_url, "test-model", [], 1000, 0.0, prompt_tokens=250)
+
+    assert acquired == [100 + 1000, 250 + 1000]
+    assert settled == [(1100, 150), (1250, 150)]
+
+
+def test_broken_stream_still_settles_its_reservation(monkeypatch, clock):
+    monkeypatch.setenv("GPTDIFF_RATE_LIMIT_TPM", "60000")
+    base_url = "http://ratelimit.test/stream/"
+    limiter = get_rate_limiter(base_url, "test-model")
+    settled = []
+    monkeypatch.setattr(limiter, "settle", lambda reserved, used: settled.append((reserved, used)))
+
+    def broken_stream(*args):
+        yield "x" * 400
+        raise ConnectionError("stream dropped")
+
+    monkeypatch.setattr(gptdiff, "_llm_stream_chunks", broken_stream)
+    with pytest.raises(ConnectionError):
+        list(gptdiff.call_llm_stream("key", base_url, "test-model", [], 1000, 0.0, prompt_tokens=250))
+    # No usage was reported: the prompt and the 100 tokens received are charged.
+    assert settled == [(1250, 350)]
@@ -0,0 +1,167 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import gptdiff.gptdiff as gptdiff
+from gptdiff import retry, transport
+from gptdiff.gptdiff import call_llm, call_llm_for_apply, call_llm_stream
+from gptdiff.retry import LLMHTTPError, RetryPolicy, RetryStats, retry_after, retry_stats
+
+COMPLETION = {
+    "id": "cmpl-1", "object": "chat.completion", "created": 0, "model": "test-model",
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}, "finish_reason": "stop"}],
+    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+}
+ANTHROPIC_COMPLETION = {"content": [{"type": "text", "text": "ok"}], "usage": {"input_tokens": 1, "output_tokens": 1}}
+ANTHROPIC_STREAM = "".join(f"data: {json.dumps(event)}\n\n" for event in [
+    {"type": "message_start", "message": {"usage": {"input_tokens": 3}}},
+    {"type": "content_block_delta", "delta": {"type": "text_delta", "text": "o"}},
+    {"type": "content_block_delta", "delta": {"type": "text_delta", "text": "k"}},
+    {"type": "message_delta", "usage": {"output_tokens": 2}},
+])
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """Plays one scripted fault per request, then answers normally."""
+    protocol_version = "HTTP/1.1"
+    faults = []
+    requests = 0
+    body = COMPLETION
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        type(self).requests += 1
+        fault = self.faults.pop(0) if self.faults else None
+        if isinstance(fault, float):
+            # Answer too late: the client's attempt timeout has passed.
+            time.sleep(fault)
+            fault = None
+        status, headers = fault if fault else (200, {})
+        if status == 200 and isinstance(self.body, str):
+            # A server-sent event stream.
+            body, content_type = self.body.encode(), "text/event-stream"
+        else:
+            body = json.dumps(self.body if status == 200 else {"error": {"message": "injected"}}).encode()
+            content_type = "application/json"
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def flaky_server(monkeypatch):
+    monkeypatch.setattr(retry, "BASE_DELAY", 0.01)
+    retry_stats().reset()
+    handler = type("Handler", (FlakyHandler,), {"faults": [], "requests": 0})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1/", handler
+    server.shutdown()
+    transport.close_clients()
+    retry_stats().reset()
+
+
+def test_call_llm_retries_rate_limits_and_server_errors(flaky_server):
+    base_url, handler = flaky_server
+    handler.faults = [(429, {"Retry-After": "0"}), (500, {}), (529, {})]
+    response = call_llm("key", base_url, "test-model", MESSAGES, max_tokens=10, temperature=0.0)
+    assert response.choices[0].message.content == "ok"
+    assert handler.requests == 4
+    stats = retry_stats()
+    assert (stats.calls, stats.retries, stats.gave_up) == (1, 3, 0)
+    assert stats.reasons == {"429": 1, "500": 1, "529": 1}
+    assert stats.summary().startswith("LLM retries: 3 over 1 calls")
+
+
+def test_call_llm_for_apply_retries_timeouts(flaky_server, monkeypatch):
+    base_url, handler = flaky_server
+    monkeypatch.setenv("GPTDIFF_LLM_TIMEOUT", "0.2")
+    handler.faults = [0.6]
+    assert call_llm_for_apply("a.py", "x = 1\n", "@@ -1 +1 @@\n-x = 1\n+x = 2", "test-model",
+                              api_key="key", base_url=base_url) == "ok"
+    assert retry_stats().reasons == {"timeout": 1}
+
+
+def test_anthropic_requests_are_retried(flaky_server, monkeypatch):
+    base_url, handler = flaky_server
+    handler.body = ANTHROPIC_COMPLETION
+    handler.faults = [(529, {"retry-after": "0"}), (503, {})]
+    monkeypatch.setattr(gptdiff, "ANTHROPIC_MESSAGES_URL", base_url + "messages")
+    response = call_llm("key", "https://api.anthropic.com/v1/", "claude", MESSAGES, max_tokens=10, temperature=0.0)
+    assert response.choices[0].message.content == "ok"
+    assert handler.requests == 3
+
+
+def test_opening_a_stream_is_retried_and_errors_are_raised(flaky_server, monkeypatch):
+    base_url, handler = flaky_server
+    handler.body = ANTHROPIC_STREAM
+    handler.faults = [(529, {"retry-after": "0"})]
+    monkeypatch.setattr(gptdiff, "ANTHROPIC_MESSAGES_URL", base_url + "messages")
+    usage = {}
+    chunks = list(call_llm_stream("key", "https://api.anthropic.com/v1/", "claude", MESSAGES, 10, 0.0, usage=usage))
+    assert "".join(chunks) == "ok"
+    assert usage["prompt_tokens"] == 3 and usage["completion_tokens"] == 2
+    assert handler.requests == 2
+
+    # An error body has no events: it is raised instead of read as an empty reply.
+    handler.faults = [(400, {})]
+    with pytest.raises(LLMHTTPError) as raised:
+        list(call_llm_stream("key", "https://api.anthropic.com/v1/", "claude", MESSAGES, 10, 0.0))
+    assert raised.value.status_code == 400
+
+
+def test_client_errors_are_not_retried(flaky_server):
+    base_url, handler = flaky_server
+    handler.faults = [(400, {})]
+    with pytest.raises(Exception) as raised:
+        call_llm("key", base_url, "test-model", MESSAGES, max_tokens=10, temperature=0.0)
+    assert getattr(raised.value, "status_code", None) == 400
+    assert handler.requests == 1
+    assert retry_stats().summary() is None
+
+
+def test_gives_up_after_max_retries_or_at_the_deadline():
+    stats = RetryStats()
+    attempts = []
+
+    def overloaded(timeout):
+        attempts.append(timeout)
+        raise LLMHTTPError(529)
+
+    with pytest.raises(LLMHTTPError):
+        RetryPolicy(max_retries=2, base_delay=0, stats=stats).call(overloaded)
+    assert len(attempts) == 3
+    assert (stats.retries, stats.gave_up) == (2, 1)
+
+    # A Retry-After beyond the deadline gives up at once instead of sleeping.
+    attempts.clear()
+
+    def rate_limited(timeout):
+        attempts.append(timeout)
+        raise LLMHTTPError(429, {"Retry-After": "60"})
+
+    started = time.monotonic()
+    with pytest.raises(LLMHTTPError):
+        RetryPolicy(deadline=5, stats=stats).call(rate_limited)
+    assert len(attempts) == 1 and attempts[0] <= 5
+    assert time.monotonic() - started < 1
+
+
+def test_retry_after_formats():
+    assert retry_after(LLMHTTPError(429, {"Retry-After": "2.5"})) == 2.5
+    assert retry_after(LLMHTTPError(429, {"retry-after-ms": "250", "Retry-After": "9"})) == 0.25
+    assert retry_after(LLMHTTPError(429, {"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})) == 0.0
+    assert retry_after(LLMHTTPError(429, {"Retry-After": "soon"})) is None
+    assert retry_after(LLMHTTPError(500)) is None
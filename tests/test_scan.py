@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+import gptdiff.gptdiff as gd
+from gptdiff.gptdiff import list_files_and_dirs, load_project_files, scan_project_tree
+from gptdiff.ignore import IgnoreMatcher
+
+
+@pytest.fixture
+def project(tmp_path):
+    (tmp_path / ".gitignore").write_text("node_modules/\nbuild/\n")
+    for rel in ["src/app.py", "src/lib/util.py", "docs/index.md", "README.md",
+                "node_modules/pkg/index.js", "build/out/app.bin"]:
+        path = tmp_path / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(rel)
+    return tmp_path
+
+
+def test_ignored_directories_are_pruned_before_listing(project, monkeypatch):
+    opened = []
+    real_scandir = os.scandir
+
+    def recording_scandir(path):
+        opened.append(os.path.relpath(path, project))
+        return real_scandir(path)
+
+    monkeypatch.setattr(gd.os, "scandir", recording_scandir)
+    listed = {os.path.relpath(p, project) for p in list_files_and_dirs(str(project), IgnoreMatcher(project))}
+
+    assert os.path.join("src", "lib", "util.py") in listed
+    assert not any(p.startswith("node_modules") or p.startswith("build") for p in listed)
+    assert not any(p.startswith("node_modules") or p.startswith("build") for p in opened)
+
+
+def test_scan_reports_file_flags(project):
+    entries = {os.path.relpath(p, project): is_file for p, is_file in scan_project_tree(str(project), IgnoreMatcher(project))}
+    assert entries["src"] is False
+    assert entries[os.path.join("src", "app.py")] is True
+
+
+@pytest.mark.skipif(not hasattr(os, "symlink"), reason="symlinks not supported")
+def test_symlink_loops_are_not_followed(project):
+    try:
+        os.symlink(project / "src", project / "src" / "lib" / "loop")
+    except OSError:
+        pytest.skip("cannot create symlinks here")
+
+    listed = [os.path.relpath(p, project) for p in list_files_and_dirs(str(project), IgnoreMatcher(project))]
+    assert len(listed) == len(set(listed))
+    assert not any("loop" + os.sep in p for p in listed)
+
+
+def test_thread_pool_scan_matches_sequential_order(project):
+    for i in range(20):
+        (project / "src" / f"pkg{i}").mkdir()
+        (project / "src" / f"pkg{i}" / "mod.py").write_text(str(i))
+
+    sequential = scan_project_tree(str(project), IgnoreMatcher(project), workers=0)
+    threaded = scan_project_tree(str(project), IgnoreMatcher(project), workers=8)
+    assert threaded == sequential
+
+
+def test_scan_order_does_not_depend_on_the_filesystem(project, monkeypatch):
+    class ReversedScandir:
+        def __init__(self, path):
+            self.entries = list(real_scandir(path))[::-1]
+
+        def __enter__(self):
+            return iter(self.entries)
+
+        def __exit__(self, *exc):
+            return False
+
+    real_scandir = os.scandir
+    expected = [os.path.relpath(p, project) for p in list_files_and_dirs(str(project), IgnoreMatcher(project))]
+    monkeypatch.setattr(gd.os, "scandir", ReversedScandir)
+    listed = [os.path.relpath(p, project) for p in list_files_and_dirs(str(project), IgnoreMatcher(project))]
+    assert listed == expected
+    assert listed == [".gitignore", "README.md", "docs", os.path.join("docs", "index.md"), "src",
+                      os.path.join("src", "app.py"), os.path.join("src", "lib"), os.path.join("src", "lib", "util.py")]
+
+
+def test_load_project_files_uses_scan_workers_env(project, monkeypatch):
+    monkeypatch.setenv("GPTDIFF_SCAN_WORKERS", "4")
+    files = {os.path.relpath(p, project) for p, _ in load_project_files(str(project), str(project))}
+    assert files == {os.path.join("src", "app.py"), os.path.join("src", "lib", "util.py"),
+                     os.path.join("docs", "index.md"), "README.md"}
@@ -0,0 +1,109 @@
+import threading
+import time
+
+import pytest
+
+from gptdiff.scheduler import ApplyPool
+
+
+def test_runs_costliest_waiting_job_first():
+    order = []
+    started = threading.Event()
+    gate = threading.Event()
+
+    def run(key, item):
+        order.append(key)
+        if key == "blocker":
+            started.set()
+            gate.wait(5)
+
+    with ApplyPool(run, workers=1) as pool:
+        # Occupy the only worker, queue the rest, then release it.
+        pool.submit("blocker", None)
+        assert started.wait(5)
+        for key, cost in [("small", 1), ("huge", 100), ("medium", 10)]:
+            pool.submit(key, None, cost=cost)
+        gate.set()
+
+    assert order == ["blocker", "huge", "medium", "small"]
+
+
+def test_never_runs_more_than_workers_at_once():
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def run(key, item):
+        with lock:
+            active.append(key)
+            peak.append(len(active))
+        time.sleep(0.01)
+        with lock:
+            active.remove(key)
+
+    with ApplyPool(run, workers=3) as pool:
+        for i in range(12):
+            pool.submit(i, None)
+
+    assert max(peak) == 3
+
+
+def test_same_key_runs_in_submission_order_never_concurrently():
+    seen = []
+    running = set()
+    overlap = []
+
+    def run(key, item):
+        if key in running:
+            overlap.append(key)
+        running.add(key)
+        time.sleep(0.01)
+        seen.append((key, item))
+        running.discard(key)
+
+    with ApplyPool(run, workers=4) as pool:
+        for i in range(5):
+            pool.submit("a.py", i, cost=i)
+            pool.submit(f"other{i}.py", i)
+
+    assert [item for key, item in seen if key == "a.py"] == [0, 1, 2, 3, 4]
+    assert overlap == []
+
+
+def test_jobs_submitted_while_running_are_picked_up():
+    done = []
+    pool = ApplyPool(lambda key, item: done.append(key), workers=1)
+    pool.submit("one", None)
+    time.sleep(0.02)
+    pool.submit("two", None)
+    pool.close()
+    assert done == ["one", "two"]
+
+
+def test_burst_of_submits_starts_enough_workers():
+    barrier = threading.Barrier(4, timeout=5)
+    pool = ApplyPool(lambda key, item: key == "warmup" or barrier.wait(), workers=4)
+    pool.submit("warmup", None)
+    while pool._idle != 1:
+        time.sleep(0.001)
+    # Holding the lock keeps the notified idle worker from waking mid-burst.
+    with pool._cond:
+        for key in "abcd":
+            pool.submit(key, None)
+    pool.close()
+    assert len(pool._threads) == 4
+
+def test_close_reraises_first_error_after_other_jobs_finish():
+    done = []
+
+    def run(key, item):
+        if key == "bad":
+            raise ValueError("boom")
+        done.append(key)
+
+    pool = ApplyPool(run, workers=1)
+    pool.submit("bad", None, cost=10)
+    pool.submit("good", None)
+    with pytest.raises(ValueError, match="boom"):
+        pool.close()
+    assert done == ["good"]
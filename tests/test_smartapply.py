@@ -1,4 +1,7 @@
+from types import SimpleNamespace
+
 from gptdiff import smartapply
+from gptdiff.gptdiff import smart_apply_stream
 from unittest.mock import patch
 
 def test_smartapply_file_deletion():
@@ -263,4 +266,81 @@ diff --git a/game.js b/game.js
     monkeypatch.setattr('gptdiff.gptdiff.call_llm_for_apply', mock_call_llm)
     updated_files = smartapply(diff_text, original_files)
     assert "game.js" in updated_files, "The new file 'game.js' should be created"
-    assert updated_files["game.js"] == expected_content, "The file content should match the diff"
\ No newline at end of file
+    assert updated_files["game.js"] == expected_content, "The file content should match the diff"
+
+def test_smartapply_applies_exact_patches_without_llm(capsys):
+    """Patches that match exactly are applied in memory; only the rest reach the LLM."""
+    diff_text = '''diff --git a/exact.py b/exact.py
+--- a/exact.py
++++ b/exact.py
+@@ -1,2 +1,2 @@
+ def f():
+-    return 1
++    return 2
+diff --git a/drifted.py b/drifted.py
+--- a/drifted.py
++++ b/drifted.py
+@@ -1,2 +1,2 @@
+ def g():
+-    return 1
++    return 2'''
+
+    original_files = {
+        "exact.py": "def f():\n    return 1",
+        "drifted.py": "def g():\n    return 3",
+    }
+
+    with patch('gptdiff.gptdiff.call_llm_for_apply', return_value="def g():\n    return 2") as llm:
+        updated_files = smartapply(diff_text, original_files)
+
+    assert updated_files["exact.py"] == "def f():\n    return 2"
+    assert updated_files["drifted.py"] == "def g():\n    return 2"
+    assert [c.args[0] for c in llm.call_args_list] == ["drifted.py"]
+    assert "1/2 files applied exactly" in capsys.readouterr().out
+
+
+def test_smartapply_sends_fuzzed_patches_to_the_llm(capsys):
+    """Offset placements are applied in memory; fuzzed ones are left to the LLM."""
+    diff_text = '''diff --git a/moved.py b/moved.py
+--- a/moved.py
++++ b/moved.py
+@@ -1,2 +1,2 @@
+ def f():
+-    return 1
++    return 2
+diff --git a/fuzzy.py b/fuzzy.py
+--- a/fuzzy.py
++++ b/fuzzy.py
+@@ -1,3 +1,3 @@
+ def g():
+-    return 1
++    return 2
+ # end'''
+
+    original_files = {
+        "moved.py": "import os\n\ndef f():\n    return 1\n",
+        "fuzzy.py": "def G():\n    return 1\n# END\n",
+    }
+
+    with patch('gptdiff.gptdiff.call_llm_for_apply', return_value="def G():\n    return 2\n# END\n") as llm:
+        updated_files = smartapply(diff_text, original_files)
+
+    assert updated_files["moved.py"] == "import os\n\ndef f():\n    return 2\n"
+    assert [c.args[0] for c in llm.call_args_list] == ["fuzzy.py"]
+    assert "0/2 files applied exactly without the LLM (0%), 1 more at an offset" in capsys.readouterr().out
+
+
+def test_smart_apply_stream_keeps_a_missing_final_newline(tmp_path):
+    (tmp_path / "a.py").write_text("a = 1\nb = 2")
+    (tmp_path / "b.py").write_text("c = 1")
+    patches = [
+        ("a.py", "--- a/a.py\n+++ b/a.py\n@@ -1,2 +1,2 @@\n-a = 1\n+a = 3\n b = 2"),
+        ("b.py", "--- a/b.py\n+++ b/b.py\n@@ -1 +1 @@\n-c = 1\n\\ No newline at end of file\n+c = 2"),
+    ]
+    args = SimpleNamespace(applymodel="m", max_tokens=100, beep=False, atomic=False)
+    with patch('gptdiff.gptdiff.call_llm_for_apply') as llm:
+        smart_apply_stream(str(tmp_path), patches, "", args)
+    assert not llm.called
+    assert (tmp_path / "a.py").read_text() == "a = 3\nb = 2"
+    # The patch says the new last line ends in a newline.
+    assert (tmp_path / "b.py").read_text() == "c = 2\n"
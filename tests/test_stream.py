@@ -0,0 +1,125 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from gptdiff import gptdiff
+from gptdiff.gptdiff import DiffStreamParser, generate_diff_stream, smart_apply_stream
+
+RESPONSE = """Here is the change.
+```diff
+diff --git a/one.py b/one.py
+--- a/one.py
++++ b/one.py
+@@ -1,2 +1,2 @@
+ def one():
+-    return 1
++    return 11
+diff --git a/two.py b/two.py
+--- a/two.py
++++ b/two.py
+@@ -1 +1 @@
+-x = 2
++x = 22
+```
+Done.
+"""
+
+
+def feed_in_chunks(parser, text, size):
+    completed = []
+    for i in range(0, len(text), size):
+        completed.extend(parser.feed(text[i:i + size]))
+    completed.extend(parser.close())
+    return completed
+
+
+@pytest.mark.parametrize("size", [1, 7, 64, len(RESPONSE)])
+def test_parser_splits_files_across_chunk_boundaries(size):
+    parser = DiffStreamParser()
+    completed = feed_in_chunks(parser, RESPONSE, size)
+    assert [path for path, _ in completed] == ["one.py", "two.py"]
+    assert "+    return 11" in completed[0][1]
+    assert "x = 22" not in completed[0][1]
+    assert completed[1][1].rstrip().endswith("+x = 22")
+    assert parser.diff_text.startswith("diff --git a/one.py b/one.py")
+
+
+def test_parser_emits_first_file_before_stream_ends():
+    parser = DiffStreamParser()
+    head, tail = RESPONSE.split("diff --git a/two.py", 1)
+    # The next file header is what completes the first file.
+    assert parser.feed(head) == []
+    first = parser.feed("diff --git a/two.py b/two.py\n")
+    assert [path for path, _ in first] == ["one.py"]
+
+
+def test_parser_splits_on_from_to_headers_without_git_lines():
+    text = "```diff\n--- a/a.py\n+++ b/a.py\n@@ -1 +1 @@\n-a\n+b\n--- a/b.py\n+++ b/b.py\n@@ -1 +1 @@\n-c\n+d\n```\n"
+    parser = DiffStreamParser()
+    completed = feed_in_chunks(parser, text, 3)
+    assert [path for path, _ in completed] == ["a.py", "b.py"]
+    # A removed line that looks like a header does not start a new file.
+    text = "```diff\n--- a/a.py\n+++ b/a.py\n@@ -1,2 +1 @@\n--- not a header\n keep\n```"
+    parser = DiffStreamParser()
+    completed = parser.feed(text) + parser.close()
+    assert [path for path, _ in completed] == ["a.py"]
+
+
+def test_parser_ignores_text_outside_diff_blocks():
+    parser = DiffStreamParser()
+    assert feed_in_chunks(parser, "diff --git a/x b/x\nno fences here\n", 4) == []
+    assert parser.diff_text == ""
+
+
+def test_generate_diff_stream_yields_files_as_they_arrive(monkeypatch):
+    fed = []
+
+    def fake_stream(api_key, base_url, model, messages, max_tokens, temperature, budget_tokens=None, usage=None, prompt_tokens=None):
+        for i in range(0, len(RESPONSE), 10):
+            fed.append(i)
+            yield RESPONSE[i:i + 10]
+        usage.update(prompt_tokens=5, completion_tokens=7)
+
+    monkeypatch.setattr(gptdiff, "call_llm_stream", fake_stream)
+    monkeypatch.setattr(gptdiff, "count_tokens", lambda text: len(text.split()))
+
+    stream = generate_diff_stream("File: one.py\nContent:\n", "bump", model="test-model", api_key="k", base_url="http://localhost/")
+    first_path, _ = next(stream)
+    assert first_path == "one.py"
+    assert len(fed) < len(range(0, len(RESPONSE), 10))
+    assert [path for path, _ in stream] == ["two.py"]
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_smart_apply_stream_starts_before_stream_finishes(tmp_path, monkeypatch):
+    (tmp_path / "one.py").write_text("def one():\n    return 1\n")
+    # two.py has drifted from the diff, so it needs the LLM.
+    (tmp_path / "two.py").write_text("x = 3\n")
+
+    def fake_apply(file_path, original_content, file_diff, model, **kwargs):
+        return "x = 22\n"
+
+    monkeypatch.setattr(gptdiff, "call_llm_for_apply_with_think_tool_available", fake_apply)
+
+    def patches():
+        parser = DiffStreamParser()
+        head, tail = RESPONSE.split("--- a/two.py", 1)
+        yield from parser.feed(head)
+        # one.py is already applied while two.py is still streaming.
+        assert wait_for(lambda: "11" in (tmp_path / "one.py").read_text())
+        yield from parser.feed("--- a/two.py" + tail)
+        yield from parser.close()
+
+    args = SimpleNamespace(applymodel="m", max_tokens=100, beep=False)
+    smart_apply_stream(str(tmp_path), patches(), "bump", args)
+    assert (tmp_path / "one.py").read_text() == "def one():\n    return 11\n"
+    assert (tmp_path / "two.py").read_text() == "x = 22\n"
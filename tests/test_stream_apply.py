@@ -0,0 +1,91 @@
+import io
+import random
+
+import pytest
+
+import gptdiff.applydiff as applydiff
+from gptdiff.applydiff import PatchApplyError, apply_diff, apply_patch_to_stream, apply_patch_to_text
+
+ORIGINAL = "".join(f"row {i}\n" for i in range(500))
+
+
+def stream(original, patch, **kwargs):
+    dest = io.BytesIO()
+    apply_patch_to_stream(io.BytesIO(original.encode("utf8")), dest, patch, **kwargs)
+    return dest.getvalue().decode("utf8")
+
+
+def random_patch(rng, lines):
+    parts = []
+    line = 0
+    while True:
+        line += rng.randint(3, 60)
+        if line + 4 >= len(lines):
+            break
+        # Headers are off by a few lines, so hunks have to be searched for.
+        header = max(line + rng.randint(-5, 5), 1)
+        removed = rng.randint(0, 2)
+        parts.append(f"@@ -{header},{removed + 2} +{header},2 @@")
+        parts.append(" " + lines[line - 1])
+        parts += ["-" + lines[line + k] for k in range(removed)]
+        parts += [f"+added {line} {k}" for k in range(rng.randint(0, 2))]
+        parts.append(" " + lines[line + removed])
+        line += removed + 1
+    return "\n".join(parts)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_in_memory_apply_across_block_boundaries(monkeypatch, seed):
+    # Tiny blocks, so lines and hunks straddle every block boundary.
+    monkeypatch.setattr(applydiff, "_STREAM_BLOCK", 7)
+    rng = random.Random(seed)
+    patch = random_patch(rng, ORIGINAL.splitlines())
+    assert stream(ORIGINAL, patch) == apply_patch_to_text(ORIGINAL, patch)
+
+
+def test_reports_placements_and_keeps_crlf_endings():
+    original = ORIGINAL.replace("\n", "\r\n")
+    placements = []
+    result = stream(original, "@@ -200,2 +200,2 @@\n row 210\n-row 211\n+ROW 211", placements=placements)
+    assert result == original.replace("row 211\r\n", "ROW 211\r\n")
+    assert [str(p) for p in placements] == ["Hunk #1 succeeded at 211 (offset 11 lines)."]
+
+
+def test_adds_a_final_newline():
+    assert stream("a\nb", "@@ -1,2 +1,2 @@\n a\n-b\n+c") == "a\nc\n"
+    assert stream("a\nb", "@@ -1 +1 @@\n-a\n+z") == "z\nb\n"
+
+
+def test_hunk_beyond_the_search_window_fails():
+    patch = "@@ -10,1 +10,1 @@\n-row 400\n+ROW 400"
+    with pytest.raises(PatchApplyError, match="Hunk #1 FAILED at 10"):
+        stream(ORIGINAL, patch, search_lines=100)
+    assert "ROW 400" in stream(ORIGINAL, patch, search_lines=1000)
+
+
+def test_apply_diff_streams_large_files(tmp_path, monkeypatch):
+    monkeypatch.setenv("GPTDIFF_STREAM_APPLY_MB", "0.001")
+    (tmp_path / "big.txt").write_text(ORIGINAL)
+    (tmp_path / "small.txt").write_text("x\n")
+    diff_text = (
+        "--- a/big.txt\n+++ b/big.txt\n@@ -300 +300 @@\n-row 299\n+ROW 299\n"
+        "--- a/small.txt\n+++ b/small.txt\n@@ -1 +1 @@\n-x\n+y\n"
+    )
+    read_text = []
+    real_read_text = applydiff.Path.read_text
+
+    def recording_read_text(self, *args, **kwargs):
+        read_text.append(self.name)
+        return real_read_text(self, *args, **kwargs)
+
+    monkeypatch.setattr(applydiff.Path, "read_text", recording_read_text)
+    assert apply_diff(str(tmp_path), diff_text) is True
+    assert read_text == ["small.txt"]
+    assert (tmp_path / "big.txt").read_text() == ORIGINAL.replace("row 299\n", "ROW 299\n")
+
+    # A failing hunk in a streamed file still leaves every file untouched.
+    (tmp_path / "small.txt").write_text("x\n")
+    bad = diff_text.replace("-row 299", "-no such row")
+    assert apply_diff(str(tmp_path), bad) is False
+    assert (tmp_path / "small.txt").read_bytes() == b"x\n"
+    assert (tmp_path / "big.txt").read_text() == ORIGINAL.replace("row 299\n", "ROW 299\n")
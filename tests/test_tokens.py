@@ -0,0 +1,79 @@
+import os
+import re
+import time
+
+import pytest
+
+import gptdiff.tokens as tokens
+from gptdiff.cache import FileCache
+from gptdiff.gptdiff import call_llm_for_diff
+
+
+class FakeEncoding:
+    """Whitespace tokenizer that records how much text it encoded."""
+
+    def __init__(self):
+        self.encoded = []
+        self.batch_calls = 0
+
+    def encode_ordinary(self, text):
+        self.encoded.append(text)
+        return text.split()
+
+    def encode_ordinary_batch(self, texts, num_threads=8):
+        self.batch_calls += 1
+        return [self.encode_ordinary(text) for text in texts]
+
+
+@pytest.fixture
+def fake_encoding(monkeypatch):
+    enc = FakeEncoding()
+    monkeypatch.setattr(tokens, "get_encoding", lambda name=tokens.ENCODING_NAME: enc)
+    return enc
+
+
+def test_count_file_tokens_encodes_each_file_once_in_a_batch(fake_encoding):
+    files = [("a.py", "one two three"), ("b.py", "four"), ("c.py", "")]
+    assert tokens.count_file_tokens(files) == [3, 1, 0]
+    assert fake_encoding.batch_calls == 1
+    assert sorted(fake_encoding.encoded) == sorted(["one two three", "four", ""])
+
+
+def test_count_file_tokens_reuses_cached_counts(fake_encoding, tmp_path):
+    source = tmp_path / "a.py"
+    source.write_text("alpha beta")
+    past = time.time() - 10
+    os.utime(source, (past, past))
+    cache_dir = str(tmp_path / "cache")
+
+    with FileCache(cache_dir) as cache:
+        files = [(str(source), cache.read_text(str(source)))]
+        assert tokens.count_file_tokens(files, cache) == [2]
+    fake_encoding.encoded.clear()
+
+    with FileCache(cache_dir) as cache:
+        files = [(str(source), cache.read_text(str(source)))]
+        assert tokens.count_file_tokens(files, cache) == [2]
+    assert fake_encoding.encoded == []
+
+
+def test_call_llm_for_diff_uses_precomputed_file_tokens(fake_encoding, monkeypatch, capsys):
+    class Message:
+        content = "```diff\n--- a/x\n+++ b/x\n```"
+
+    class Choice:
+        message = Message()
+
+    class Response:
+        choices = [Choice()]
+        usage = None
+
+    monkeypatch.setattr("gptdiff.gptdiff.call_llm", lambda **kwargs: Response())
+    files_content = "File: x\nContent:\n" + "word " * 1000
+
+    call_llm_for_diff("system", "goal", files_content, "test-model", api_key="k", base_url="http://localhost/",
+                      files_tokens=1234)
+
+    assert all(len(text) < 1000 for text in fake_encoding.encoded)
+    reported = int(re.search(r"with (\d+) input tokens", capsys.readouterr().out).group(1))
+    assert 1234 < reported < 1234 + 200
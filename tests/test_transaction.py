@@ -0,0 +1,137 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import gptdiff.gptdiff as gptdiff
+from gptdiff.applydiff import apply_diff
+from gptdiff.gptdiff import smart_apply_stream
+from gptdiff.transaction import ApplyTransaction
+
+
+def tree(root):
+    return {
+        str(path.relative_to(root)): path.read_text()
+        for path in sorted(root.rglob("*")) if path.is_file()
+    }
+
+
+def test_commit_writes_creates_and_deletes(tmp_path):
+    (tmp_path / "keep.txt").write_text("old\n")
+    (tmp_path / "gone.txt").write_text("bye\n")
+    transaction = ApplyTransaction()
+    transaction.write(tmp_path / "keep.txt", "new\n")
+    transaction.write(tmp_path / "sub" / "dir" / "made.txt", b"made\n")
+    transaction.delete(tmp_path / "gone.txt")
+    transaction.delete(tmp_path / "never-existed.txt")
+    transaction.commit()
+    assert tree(tmp_path) == {"keep.txt": "new\n", "sub/dir/made.txt": "made\n"}
+
+
+def test_commit_streams_a_list_of_lines(tmp_path):
+    transaction = ApplyTransaction()
+    transaction.write(tmp_path / "lines.txt", ["first\n", "caf\u00e9\n", "last\n"])
+    transaction.commit()
+    assert (tmp_path / "lines.txt").read_bytes() == "first\ncaf\u00e9\nlast\n".replace("\n", os.linesep).encode("utf8")
+
+
+def test_failure_part_way_through_commit_restores_everything(tmp_path, monkeypatch):
+    (tmp_path / "a.txt").write_text("a\n")
+    (tmp_path / "b.txt").write_text("b\n")
+    (tmp_path / "c.txt").write_text("c\n")
+    before = tree(tmp_path)
+    transaction = ApplyTransaction()
+    transaction.write(tmp_path / "a.txt", "A\n")
+    transaction.delete(tmp_path / "b.txt")
+    transaction.write(tmp_path / "new" / "d.txt", "D\n")
+    transaction.write(tmp_path / "c.txt", "C\n")
+
+    real_replace = os.replace
+    failed = []
+
+    def flaky_replace(src, dst):
+        if str(dst).endswith("c.txt") and not failed:
+            failed.append(dst)
+            raise OSError("disk full")
+        return real_replace(src, dst)
+
+    monkeypatch.setattr(os, "replace", flaky_replace)
+    with pytest.raises(OSError, match="disk full"):
+        transaction.commit()
+    monkeypatch.undo()
+    # Contents, deleted files and created directories are restored, and no temp files or backups remain.
+    assert tree(tmp_path) == before
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a.txt", "b.txt", "c.txt"]
+
+
+def test_apply_diff_changes_nothing_when_a_later_file_fails(tmp_path):
+    (tmp_path / "one.py").write_text("a = 1\n")
+    (tmp_path / "two.py").write_text("b = 2\n")
+    (tmp_path / "three.py").write_text("c = 3\n")
+    before = tree(tmp_path)
+    diff = """--- a/one.py
++++ b/one.py
+@@ -1 +1 @@
+-a = 1
++a = 10
+--- a/three.py
++++ /dev/null
+@@ -1 +0,0 @@
+-c = 3
+--- a/two.py
++++ b/two.py
+@@ -1 +1 @@
+-b = 999
++b = 20
+"""
+    assert apply_diff(str(tmp_path), diff) is False
+    assert tree(tmp_path) == before
+
+
+def test_atomic_smartapply_writes_nothing_if_any_file_fails(tmp_path, monkeypatch):
+    (tmp_path / "one.py").write_text("a = 1\n")
+    (tmp_path / "two.py").write_text("b = 2\n")
+    before = tree(tmp_path)
+
+    def failing_apply(*args, **kwargs):
+        raise RuntimeError("model unavailable")
+
+    monkeypatch.setattr(gptdiff, "call_llm_for_apply_with_think_tool_available", failing_apply)
+    patches = [
+        ("one.py", "--- a/one.py\n+++ b/one.py\n@@ -1 +1 @@\n-a = 1\n+a = 10"),
+        # Drifted, so it needs the LLM, which fails.
+        ("two.py", "--- a/two.py\n+++ b/two.py\n@@ -1 +1 @@\n-b = 999\n+b = 20"),
+    ]
+    args = SimpleNamespace(applymodel="m", max_tokens=100, beep=False, atomic=True)
+    smart_apply_stream(str(tmp_path), patches, "", args)
+    assert tree(tmp_path) == before
+
+    # Without the failing file, the rest is written.
+    smart_apply_stream(str(tmp_path), patches[:1], "", args)
+    assert tree(tmp_path) == {"one.py": "a = 10\n", "two.py": "b = 2\n"}
+
+
+def test_read_returns_staged_content(tmp_path):
+    (tmp_path / "a.txt").write_text("disk\n")
+    (tmp_path / "b.txt").write_text("b\n")
+    transaction = ApplyTransaction()
+    assert transaction.read(tmp_path / "a.txt") == "disk\n"
+    transaction.write(tmp_path / "a.txt", "staged\n")
+    transaction.write(tmp_path / "lines.txt", ["x\n", "y\n"])
+    transaction.delete(tmp_path / "b.txt")
+    assert transaction.read(tmp_path / "a.txt") == "staged\n"
+    assert transaction.read(tmp_path / "lines.txt") == "x\ny\n"
+    with pytest.raises(FileNotFoundError):
+        transaction.read(tmp_path / "b.txt")
+
+
+def test_atomic_smartapply_stream_builds_on_earlier_patches_for_a_file(tmp_path):
+    (tmp_path / "app.py").write_text("a = 1\nb = 2\n")
+    patches = [
+        ("app.py", "--- a/app.py\n+++ b/app.py\n@@ -1 +1 @@\n-a = 1\n+a = 10"),
+        # A second diff block for the same file, as a streamed diff may contain.
+        ("app.py", "--- a/app.py\n+++ b/app.py\n@@ -2 +2 @@\n-b = 2\n+b = 20"),
+    ]
+    args = SimpleNamespace(applymodel="m", max_tokens=100, beep=False, atomic=True)
+    smart_apply_stream(str(tmp_path), patches, "", args)
+    assert tree(tmp_path) == {"app.py": "a = 10\nb = 20\n"}
@@ -0,0 +1,77 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from gptdiff import transport
+from gptdiff.gptdiff import call_llm
+
+COMPLETION = {
+    "id": "cmpl-1", "object": "chat.completion", "created": 0, "model": "test-model",
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}, "finish_reason": "stop"}],
+    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+}
+
+
+class CompletionHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        type(self).connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = json.dumps(COMPLETION).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def completion_server():
+    handler = type("Handler", (CompletionHandler,), {"connections": 0})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1/", handler
+    server.shutdown()
+    transport.close_clients()
+
+
+def test_clients_are_shared_per_endpoint_and_key():
+    try:
+        a = transport.get_openai_client("http://localhost:1/v1/", "key-a")
+        assert transport.get_openai_client("http://localhost:1/v1/", "key-a") is a
+        assert transport.get_openai_client("http://localhost:1/v1/", "key-b") is not a
+        session = transport.get_requests_session("https://api.anthropic.com", "key-a")
+        assert transport.get_requests_session("https://api.anthropic.com", "key-a") is session
+    finally:
+        transport.close_clients()
+
+
+def test_configure_http_pool_replaces_clients(monkeypatch):
+    monkeypatch.setattr(transport, "_pool_size", None)
+    client = transport.get_openai_client("http://localhost:1/v1/", "key")
+    transport.configure_http_pool(4)
+    try:
+        assert transport.pool_size() == 4
+        assert transport.get_openai_client("http://localhost:1/v1/", "key") is not client
+    finally:
+        transport.configure_http_pool(None)
+
+
+def test_call_llm_reuses_keep_alive_connection(completion_server):
+    base_url, handler = completion_server
+    messages = [{"role": "user", "content": "hi"}]
+    for _ in range(5):
+        response = call_llm("key", base_url, "test-model", messages, max_tokens=10, temperature=0.0)
+        assert response.choices[0].message.content == "ok"
+    assert handler.connections == 1